@@ -0,0 +1,190 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+
+from src.machine.batch import engines
+from src.machine.machinery import simulation
+from src.translator.lex import RegexLexer, TokenType
+from src.translator.parse import Parser
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_THRESHOLD = 0.1
+
+
+# Program with its input; 'limit' bounds the executed instructions
+class Workload(namedtuple("Workload", "name source input limit")):
+    pass
+
+
+# Metric that got worse than the baseline by more than the threshold; 'change' is relative, negative for a slowdown
+class Regression(namedtuple("Regression", "metric baseline value change")):
+    pass
+
+
+def read_example(name: str, suffix: str):
+    with open(os.path.join(EXAMPLES_DIR, name, name + suffix), encoding="utf-8") as file:
+        return file.read()
+
+
+def euler1(_scale: int):
+    return Workload("euler1", read_example("prob1", ".js"), "", 100000)
+
+
+def hello_world(_scale: int):
+    return Workload("hello_world", read_example("hello_world", ".js"), "", 100000)
+
+
+def cat(scale: int):
+    text = "The quick brown fox jumps over the lazy dog 0123456789\n" * (400 * scale)
+    return Workload("cat", read_example("cat", ".js"), text, 10 * len(text) + 100)
+
+
+def nested_loops(scale: int):
+    source = f"int n = {10 * scale}\nint i = 0\nint j = 0\nint k = 0\nint s = 0\n" \
+             "while (i < n)\n\tj = 0\n\twhile (j < 20)\n\t\tk = 0\n\t\twhile (k < 20)\n" \
+             "\t\t\ts += i * j - k % 3\n\t\t\tk += 1\n\t\tendwhile\n\t\tj += 1\n\tendwhile\n\ti += 1\nendwhile\n" \
+             "print(s, int)\n"
+    return Workload("nested_loops", source, "", 10 ** 8)
+
+
+# A loop around one long block of assignments, so both the translator and the block engines get a large basic block
+def straight_line(scale: int):
+    statements = ["a = b % 97 + c", "b = c * 3 % 89 - d", "c = d + a % 13", "d = a - b % 7"]
+    body = "".join("\t" + statements[i % len(statements)] + "\n" for i in range(280))
+    source = f"int a = 1\nint b = 2\nint c = 3\nint d = 4\nint r = 0\nwhile (r < {20 * scale})\n{body}\tr += 1\n" \
+             "endwhile\nprint(a, int)\n"
+    return Workload("straight_line", source, "", 10 ** 8)
+
+
+workloads = {
+    "euler1": euler1,
+    "hello_world": hello_world,
+    "cat": cat,
+    "nested_loops": nested_loops,
+    "straight_line": straight_line
+}
+
+
+# Shortest of 'repeat' runs and the result of the last one
+def best_time(function, repeat: int):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def count_tokens(source: str):
+    lexer = RegexLexer(source)
+    count = 1
+    while lexer.get_token().kind != TokenType.EOF:
+        count += 1
+    return count
+
+
+def rate(amount: int, elapsed: float):
+    return amount / elapsed if elapsed else 0.0
+
+
+# Metrics of one workload: translator and engine throughputs, and the peak of memory allocated while the
+# program is translated and run by the interpreter
+def measure(workload: Workload, engine_names, repeat: int = 3):
+    metrics = {}
+    lex_time, tokens = best_time(lambda: count_tokens(workload.source), repeat)
+    parse_time, code = best_time(lambda: Parser(RegexLexer(workload.source)).program(), repeat)
+    metrics["lex_tokens_per_s"] = rate(tokens, lex_time)
+    metrics["parse_tokens_per_s"] = rate(tokens, parse_time)
+
+    input_buffer = list(workload.input) + ["\0"]
+    for name in engine_names:
+        elapsed, (_, ticks, instructions) = best_time(
+            lambda engine=engines[name]: simulation(list(input_buffer), code, workload.limit, engine), repeat)
+        metrics[name + ".instructions_per_s"] = rate(instructions, elapsed)
+        metrics[name + ".ticks_per_s"] = rate(ticks, elapsed)
+
+    tracemalloc.start()
+    try:
+        simulation(list(input_buffer), Parser(RegexLexer(workload.source)).program(), workload.limit)
+        metrics["peak_kib"] = tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+    return metrics
+
+
+# Flat {"workload.metric": value} results of the selected workloads
+def run_suite(workload_names=None, engine_names=None, repeat: int = 3, scale: int = 1):
+    results = {}
+    for name in workload_names or list(workloads):
+        for metric, value in measure(workloads[name](scale), engine_names or list(engines), repeat).items():
+            results[name + "." + metric] = value
+    return results
+
+
+# Rates must not drop and the peak memory must not grow by more than 'threshold'. Metrics missing on either side
+# are not compared.
+def compare(results: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD):
+    regressions = []
+    for metric, value in results.items():
+        expected = baseline.get(metric)
+        if not expected:
+            continue
+        change = (value - expected) / expected
+        worse = change > threshold if metric.endswith("peak_kib") else change < -threshold
+        if worse:
+            regressions.append(Regression(metric, expected, value, change))
+    return regressions
+
+
+def render_results(results: dict, baseline: dict):
+    lines = []
+    for metric, value in results.items():
+        line = f"{metric:45} {value:16.1f}"
+        if baseline.get(metric):
+            line += f" {baseline[metric]:16.1f} {100 * (value - baseline[metric]) / baseline[metric]:+7.1f}%"
+        lines.append(line)
+    return lines
+
+
+def main(args):
+    arg_parser = argparse.ArgumentParser(prog="benchmark.py")
+    arg_parser.add_argument("--workload", action="append", choices=list(workloads), help="default: all of them")
+    arg_parser.add_argument("--engine", action="append", choices=list(engines), help="default: all of them")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the best one counts")
+    arg_parser.add_argument("--scale", type=int, default=1, help="input and loop size multiplier")
+    arg_parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    arg_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                            help="allowed relative regression, 0.1 is 10%%")
+    arg_parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    options = arg_parser.parse_args(args)
+
+    results = run_suite(options.workload, options.engine, options.repeat, options.scale)
+    baseline = {}
+    if os.path.exists(options.baseline):
+        with open(options.baseline, encoding="utf-8") as file:
+            baseline = json.loads(file.read())
+
+    print("\n".join(render_results(results, baseline)))
+    regressions = compare(results, baseline, options.threshold)
+    for regression in regressions:
+        print(f"Regression: {regression.metric} {regression.baseline:.1f} -> {regression.value:.1f} "
+              f"({100 * regression.change:+.1f}%)")
+
+    if options.save_baseline:
+        with open(options.baseline, "w", encoding="utf-8") as file:
+            file.write(json.dumps(results, indent=4))
+    return regressions
+
+
+if __name__ == '__main__':
+    sys.exit(1 if main(sys.argv[1:]) else 0)
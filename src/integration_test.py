@@ -1,18 +1,37 @@
+import asyncio
 import contextlib
 import io
+import itertools
+import json
 import logging
 import os
+import re
 import tempfile
 
 import pytest
 
-from src.machine import machinery
-from src.translator import translate
+from src import benchmark, isa, pipeline
+from src import server as server_module
+from src.exceptions import MachineException, TranslationException
+from src.machine import batch, costs, machinery, result_cache, snapshot, tick_analyzer, vector
+from src.machine.config import PAGED_MEMORY_SIZE, make_geometry
+from src.machine.compiler import CompiledControlUnit
+from src.machine.fastforward import FastForwardControlUnit
+from src.machine.fusion import FusedControlUnit
+from src.machine.device import Device, MappedInputStream, OutputSink
+from src.machine.profiler import Profiler, region_of, render_report
+from src.machine.trace import Tracer, TraceLevel, IoLog, BufferRenderer, IO_OUTPUT
+from src.translator import optimize, translate
+from src.translator.cache import ENTRY_SUFFIX, TranslationCache
+from src.translator.lex import Lexer, RegexLexer, TokenType
+from src.translator.parse import Parser
 
 
 @pytest.mark.golden_test("golden/*.yml")
 def test_whole_by_golden(golden, caplog):
     caplog.set_level(logging.DEBUG)
+    # Without source locations, so that moving a logging call does not touch the goldens
+    caplog.handler.setFormatter(logging.Formatter("%(levelname)-8s %(name)s %(message)s"))
 
     with tempfile.TemporaryDirectory() as tmpdirname:
         source = os.path.join(tmpdirname, "source.js")
@@ -27,7 +46,7 @@ def test_whole_by_golden(golden, caplog):
         with contextlib.redirect_stdout(io.StringIO()) as stdout:
             translate.main([source, target])
             print("============================================================")
-            machinery.main([target, input_stream])
+            machinery.main([target, input_stream, "--io-log", "buffers"])
 
         with open(target, encoding="utf-8") as file:
             code = file.read()
@@ -35,3 +54,615 @@ def test_whole_by_golden(golden, caplog):
         assert code == golden.out["code"]
         assert stdout.getvalue() == golden.out["output"]
         assert caplog.text == golden.out["log"]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_object_file_by_golden(golden, tmp_path):
+    source = tmp_path / "source.js"
+    input_stream = tmp_path / "input.txt"
+    target = tmp_path / "target.o"
+    source.write_text(golden["source"], encoding="utf-8")
+    input_stream.write_text(golden["input"], encoding="utf-8")
+
+    with contextlib.redirect_stdout(io.StringIO()) as stdout:
+        translate.main(["--binary", str(source), str(target)])
+        print("============================================================")
+        machinery.main([str(target), str(input_stream)])
+
+    assert stdout.getvalue() == golden.out["output"]
+
+    parser = Parser(Lexer(golden["source"]))
+    parser.program()
+    assert isa.read_object(target, with_symbols=True).symbols == parser.symbols()
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_translation_cache_by_golden(golden, tmp_path, monkeypatch):
+    source = tmp_path / "source.js"
+    target = tmp_path / "target.json"
+    source.write_text(golden["source"], encoding="utf-8")
+    options = [str(source), str(target), "--cache-dir", str(tmp_path / "cache")]
+
+    with contextlib.redirect_stdout(io.StringIO()) as stdout:
+        translate.main(options)
+        # The lexer is part of the key
+        translate.main(options + ["--lexer", "char"])
+        assert len(list((tmp_path / "cache").iterdir())) == 2
+        target.unlink()
+        # A hit does not translate at all
+        monkeypatch.setattr(translate, "Parser", None)
+        translate.main(options)
+
+    assert target.read_text(encoding="utf-8") == golden.out["code"]
+    assert stdout.getvalue().splitlines() == golden.out["output"].splitlines()[:1] * 3
+
+
+def test_translation_cache_eviction(tmp_path):
+    cache = TranslationCache(str(tmp_path), max_size=400)
+    for index in range(5):
+        cache.store(str(index), b"x" * 100, {"instructions": index})
+        os.utime(tmp_path / (str(index) + ENTRY_SUFFIX), (index, index))
+    # Loading refreshes an entry, so it outlives newer ones
+    assert cache.load("2") == (b"x" * 100, {"instructions": 2})
+    cache.store("5", b"x" * 100, {"instructions": 5})
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["2.entry", "4.entry", "5.entry"]
+    assert cache.load("0") is None
+
+
+def test_scratch_cells_are_reused():
+    statement = "x = x % 7 * 2 + y * 3 - x % 5"
+    source = "int x = 1\nint y = 4\nif (x * 2 + 1 < y * y - x)\n" + (statement + "\n") * 60 + "endif\nprint(x, int)\n"
+    parser = Parser(Lexer(source))
+    code = parser.program()
+
+    x, y = 1, 4
+    for _ in range(60):
+        x = x % 7 * 2 + y * 3 - x % 5
+    assert [symbol for symbol in parser.symbols() if symbol.startswith("exp_op")] == ["exp_op1", "exp_op2"]
+    assert machinery.simulation(["\0"], code, 100000)[0] == [str(x)]
+
+
+def test_constant_folding():
+    source = "int n = 2 * 3 - 1\nint debug = 0\nint i = 0\nint s = 0\n{}while (i < n)\n" \
+             "s += i * 4 % 3 + n - 0\nif (debug != 0)\nprint(s, int)\nendif\ni += 1\nendwhile\nprint(s, int)\n"
+    folded = Parser(Lexer(source.format(""))).program()
+    # Assigning the variables keeps them from being known at compile time
+    plain = Parser(Lexer(source.format("n = n\ndebug = debug\n"))).program()
+
+    output, ticks, instructions = machinery.simulation(["\0"], folded, 100000)
+    plain_output, plain_ticks, plain_instructions = machinery.simulation(["\0"], plain, 100000)
+    assert output == plain_output == [str(sum(i * 4 % 3 + 5 for i in range(5)))]
+    assert len(folded) < len(plain)
+    assert ticks < plain_ticks
+    assert instructions < plain_instructions
+    assert isa.Opcode.BEQ not in [instr['opcode'] for instr in folded]
+
+
+def tokens(lexer):
+    while True:
+        token = lexer.get_token()
+        yield token.text, token.kind, token.line, token.column, token.end_column
+        if token.kind == TokenType.EOF:
+            return
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_regex_lexer_by_golden(golden):
+    source = golden["source"] + "\nWhile (x1 >= 2) // comment\nx1 %= 3\nENDWHILE\n"
+    assert list(tokens(RegexLexer(source))) == list(tokens(Lexer(source)))
+
+
+@pytest.mark.parametrize("source", ["x = 1.5", "x != !y", "s = \"a\tb\"", "x = \"ab", "x = 1 & 2"])
+def test_regex_lexer_errors(source):
+    with pytest.raises(TranslationException) as expected:
+        list(tokens(Lexer(source)))
+    with pytest.raises(TranslationException) as got:
+        list(tokens(RegexLexer(source)))
+    assert got.value.get_msg() == expected.value.get_msg()
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_source_map_by_golden(golden, tmp_path):
+    source = tmp_path / "source.js"
+    target = tmp_path / "target.json"
+    source.write_text(golden["source"], encoding="utf-8")
+    with contextlib.redirect_stdout(io.StringIO()):
+        translate.main([str(source), str(target), "--source-map"])
+
+    parser = Parser(Lexer(golden["source"]))
+    code = parser.program()
+    source_map, symbols = isa.read_source_map(str(target))
+    assert source_map == parser.source_map()
+    assert symbols == parser.symbols()
+
+    # Every cell but the scratch ones and the final HLT comes from a statement or a declaration
+    scratch = {addr for name, addr in symbols.items() if name.startswith("exp_op")}
+    assert set(source_map) == set(range(len(code) - 1)) - scratch
+    lines = golden["source"].split("\n")
+    for span in source_map.values():
+        text = lines[span.line - 1][span.column - 1:span.end_column]
+        assert span.line == span.end_line
+        assert re.match(r"(int|string|print|input|if|while)\b|\w+ *[-+*/%]?=", text, re.IGNORECASE)
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_optimizer_by_golden(golden):
+    code = Parser(Lexer(golden["source"])).program()
+    optimized, _ = optimize.optimize(Parser(Lexer(golden["source"])).program())
+    input_buffer = list(golden["input"]) + ["\0"]
+
+    output, ticks, instructions = machinery.simulation(list(input_buffer), code, 100000)
+    optimized_output, optimized_ticks, optimized_instructions = \
+        machinery.simulation(list(input_buffer), optimized, 100000)
+    assert optimized_output == output
+    assert len(optimized) <= len(code)
+    assert optimized_ticks <= ticks
+    assert optimized_instructions <= instructions
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_trace_ring_buffer_by_golden(golden):
+    code = Parser(Lexer(golden["source"])).program()
+    tracer = Tracer(TraceLevel.INSTRUCTION, capacity=16)
+    machinery.simulation(list(golden["input"]) + ["\0"], code, 100000, tracer=tracer)
+
+    logged = re.findall(r"^DEBUG +\S+ (.*)$", golden.out["log"], re.MULTILINE)
+    assert list(tracer.render()) == logged[-16:]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_streaming_device_by_golden(golden, tmp_path):
+    code = Parser(Lexer(golden["source"])).program()
+    output, ticks, instructions = machinery.simulation(list(golden["input"]) + ["\0"], code, 100000)
+
+    input_file = tmp_path / "input.txt"
+    input_file.write_text(golden["input"], encoding="utf-8")
+    output_file = tmp_path / "output.txt"
+    with open(output_file, "wb") as file:
+        input_stream = MappedInputStream(str(input_file), terminator="\0")
+        sink = OutputSink(file.fileno(), chunk_size=4)
+        assert machinery.simulation(input_stream, code, 100000, output=sink)[1:] == (ticks, instructions)
+        input_stream.close()
+
+    assert output_file.read_text(encoding="utf-8") == ''.join(output)
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_batch_by_golden(golden, tmp_path):
+    source = tmp_path / "source.js"
+    target = tmp_path / "target.o"
+    source.write_text(golden["source"], encoding="utf-8")
+    with contextlib.redirect_stdout(io.StringIO()):
+        translate.main(["--binary", str(source), str(target)])
+
+    code = Parser(Lexer(golden["source"])).program()
+    output, ticks, instructions = machinery.simulation(list(golden["input"]) + ["\0"], code, 100000)
+
+    inputs = [golden["input"]] * 4
+    report = batch.run_inputs(str(target), inputs, workers=2, engine=CompiledControlUnit)
+    expected = batch.JobResult(str(target), ''.join(output), ticks, instructions, None)
+    assert report.results == [expected] * 4
+    assert report.total_instructions() == 4 * instructions
+
+    report = batch.run_inputs(str(target), [golden["input"]], limit=instructions - 1, workers=1)
+    assert report.results[0].error == "Too long execution! Increase limit"
+
+    assert batch.fork_inputs(str(target), inputs).results == [expected] * 4
+
+
+def test_batch_failed_jobs(tmp_path):
+    source = tmp_path / "source.js"
+    target = tmp_path / "target.o"
+    source.write_text("int n = 0\ninput(n)\ninput(n)\nprint(n, string)\n", encoding="utf-8")
+    with contextlib.redirect_stdout(io.StringIO()):
+        translate.main(["--binary", str(source), str(target)])
+
+    # One job running out of input fails alone, in the pool and in forks
+    for report in (batch.run_inputs(str(target), ["", "a"], workers=2), batch.fork_inputs(str(target), ["", "a"])):
+        assert report.results[0] == batch.JobResult(str(target), None, None, None, "Buffer is empty")
+        assert report.results[1].error is None
+
+    # So does one failing in any other way, here on OUTC of a value that is not a character
+    source.write_text("int n = 0\ninput(n)\nn -= 100\nprint(n, string)\n", encoding="utf-8")
+    with contextlib.redirect_stdout(io.StringIO()):
+        translate.main(["--binary", str(source), str(target)])
+    for report in (batch.run_inputs(str(target), ["a", "z"], workers=1),
+                   batch.run_inputs(str(target), ["a", "z"], workers=2), batch.fork_inputs(str(target), ["a", "z"])):
+        assert report.results[0] == batch.JobResult(str(target), None, None, None, "chr() arg not in range(0x110000)")
+        assert report.results[1].output == chr(ord("z") - 100)
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_snapshot_by_golden(golden):
+    code = Parser(Lexer(golden["source"])).program()
+    input_buffer = list(golden["input"]) + ["\0"]
+    expected = machinery.simulation(list(input_buffer), code, 100000)
+
+    # Stopped in the middle of the run and finished on another engine
+    device = Device()
+    device.load(list(input_buffer))
+    control_unit = machinery.ControlUnit(code, device)
+    for _ in range(expected[2] // 2):
+        control_unit.decode_and_execute_instruction()
+    blob = snapshot.snapshot(control_unit, expected[2] // 2)
+    restored, instructions = snapshot.restore(blob, input_buffer[device.read_ind:], CompiledControlUnit)
+    assert repr(restored) == repr(control_unit)
+    instructions += restored.run(100000)
+    assert (restored.device.output, restored.tact, instructions) == expected
+
+    # Everything before the first read is shared by all forks
+    blob = snapshot.run_prefix(code, 100000)
+    results = snapshot.fork(blob, [input_buffer, ["\0"]], 100000)
+    assert results[0] == snapshot.ForkResult(*expected, None)
+    assert results[1] == snapshot.ForkResult(*machinery.simulation(["\0"], code, 100000), None)
+
+
+def test_fork_failed_inputs():
+    code = Parser(Lexer("int n = 0\ninput(n)\ninput(n)\nprint(n, string)\n")).program()
+    blob = snapshot.run_prefix(code, 100000)
+    results = snapshot.fork(blob, [["\0"], ["a", "\0"]], 100000)
+    assert results[0] == snapshot.ForkResult(None, None, None, "Buffer is empty")
+    assert results[1].error is None
+
+    # A fork failing in any other way keeps the results of the others
+    code = Parser(Lexer("int n = 0\ninput(n)\nn -= 100\nprint(n, string)\n")).program()
+    results = snapshot.fork(snapshot.run_prefix(code, 100000), [["a"], ["z"]], 100000)
+    assert results[0] == snapshot.ForkResult(None, None, None, "chr() arg not in range(0x110000)")
+    assert results[1].output == [chr(ord("z") - 100)]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_lockstep_by_golden(golden):
+    pytest.importorskip("numpy")
+    code = Parser(Lexer(golden["source"])).program()
+    inputs = [golden["input"], golden["input"][::-1], "", "x" * 10]
+
+    expected = []
+    for input_text in inputs:
+        try:
+            expected.append((*machinery.simulation(list(input_text) + ["\0"], code, 100000), None))
+        except (MachineException, EOFError) as exception:
+            expected.append(type(exception))
+
+    results = vector.simulate_lanes([list(input_text) + ["\0"] for input_text in inputs], code, 100000)
+    assert [tuple(result) if result.error is None else type(result.error) for result in results] == expected
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_profiler_by_golden(golden):
+    parser = Parser(Lexer(golden["source"]))
+    code = parser.program()
+    profiler = Profiler()
+    _, ticks, instructions = machinery.simulation(list(golden["input"]) + ["\0"], code, 100000, tracer=profiler)
+
+    assert profiler.instructions() == instructions
+    assert profiler.total_ticks() == ticks
+    assert sum(profiler.opcode_ticks.values()) == ticks
+    assert sum(profiler.writes) == profiler.opcode_counts.get(isa.code_by_opcode[isa.Opcode.ST], 0)
+    for pc, taken, not_taken in profiler.branches():
+        assert taken + not_taken == profiler.counts[pc]
+
+    regions = profiler.aggregate(region_of(parser.symbols()))
+    assert sum(count for count, _ in regions.values()) == instructions
+    report = render_report(profiler, parser.symbols())
+    assert report[0] == f"Profile: {instructions} instructions, {ticks} ticks"
+    assert "Regions:" in report
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_io_log_by_golden(golden):
+    code = Parser(Lexer(golden["source"])).program()
+    input_buffer = list(golden["input"]) + ["\0"]
+    io_log = IoLog()
+    output, _, _ = machinery.simulation(input_buffer, code, 100000, io_log=io_log)
+
+    assert [value for direction, _, value in io_log.events() if direction == IO_OUTPUT] == output
+    render = BufferRenderer(input_buffer)
+    logged = re.findall(r"^INFO +\S+ (.*)$", golden.out["log"], re.MULTILINE)
+    assert [render(*event) for event in io_log.events()] == logged
+
+
+@pytest.mark.parametrize("engine", [machinery.DispatchControlUnit, CompiledControlUnit, FastForwardControlUnit,
+                                    FusedControlUnit])
+@pytest.mark.golden_test("golden/*.yml")
+def test_engine_by_golden(golden, engine):
+    code = Parser(Lexer(golden["source"])).program()
+    input_buffer = list(golden["input"]) + ["\0"]
+
+    expected = machinery.simulation(list(input_buffer), code, 100000)
+    actual = machinery.simulation(list(input_buffer), code, 100000, engine=engine)
+    assert actual == expected
+
+    with pytest.raises(MachineException):
+        machinery.simulation(list(input_buffer), code, expected[2] - 1, engine=engine)
+
+
+@pytest.mark.parametrize("step, limit", [(3, 10 ** 6), (30000, 10 ** 6), (3, 200000)])
+def test_fast_forward_counted_loop(step, limit):
+    source = f"int i = 0\nint s = 7\nint t = 0\nwhile (i < 100000)\ns += {step}\nt = i * 4 - 7\nif (i == 500)\n" \
+             "s -= 1\nendif\ni += 1\nendwhile\nprint(s, int)\nprint(t, int)\n"
+    code = Parser(Lexer(source)).program()
+    try:
+        expected = machinery.simulation(["\0"], code, limit, engine=machinery.DispatchControlUnit)
+    except MachineException as exception:
+        expected = exception.get_msg()
+
+    device = Device()
+    device.load(["\0"])
+    control_unit = FastForwardControlUnit(code, device)
+    try:
+        instructions = control_unit.run(limit)
+        actual = (device.output, control_unit.tact, instructions)
+    except MachineException as exception:
+        actual = exception.get_msg()
+    assert actual == expected
+    assert control_unit.skipped > 0
+
+
+def test_benchmark_suite():
+    results = benchmark.run_suite(["euler1", "cat"], ["interpreter", "compiled"], repeat=1)
+    assert sorted(results) == sorted(workload + "." + metric for workload in ("euler1", "cat") for metric in (
+        "lex_tokens_per_s", "parse_tokens_per_s", "interpreter.instructions_per_s", "interpreter.ticks_per_s",
+        "compiled.instructions_per_s", "compiled.ticks_per_s", "peak_kib"))
+    assert all(value > 0 for value in results.values())
+
+    assert not benchmark.compare(results, results)
+    slower = {metric: value * 2 for metric, value in results.items()}
+    regressions = benchmark.compare(results, slower, threshold=0.1)
+    assert sorted(regression.metric for regression in regressions) == sorted(
+        metric for metric in results if not metric.endswith("peak_kib"))
+    assert all(regression.change == pytest.approx(-0.5) for regression in regressions)
+
+
+@pytest.mark.parametrize("engine", list(batch.engines.values()))
+def test_sparse_memory(engine):
+    geometry = make_geometry(10 ** 7, 64)
+    top = geometry.max_addr
+    code = [{'opcode': isa.Opcode.LD, 'arg': 2 ** 40, 'arg_mode': isa.AddressingMode.DIRECT},
+            {'opcode': isa.Opcode.ST, 'arg': top, 'arg_mode': isa.AddressingMode.ABSOLUTE},
+            {'opcode': isa.Opcode.CLA},
+            {'opcode': isa.Opcode.LD, 'arg': top, 'arg_mode': isa.AddressingMode.ABSOLUTE},
+            {'opcode': isa.Opcode.OUT},
+            {'opcode': isa.Opcode.HLT}]
+    device = Device()
+    device.load(["\0"])
+    control_unit = engine(code, device, geometry)
+    assert control_unit.run(100) == 5
+    assert device.output == [str(2 ** 40)]
+    # Only the pages of the program and of the written cell are there
+    assert control_unit.memory.allocated() == len(control_unit.memory) == 10 ** 7
+    assert len(control_unit.memory.args.pages) == 2
+
+
+def test_word_size():
+    source = "int x = 30000\nx += 30000\nprint(x, int)\n"
+    narrow = make_geometry(word_size=16)
+    assert machinery.simulation(["\0"], Parser(Lexer(source)).program(), 1000) == (["60000"], 17, 6)
+    with pytest.raises(MachineException) as error:
+        machinery.simulation(["\0"], Parser(Lexer(source), narrow).program(), 1000, geometry=narrow)
+    assert error.value.get_msg() == "Overflow error!"
+
+    # Snapshots keep the geometry
+    device = Device()
+    device.load(["\0"])
+    control_unit = machinery.ControlUnit(Parser(Lexer(source), narrow).program(), device, narrow)
+    control_unit, _ = snapshot.restore(snapshot.snapshot(control_unit), ["\0"])
+    assert control_unit.geometry == narrow
+    with pytest.raises(MachineException):
+        control_unit.run(1000)
+
+    with pytest.raises(TranslationException) as error:
+        Parser(Lexer(source), make_geometry(memory_size=4)).program()
+    assert error.value.get_msg() == "Program is too large: 7 words for a memory of 4"
+
+
+# Constants are checked against the word size when translated, whether the code uses them or not
+def test_constant_out_of_word_range():
+    source = "int x = 3000000000\nint y = 1\nprint(y, int)\n"
+    with pytest.raises(TranslationException) as error:
+        Parser(Lexer(source)).program()
+    assert error.value.get_msg() == "Constant 3000000000 does not fit into a word of 32 bits"
+    with pytest.raises(TranslationException):
+        Parser(Lexer("int y = 1\ny += 3000000000\n")).program()
+
+    wide = make_geometry(word_size=64)
+    assert machinery.simulation(["\0"], Parser(Lexer(source), wide).program(), 1000, geometry=wide)[0] == ["1"]
+
+
+def test_batch_geometry(tmp_path):
+    source = tmp_path / "source.js"
+    target = tmp_path / "target.o"
+    input_file = tmp_path / "input.txt"
+    source.write_text("int x = 30000\nx += 30000\nprint(x, int)\n", encoding="utf-8")
+    input_file.write_text("", encoding="utf-8")
+    with contextlib.redirect_stdout(io.StringIO()) as stdout:
+        translate.main(["--binary", str(source), str(target)])
+        batch.main([str(target), str(input_file), "--workers", "1"])
+        batch.main([str(target), str(input_file), "--workers", "1", "--word-size", "16"])
+        batch.main([str(target), str(input_file), "--fork", "--word-size", "16"])
+
+    lines = stdout.getvalue().splitlines()
+    assert lines[1] == f"{input_file}: Output: 60000, Instructions: 6, Ticks: 17"
+    assert lines[3] == lines[5] == f"{input_file}: Error: Overflow error!"
+
+
+def test_lockstep_geometry():
+    pytest.importorskip("numpy")
+    source = "int x = 30000\nx += 30000\nprint(x, int)\n"
+    narrow = make_geometry(word_size=16)
+    result, = vector.simulate_lanes([["\0"]], Parser(Lexer(source), narrow).program(), 1000, narrow)
+    assert result.error.get_msg() == "Overflow error!"
+
+    wide = make_geometry(PAGED_MEMORY_SIZE, 64)
+    result, = vector.simulate_lanes([["\0"]], Parser(Lexer(source), wide).program(), 1000, wide)
+    assert result == vector.LaneResult(["60000"], 17, 6, None)
+    # Lane memories are flat, so paged geometries are refused
+    paged = make_geometry(PAGED_MEMORY_SIZE + 1)
+    with pytest.raises(ValueError):
+        vector.simulate_lanes([["\0"]], Parser(Lexer(source), paged).program(), 1000, paged)
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_pipeline_by_golden(golden):
+    output, instructions, ticks = re.search(r"Output: (.*)\nInstructions: (\d+)\nTicks: (\d+)\n$", golden.out["output"],
+                                            re.DOTALL).groups()
+    code = Parser(Lexer(golden["source"])).program()
+    assert pipeline.compile_and_run(golden["source"], golden["input"]) == \
+        pipeline.RunResult(code, output, int(ticks), int(instructions), None)
+
+    result = pipeline.compile_and_run(golden["source"], golden["input"], engine=CompiledControlUnit, optimize=True)
+    assert result.output == output
+    assert pipeline.run_code(code, golden["input"], limit=int(instructions) - 1) == \
+        pipeline.RunResult(code, None, None, None, "Too long execution! Increase limit")
+    assert pipeline.compile_and_run("print(nope, int)\n" + golden["source"], golden["input"]) == pipeline.RunResult(
+        None, None, None, None, "Invalid operation - try to print not defined variable - nope")
+
+
+def test_pipeline_failed_runs():
+    result = pipeline.compile_and_run("int n = 0\ninput(n)\ninput(n)\n", "")
+    assert result.code is not None
+    assert result[1:] == (None, None, None, "Buffer is empty")
+    result = pipeline.compile_and_run("int n = 0\ninput(n)\nn -= 100\nprint(n, string)\n", "a")
+    assert result[1:] == (None, None, None, "chr() arg not in range(0x110000)")
+    # Running off the end of memory
+    code = [{'opcode': isa.Opcode.NOP}] * 2
+    assert pipeline.run_code(code, geometry=make_geometry(memory_size=2)).error == "bytearray index out of range"
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_server_by_golden(golden):
+    output, instructions, ticks = re.search(r"Output: (.*)\nInstructions: (\d+)\nTicks: (\d+)\n$", golden.out["output"],
+                                            re.DOTALL).groups()
+    endless = "int i = 0\nwhile (i == 0)\nprint(i, int)\nendwhile\n"
+
+    async def session(address):
+        reader, writer = await asyncio.open_connection(*address)
+        requests = [{"id": 1, "op": "run", "source": golden["source"], "input": golden["input"], "engine": "compiled"},
+                    {"id": 2, "op": "run", "source": endless, "limit": 10 ** 9},
+                    {"id": 3, "op": "run", "source": endless, "limit": 10 ** 9, "tick_limit": 1000},
+                    {"id": 4, "op": "compile", "source": golden["source"]},
+                    {"id": 5, "op": "frobnicate"}]
+        writer.write(b"".join(json.dumps(request).encode() + b"\n" for request in requests))
+        events = {}
+        # The endless run streams its output before it is cancelled
+        while 2 not in events:
+            event = json.loads(await reader.readline())
+            events.setdefault(event["id"], []).append(event)
+        writer.write(b'{"id": 2, "op": "cancel"}\n')
+        writer.write_eof()
+        async for line in reader:
+            event = json.loads(line)
+            events.setdefault(event["id"], []).append(event)
+        return events
+
+    async def scenario():
+        server = server_module.SimulationServer(workers=2)
+        try:
+            return await session(await server.start())
+        finally:
+            await server.close()
+
+    events = asyncio.run(scenario())
+    assert "".join(event["text"] for event in events[1][:-1]) == output
+    assert events[1][-1] == {"id": 1, "event": "result", "ticks": int(ticks), "instructions": int(instructions),
+                             "error": None}
+    assert set("".join(event["text"] for event in events[2][:-1])) == {"0"}
+    assert events[2][-1] == {"id": 2, "event": "result", "error": "Cancelled"}
+    assert events[3][-1] == {"id": 3, "event": "result", "error": "Tick limit exceeded"}
+    code = json.loads(json.dumps(Parser(Lexer(golden["source"])).program()))
+    assert events[4] == [{"id": 4, "event": "code", "code": code}]
+    assert events[5] == [{"id": 5, "event": "error", "error": "Unknown request"}]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_result_cache_by_golden(golden, tmp_path, monkeypatch):
+    cache = result_cache.ResultCache(str(tmp_path))
+    code = Parser(Lexer(golden["source"])).program()
+    result = pipeline.run_code(code, golden["input"], cache=cache)
+    too_long = pipeline.run_code(code, golden["input"], limit=result.instructions - 1, cache=cache)
+    assert too_long.error == "Too long execution! Increase limit"
+
+    # Hits do not run at all, whatever the engine
+    runs = []
+
+    def counted_simulation(*args, **kwargs):
+        runs.append(args)
+        return machinery.simulation(*args, **kwargs)
+
+    monkeypatch.setattr(result_cache, "simulation", counted_simulation)
+    assert pipeline.run_code(code, golden["input"], engine=FusedControlUnit, cache=cache) == result
+    assert pipeline.run_code(code, golden["input"], limit=result.instructions - 1, cache=cache) == too_long
+    assert not runs
+    pipeline.run_code(code, golden["input"] + "?", cache=cache)
+    assert len(runs) == 1
+
+    # Every engine a result can come from is part of the key
+    engine_sources = {engine.__module__[len("src."):].replace(".", "/") + ".py" for engine in batch.engines.values()}
+    assert engine_sources <= set(result_cache.machine_sources)
+
+
+# The cost tables give the ticks ControlUnit counts step by step, for every instruction, mode and branch outcome
+# One instruction of every opcode and mode after a load of -1, 0 or 1, so branches go both ways
+def tick_cost_cases():
+    for opcode, arg_mode, value in itertools.product(
+            [opcode for opcode in isa.Opcode if opcode is not isa.Opcode.HLT], isa.AddressingMode, (-1, 0, 1)):
+        arg = {isa.AddressingMode.DIRECT: value, isa.AddressingMode.ABSOLUTE: 9, isa.AddressingMode.RELATIVE: 8}
+        code = [{'opcode': isa.Opcode.LD, 'arg': value, 'arg_mode': isa.AddressingMode.DIRECT},
+                {'opcode': opcode, 'arg': arg[arg_mode], 'arg_mode': arg_mode}] + [{'opcode': isa.Opcode.HLT}] * 6 + \
+               [{'opcode': isa.Opcode.DATA, 'arg': 9, 'arg_mode': isa.AddressingMode.DIRECT},
+                {'opcode': isa.Opcode.DATA, 'arg': value, 'arg_mode': isa.AddressingMode.DIRECT}]
+        yield opcode, arg_mode, code
+
+
+def test_tick_costs():
+    for opcode, arg_mode, code in tick_cost_cases():
+        device = Device()
+        device.load(["a"])
+        control_unit = machinery.ControlUnit(code, device)
+        control_unit.decode_and_execute_instruction()
+        # Failing instructions (division by zero, chr of a negative value) are left out
+        with contextlib.suppress(MachineException, ValueError):
+            control_unit.decode_and_execute_instruction()
+            taken = control_unit.program_counter != 2
+            assert control_unit.tact - 3 == costs.instruction_ticks(opcode, arg_mode, taken)
+
+
+# The lockstep engine counts ticks with the same tables
+def test_lockstep_tick_costs():
+    pytest.importorskip("numpy")
+    for _, _, code in tick_cost_cases():
+        result, = vector.simulate_lanes([["a"]], code, 10)
+        if result.error is None:
+            assert result.ticks == machinery.simulation(["a"], code, 10)[1]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_tick_analyzer_by_golden(golden, tmp_path):
+    instructions, ticks = map(int, re.search(r"Instructions: (\d+)\nTicks: (\d+)\n$", golden.out["output"]).groups())
+    code = Parser(Lexer(golden["source"])).program()
+    report = tick_analyzer.analyze(code)
+    # Loops that end on data get the instruction count of the run as a bound, which is never too small
+    bounds = {loop.header: instructions for loop in report.loops if loop.bound is None}
+    if bounds:
+        assert report.worst_case is None
+        report = tick_analyzer.analyze(code, bounds)
+    assert report.worst_case >= ticks
+
+    code_file = tmp_path / "code.json"
+    isa.write_code(code_file, code)
+    with contextlib.redirect_stdout(io.StringIO()) as stdout:
+        tick_analyzer.main([str(code_file)] + [f"--bound={header}={bound}" for header, bound in bounds.items()])
+    assert stdout.getvalue().splitlines() == tick_analyzer.render_costs(report)
+
+
+def test_tick_analyzer_counted_loop():
+    source = "int i = 0\nint s = 0\nint j = 0\nwhile (i < 10)\ns += i\nj = 3\nwhile (j > 0)\nj -= 1\nendwhile\n" \
+             "i += 1\nendwhile\nprint(s, int)\n"
+    parser = Parser(Lexer(source))
+    code = parser.program()
+    report = tick_analyzer.analyze(code)
+    assert [(loop.header, loop.bound, loop.inferred) for loop in report.loops] == [
+        (parser.symbols()["loop1"], 10, True), (parser.symbols()["loop2"], 3, True)]
+    # Every run takes the same path, so the worst case is exact
+    assert report.worst_case == machinery.simulation(["\0"], code, 10000)[1]
@@ -1,5 +1,9 @@
 import enum
 import json
+import mmap
+import struct
+import sys
+from array import array
 from collections import namedtuple
 
 
@@ -47,13 +51,51 @@ class AddressingMode(str, enum.Enum):
     RELATIVE = "RELATIVE"
 
 
+# Compact numeric codes used by array-backed memory; DATA must stay code 0 so zeroed memory reads as data
+opcode_by_code = list(Opcode)
+code_by_opcode = {opcode: code for code, opcode in enumerate(opcode_by_code)}
+
+# Mode code 0 marks an instruction without an argument
+mode_by_code = [None] + list(AddressingMode)
+code_by_mode = {mode: code for code, mode in enumerate(mode_by_code)}
+
+
 class Term(namedtuple("Term", "opcode arg arg_mode")):
     """Instruction description"""
 
 
-def write_code(filename, code):
+# Source text an instruction or data cell comes from: lines and columns counted from 1, the end column included
+class SourceSpan(namedtuple("SourceSpan", "line column end_line end_column")):
+    pass
+
+
+# Source maps are kept aside from the program, in a JSON file next to it
+def source_map_file(filename):
+    return filename + ".map"
+
+
+def write_code(filename, code, source_map=None, symbols=None):
     with open(filename, "w", encoding="utf-8") as file:
         file.write(json.dumps(code, indent=4))
+    if source_map is not None:
+        write_source_map(filename, source_map, symbols)
+
+
+# 'source_map' maps addresses to SourceSpan, 'symbols' names to addresses
+def write_source_map(filename, source_map, symbols=None):
+    table = {
+        "spans": [[addr, *span] for addr, span in sorted(source_map.items())],
+        "symbols": symbols if symbols is not None else {}
+    }
+    with open(source_map_file(filename), "w", encoding="utf-8") as file:
+        file.write(json.dumps(table))
+
+
+# Source map of a program file as ({address: SourceSpan}, {name: address})
+def read_source_map(filename):
+    with open(source_map_file(filename), encoding="utf-8") as file:
+        table = json.loads(file.read())
+    return {addr: SourceSpan(*span) for addr, *span in table["spans"]}, table["symbols"]
 
 
 def read_code(filename):
@@ -66,3 +108,96 @@ def read_code(filename):
             instr['arg_mode'] = AddressingMode(instr['arg_mode'])
 
     return code
+
+
+# Binary object file: a header, fixed-width little-endian records (opcode code, mode code, reserved, 32-bit arg)
+# and optional tagged sections, e.g. the symbol table
+OBJECT_MAGIC = b"AL3O"
+OBJECT_VERSION = 1
+object_header = struct.Struct("<4sHHI")
+object_record = struct.Struct("<BBhi")
+object_section = struct.Struct("<4sI")
+object_symbol = struct.Struct("<iH")
+SYMBOLS_TAG = b"SYMS"
+
+
+# Program loaded from an object file, kept as raw columns that the machine memory copies in one go
+class ObjectImage:
+
+    def __init__(self, opcodes: bytes, modes: bytes, args: array, symbols: dict = None):
+        self.opcodes = opcodes
+        self.modes = modes
+        self.args = args
+        self.symbols = symbols if symbols is not None else {}
+
+    def __len__(self):
+        return len(self.opcodes)
+
+
+def is_object_file(filename):
+    with open(filename, "rb") as file:
+        return file.read(len(OBJECT_MAGIC)) == OBJECT_MAGIC
+
+
+def write_object(filename, code, symbols=None):
+    records = bytearray(object_header.pack(OBJECT_MAGIC, OBJECT_VERSION, 0, len(code)))
+    for instr in code:
+        if 'arg' in instr:
+            records += object_record.pack(code_by_opcode[instr['opcode']], code_by_mode[instr['arg_mode']], 0,
+                                          instr['arg'])
+        else:
+            records += object_record.pack(code_by_opcode[instr['opcode']], 0, 0, 0)
+
+    if symbols:
+        table = bytearray()
+        for name, addr in symbols.items():
+            encoded = name.encode("utf-8")
+            table += object_symbol.pack(addr, len(encoded)) + encoded
+        records += object_section.pack(SYMBOLS_TAG, len(table)) + table
+
+    with open(filename, "wb") as file:
+        file.write(records)
+
+
+def _read_symbols(view, offset):
+    symbols = {}
+    while offset < len(view):
+        tag, size = object_section.unpack_from(view, offset)
+        offset += object_section.size
+        if tag == SYMBOLS_TAG:
+            pos = offset
+            while pos < offset + size:
+                addr, length = object_symbol.unpack_from(view, pos)
+                pos += object_symbol.size
+                symbols[bytes(view[pos:pos + length]).decode("utf-8")] = addr
+                pos += length
+        offset += size
+    return symbols
+
+
+# Records are split into columns with strided slices of the mapped file, without touching single instructions
+def read_object(filename, with_symbols=False):
+    with open(filename, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as view:
+            magic, version, _, count = object_header.unpack_from(view)
+            if magic != OBJECT_MAGIC or version != OBJECT_VERSION:
+                raise ValueError("Unsupported object file: " + filename)
+
+            end = object_header.size + count * object_record.size
+            with view[object_header.size:end] as records:
+                opcodes = bytes(records[0::object_record.size])
+                modes = bytes(records[1::object_record.size])
+                args = array("i")
+                with records.cast("i") as words:
+                    args.frombytes(words[1::2].tobytes())
+            if sys.byteorder == "big":
+                args.byteswap()
+
+            symbols = _read_symbols(view, end) if with_symbols else None
+
+    return ObjectImage(opcodes, modes, args, symbols)
+
+
+# Either format, told apart by the magic number
+def load_program(filename):
+    return read_object(filename) if is_object_file(filename) else read_code(filename)
@@ -0,0 +1,169 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+
+import argparse
+import concurrent.futures
+import functools
+import sys
+import time
+from collections import namedtuple
+
+from src.isa import load_program
+from src.machine.config import DEFAULT_GEOMETRY, Geometry, add_geometry_arguments, parse_geometry
+from src.machine.compiler import CompiledControlUnit
+from src.machine.fastforward import FastForwardControlUnit
+from src.machine.fusion import FusedControlUnit
+from src.machine.machinery import ControlUnit, DispatchControlUnit, run_error_message, run_errors, simulation
+from src.machine.result_cache import ResultCache, memoized_simulation
+from src.machine.snapshot import fork, run_prefix
+from src.machine.trace import Tracer, TraceLevel
+
+engines = {
+    "interpreter": ControlUnit,
+    "dispatch": DispatchControlUnit,
+    "compiled": CompiledControlUnit,
+    "fastforward": FastForwardControlUnit,
+    "fused": FusedControlUnit
+}
+
+
+# Outcome of one (program, input) job; 'error' holds the message of the error a failed run ended with
+class JobResult(namedtuple("JobResult", "code_file output ticks instructions error")):
+    pass
+
+
+class BatchReport:
+
+    def __init__(self, results: list, elapsed: float):
+        self.results = results
+        self.elapsed = elapsed
+
+    def total_instructions(self):
+        return sum(result.instructions for result in self.results if result.error is None)
+
+    def total_ticks(self):
+        return sum(result.ticks for result in self.results if result.error is None)
+
+    def jobs_per_second(self):
+        return len(self.results) / self.elapsed if self.elapsed else 0.0
+
+    def instructions_per_second(self):
+        return self.total_instructions() / self.elapsed if self.elapsed else 0.0
+
+
+# Per-process state: every worker loads the programs once, jobs only carry a program index and the input text
+_worker = {}
+
+
+def _init_worker(code_files: tuple, limit: int, engine, cache: ResultCache = None,
+                 geometry: Geometry = DEFAULT_GEOMETRY):
+    _worker['code_files'] = code_files
+    _worker['programs'] = [load_program(code_file) for code_file in code_files]
+    _worker['limit'] = limit
+    _worker['engine'] = engine
+    _worker['cache'] = cache
+    _worker['geometry'] = geometry
+
+
+def _run_job(job: tuple):
+    program_index, input_text = job
+    code_file = _worker['code_files'][program_index]
+    # Batches are about throughput, so worker runs are never traced whatever the logging level is
+    tracer = Tracer(TraceLevel.OFF)
+    run = simulation if _worker['cache'] is None else functools.partial(memoized_simulation, _worker['cache'])
+    try:
+        output, ticks, instructions = run(list(input_text) + ["\0"], _worker['programs'][program_index],
+                                          _worker['limit'], engine=_worker['engine'], tracer=tracer,
+                                          geometry=_worker['geometry'])
+    except run_errors as exception:
+        return JobResult(code_file, None, None, None, run_error_message(exception))
+    return JobResult(code_file, ''.join(output), ticks, instructions, None)
+
+
+# Runs (code_file, input_text) jobs across a process pool; results keep the order of the jobs.
+# With a single worker everything runs in the calling process. With a result cache, jobs that were run before are
+# answered from it.
+def run_batch(jobs, limit: int = 100000, workers: int = None, engine=ControlUnit, chunksize: int = 8,
+              cache: ResultCache = None, geometry: Geometry = DEFAULT_GEOMETRY):
+    code_files = []
+    indexed_jobs = []
+    for code_file, input_text in jobs:
+        if code_file not in code_files:
+            code_files.append(code_file)
+        indexed_jobs.append((code_files.index(code_file), input_text))
+
+    start = time.perf_counter()
+    if workers == 1:
+        _init_worker(tuple(code_files), limit, engine, cache, geometry)
+        results = [_run_job(job) for job in indexed_jobs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                    initargs=(tuple(code_files), limit, engine, cache,
+                                                              geometry)) as executor:
+            results = list(executor.map(_run_job, indexed_jobs, chunksize=chunksize))
+    return BatchReport(results, time.perf_counter() - start)
+
+
+def run_inputs(code_file, inputs, **options):
+    return run_batch([(code_file, input_text) for input_text in inputs], **options)
+
+
+# Runs the part of the program that does not depend on the input once and forks its snapshot for every input,
+# in the calling process
+def fork_inputs(code_file, inputs, limit: int = 100000, engine=ControlUnit, geometry: Geometry = DEFAULT_GEOMETRY):
+    start = time.perf_counter()
+    try:
+        blob = run_prefix(load_program(code_file), limit, engine=engine, geometry=geometry)
+    except run_errors as exception:
+        results = [JobResult(code_file, None, None, None, run_error_message(exception)) for _ in inputs]
+        return BatchReport(results, time.perf_counter() - start)
+
+    results = []
+    for result in fork(blob, [list(input_text) + ["\0"] for input_text in inputs], limit, engine):
+        output = ''.join(result.output) if result.error is None else None
+        results.append(JobResult(code_file, output, result.ticks, result.instructions, result.error))
+    return BatchReport(results, time.perf_counter() - start)
+
+
+def main(args):
+    arg_parser = argparse.ArgumentParser(prog="batch.py")
+    arg_parser.add_argument("code_file")
+    arg_parser.add_argument("input_files", nargs="+")
+    arg_parser.add_argument("--workers", type=int, default=None)
+    arg_parser.add_argument("--limit", type=int, default=100000)
+    arg_parser.add_argument("--engine", choices=list(engines), default="interpreter")
+    arg_parser.add_argument("--fork", action="store_true",
+                            help="run the input-independent prefix once and fork it in this process")
+    arg_parser.add_argument("--result-cache", metavar="DIR",
+                            help="answer jobs that were run before from a result cache in DIR, and record new ones")
+    add_geometry_arguments(arg_parser)
+    options = arg_parser.parse_args(args)
+    geometry = parse_geometry(arg_parser, options)
+
+    inputs = []
+    for input_file in options.input_files:
+        with open(input_file, encoding="utf-8") as file:
+            inputs.append(file.read())
+
+    if options.fork:
+        report = fork_inputs(options.code_file, inputs, limit=options.limit, engine=engines[options.engine],
+                             geometry=geometry)
+    else:
+        cache = ResultCache(options.result_cache) if options.result_cache is not None else None
+        report = run_inputs(options.code_file, inputs, limit=options.limit, workers=options.workers,
+                            engine=engines[options.engine], cache=cache, geometry=geometry)
+    for input_file, result in zip(options.input_files, report.results):
+        if result.error is not None:
+            print(f"{input_file}: Error: {result.error}")
+        else:
+            print(f"{input_file}: Output: {result.output}, Instructions: {result.instructions}, "
+                  f"Ticks: {result.ticks}")
+    print(f"Jobs: {len(report.results)}, Elapsed: {report.elapsed:.3f}s, "
+          f"Jobs/s: {report.jobs_per_second():.1f}, Instructions/s: {report.instructions_per_second():.0f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,329 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=too-many-instance-attributes
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+
+import functools
+
+from src.exceptions import MachineException
+from src.isa import Opcode, AddressingMode
+from src.machine.config import DEFAULT_GEOMETRY, Geometry
+from src.machine.costs import LOOP_SKIP_TICKS, execute_ticks, operand_ticks
+from src.machine.device import Device
+from src.machine.machinery import DispatchControlUnit, opcode_to_alu_operation, alu_zero_errors
+from src.machine.memory import cell_table, flag_table
+from src.machine.trace import Tracer, TraceLevel
+
+MAX_BLOCK_LENGTH = 512
+
+branch_opcodes = (Opcode.JUMP, Opcode.LOOP, Opcode.BEQ, Opcode.BNE, Opcode.BGE, Opcode.BLE, Opcode.BL, Opcode.BG)
+
+# Python condition on the local flag variables for every conditional branch
+branch_conditions = {
+    Opcode.BEQ: "z",
+    Opcode.BNE: "not z",
+    Opcode.BGE: "not n",
+    Opcode.BLE: "z or n",
+    Opcode.BL: "n",
+    Opcode.BG: "not (z or n)"
+}
+
+alu_operators = {
+    Opcode.ADD: "+",
+    Opcode.SUB: "-",
+    Opcode.MUL: "*",
+    Opcode.DIV: "//",
+    Opcode.MOD: "%"
+}
+
+# Word bounds come from the namespace of the engine, so blocks compile the same for every geometry
+OVERFLOW_CHECK = "if {0} > MAX_WORD or {0} < MIN_WORD: raise MachineException('Overflow error!')"
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_block_source(source: str):
+    return compile(source, "<block>", "exec")
+
+
+# Generates Python source for one basic block. Registers live in locals for the whole block and are written back
+# once before the exit; the tick counter is advanced by a precomputed delta per exit.
+class BlockBuilder:
+
+    def __init__(self, start: int):
+        self.start = start
+        self.lines = []
+        self.exit = []
+        self.ticks = 0
+        self.loads = set()
+        self.stores = set()
+        self.flags_set = False
+
+    def emit(self, line: str):
+        self.lines.append(line)
+
+    def use_acc(self):
+        if 'acc' not in self.stores:
+            self.loads.add('acc')
+
+    def set_flags_from(self, name: str):
+        self.emit(f"f = {name}")
+        self.flags_set = True
+
+    # Emits the operand fetch into 'lines' and returns its tick count
+    def fetch(self, lines: list, arg: int, arg_mode: AddressingMode, indent: str = ""):
+        if arg_mode == AddressingMode.DIRECT:
+            lines.append(f"{indent}dr = {arg}")
+            return operand_ticks[arg_mode]
+        if arg_mode == AddressingMode.ABSOLUTE:
+            lines.append(f"{indent}ar = {arg}")
+            lines.append(f"{indent}dr = read({arg})")
+            return operand_ticks[arg_mode]
+        lines.append(f"{indent}ar = read({arg})")
+        lines.append(f"{indent}dr = read(ar)")
+        return operand_ticks[AddressingMode.RELATIVE]
+
+    def body_fetch(self, arg: int, arg_mode: AddressingMode):
+        self.stores.add('dr')
+        if arg_mode != AddressingMode.DIRECT:
+            self.stores.add('ar')
+        return self.fetch(self.lines, arg, arg_mode)
+
+    # Exit fetches write their registers back themselves, since they happen after the common write-back
+    def exit_fetch(self, arg: int, arg_mode: AddressingMode, indent: str = ""):
+        ticks = self.fetch(self.exit, arg, arg_mode, indent)
+        self.exit.append(f"{indent}cu.data_reg = dr")
+        if arg_mode != AddressingMode.DIRECT:
+            self.exit.append(f"{indent}cu.addr_reg = ar")
+        return ticks
+
+    # Adds one instruction; returns False when it ends the block
+    def add(self, addr: int, opcode: Opcode, arg: int, arg_mode: AddressingMode):
+        if opcode in branch_opcodes:
+            self.add_branch(addr, opcode, arg, arg_mode)
+            return False
+        self.ticks += execute_ticks[opcode]
+
+        if opcode is Opcode.LD:
+            self.ticks += self.body_fetch(arg, arg_mode)
+            self.emit(OVERFLOW_CHECK.format("dr"))
+            self.emit("acc = dr")
+            self.stores.add('acc')
+            self.set_flags_from("acc")
+
+        elif opcode is Opcode.ST:
+            self.use_acc()
+            self.stores.add('ar')
+            self.emit(f"ar = {arg}")
+            self.emit(f"write({arg}, acc)")
+            self.emit(f"handlers[{arg}] = undecoded")
+            self.emit(f"if covered[{arg}]: invalidate({arg})")
+
+        elif opcode in opcode_to_alu_operation:
+            self.use_acc()
+            self.ticks += self.body_fetch(arg, arg_mode)
+            zero_error = alu_zero_errors.get(opcode_to_alu_operation[opcode])
+            if zero_error:
+                self.emit(f"if not dr: raise MachineException({zero_error!r})")
+            if opcode is Opcode.CMP:
+                self.emit("res = acc - dr")
+                self.emit(OVERFLOW_CHECK.format("res"))
+                self.set_flags_from("res")
+            else:
+                self.emit(f"acc = acc {alu_operators[opcode]} dr")
+                self.emit(OVERFLOW_CHECK.format("acc"))
+                self.stores.add('acc')
+                self.set_flags_from("acc")
+
+        elif opcode in (Opcode.INC, Opcode.DEC, Opcode.NEG):
+            self.use_acc()
+            self.stores.update(('acc', 'dr'))
+            self.emit("dr = 1" if opcode is Opcode.INC else "dr = -1")
+            self.emit("acc = acc * dr" if opcode is Opcode.NEG else "acc = acc + dr")
+            self.emit(OVERFLOW_CHECK.format("acc"))
+            self.set_flags_from("acc")
+
+        elif opcode is Opcode.CLA:
+            self.stores.add('acc')
+            self.emit("acc = 0")
+
+        elif opcode is Opcode.IN:
+            self.stores.add('acc')
+            self.emit("acc = int(read_input())")
+
+        elif opcode in (Opcode.OUTC, Opcode.OUT):
+            self.use_acc()
+            self.emit("write_output(chr(acc))" if opcode is Opcode.OUTC else "write_output(str(acc))")
+        return True
+
+    def add_branch(self, addr: int, opcode: Opcode, arg: int, arg_mode: AddressingMode):
+        ticks = self.ticks + execute_ticks[opcode]
+        if opcode is Opcode.JUMP:
+            fetch_ticks = self.exit_fetch(arg, arg_mode)
+            self.exit.append("cu.program_counter = dr")
+            self.exit.append(f"cu.tact += {ticks + fetch_ticks}")
+
+        elif opcode is Opcode.LOOP:
+            fetch_ticks = self.exit_fetch(arg, arg_mode)
+            self.exit.append("if dr > 0:")
+            self.exit.append(f"    cu.program_counter = {addr + 2}")
+            self.exit.append(f"    cu.tact += {ticks + fetch_ticks + LOOP_SKIP_TICKS}")
+            self.exit.append("else:")
+            self.exit.append(f"    cu.program_counter = {addr + 1}")
+            self.exit.append(f"    cu.tact += {ticks + fetch_ticks}")
+
+        else:
+            if not self.flags_set:
+                self.loads.add('flags')
+            self.exit.append(f"if {branch_conditions[opcode]}:")
+            fetch_ticks = self.exit_fetch(arg, arg_mode, "    ")
+            self.exit.append("    cu.program_counter = dr")
+            self.exit.append(f"    cu.tact += {ticks + fetch_ticks}")
+            self.exit.append("else:")
+            self.exit.append(f"    cu.program_counter = {addr + 1}")
+            self.exit.append(f"    cu.tact += {ticks}")
+
+    # Exit for a block that falls through into the next cell
+    def finish(self, next_addr: int):
+        self.exit.append(f"cu.program_counter = {next_addr}")
+        self.exit.append(f"cu.tact += {self.ticks}")
+
+    def source(self):
+        prologue = []
+        if 'acc' in self.loads:
+            prologue.append("acc = cu.acc")
+        if 'flags' in self.loads:
+            prologue.append("z = cu.zero_flag")
+            prologue.append("n = cu.negative_flag")
+
+        epilogue = []
+        if 'acc' in self.stores:
+            epilogue.append("cu.acc = acc")
+        if 'dr' in self.stores:
+            epilogue.append("cu.data_reg = dr")
+        if 'ar' in self.stores:
+            epilogue.append("cu.addr_reg = ar")
+        if self.flags_set:
+            epilogue.append("z = f == 0")
+            epilogue.append("n = f < 0")
+            epilogue.append("cu.zero_flag = z")
+            epilogue.append("cu.negative_flag = n")
+
+        lines = [f"def block_{self.start}():"]
+        lines += ["    " + line for line in prologue + self.lines + epilogue + self.exit]
+        return "\n".join(lines) + "\n"
+
+
+# Compiled engine: straight-line runs between branches are turned into generated Python functions and cached.
+# A block is dropped when ST writes into one of its cells; such cells are interpreted from then on.
+class CompiledControlUnit(DispatchControlUnit):
+
+    def __init__(self, program: list, device: Device, geometry: Geometry = DEFAULT_GEOMETRY):
+        super().__init__(program, device, geometry)
+        self.blocks = cell_table(self.memory, None)
+        self.block_ends = {}
+        self.covered = flag_table(self.memory)
+        self.interpret_only = flag_table(self.memory)
+        self.leaders = self.__find_leaders(len(program))
+        self.namespace = {
+            'cu': self,
+            'read': self.memory.read,
+            'write': self.memory.write,
+            'invalidate': self.invalidate,
+            'handlers': self.handlers,
+            'undecoded': self.undecoded,
+            'covered': self.covered,
+            'read_input': self.read_input,
+            'write_output': self.write_output,
+            'MachineException': MachineException,
+            'MAX_WORD': self.max_word,
+            'MIN_WORD': self.min_word
+        }
+
+    def __find_leaders(self, program_size: int):
+        leaders = set()
+        for addr in range(program_size):
+            opcode, arg, arg_mode = self.memory.fetch(addr)
+            if opcode in branch_opcodes and opcode is not Opcode.LOOP and arg_mode == AddressingMode.DIRECT:
+                leaders.add(arg)
+            elif opcode is Opcode.LOOP:
+                leaders.add(addr + 2)
+        return leaders
+
+    def invalidate(self, addr: int):
+        super().invalidate(addr)
+        if self.covered[addr]:
+            self.covered[addr] = 0
+            self.interpret_only[addr] = 1
+            for start, end in list(self.block_ends.items()):
+                if start <= addr <= end:
+                    self.blocks[start] = None
+                    del self.block_ends[start]
+
+    # Returns (function, instruction count), or False when the cell has to be interpreted
+    def compile_block(self, start: int):
+        builder = BlockBuilder(start)
+        size = len(self.memory)
+        terminated = False
+        addr = start
+        while addr < size and addr - start < MAX_BLOCK_LENGTH and not self.interpret_only[addr]:
+            if addr != start and addr in self.leaders:
+                break
+            opcode, arg, arg_mode = self.memory.fetch(addr)
+            if opcode is Opcode.HLT:
+                break
+            addr += 1
+            if not builder.add(addr - 1, opcode, arg, arg_mode):
+                terminated = True
+                break
+            # A store into a later cell of this very block would leave the rest of the block stale
+            if opcode is Opcode.ST and addr <= arg < addr + MAX_BLOCK_LENGTH:
+                break
+
+        if addr == start:
+            return False
+        if not terminated:
+            builder.finish(addr)
+
+        namespace = self.namespace
+        exec(compile_block_source(builder.source()), namespace)  # pylint: disable=exec-used
+        block = (namespace.pop(f"block_{start}"), addr - start)
+
+        self.blocks[start] = block
+        self.block_ends[start] = addr - 1
+        self.covered[start:addr] = b"\x01" * (addr - start)
+        return block
+
+    def run(self, limit: int, tracer: Tracer = None):
+        # Trace records need the state before single instructions, which blocks do not materialize
+        if tracer is not None and tracer.level != TraceLevel.OFF:
+            return super().run(limit, tracer)
+
+        blocks = self.blocks
+        handlers = self.handlers
+        size = len(blocks)
+        instr_counter = 0
+        try:
+            while True:
+                pc = self.program_counter
+                # Out-of-range addresses are left to the interpreter, which checks the limit before failing on them
+                block = blocks[pc] if 0 <= pc < size else False
+                # Close to the limit blocks could not be used anyway, so nothing new is compiled
+                if block is None and instr_counter + MAX_BLOCK_LENGTH <= limit:
+                    block = self.compile_block(pc)
+                    if not block:
+                        blocks[pc] = False
+
+                if block and instr_counter + block[1] <= limit + 1:
+                    block[0]()
+                    instr_counter += block[1]
+                else:
+                    if instr_counter > limit:
+                        raise MachineException('Too long execution! Increase limit')
+                    handlers[pc]()
+                    instr_counter += 1
+        except StopIteration:
+            pass
+
+        return instr_counter
@@ -1,3 +1,10 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+import argparse
+from collections import namedtuple
+
 START_ADDR = 0
 
 MEMORY_SIZE = 2048
@@ -6,3 +13,55 @@ WORD_INIT = 0
 MAX_WORD = int(2 ** (WORD_SIZE - 1) - 1)
 MIN_WORD = int(-2 ** (WORD_SIZE - 1))
 MAX_ADDR = MEMORY_SIZE - 1
+
+# Word sizes a machine can be configured with: characters have to fit, and words are kept in 64-bit arrays at most
+MIN_WORD_SIZE = 8
+MAX_WORD_SIZE = 64
+# Memories larger than this are paged: a page is only allocated when one of its cells is written
+PAGED_MEMORY_SIZE = 1 << 16
+PAGE_SIZE = 1 << 12
+
+
+# Address space of a machine: number of memory words and bits per word
+class Geometry(namedtuple("Geometry", "memory_size word_size")):
+
+    @property
+    def max_word(self):
+        return 2 ** (self.word_size - 1) - 1
+
+    @property
+    def min_word(self):
+        return -2 ** (self.word_size - 1)
+
+    @property
+    def max_addr(self):
+        return self.memory_size - 1
+
+    @property
+    def paged(self):
+        return self.memory_size > PAGED_MEMORY_SIZE
+
+
+DEFAULT_GEOMETRY = Geometry(MEMORY_SIZE, WORD_SIZE)
+
+
+def make_geometry(memory_size: int = MEMORY_SIZE, word_size: int = WORD_SIZE):
+    if memory_size < 1:
+        raise ValueError(f"Memory size has to be positive, got {memory_size}")
+    if not MIN_WORD_SIZE <= word_size <= MAX_WORD_SIZE:
+        raise ValueError(f"Word size has to be from {MIN_WORD_SIZE} to {MAX_WORD_SIZE} bits, got {word_size}")
+    return Geometry(memory_size, word_size)
+
+
+# Memory and word size options shared by the machine and the translator command lines
+def add_geometry_arguments(arg_parser: argparse.ArgumentParser):
+    arg_parser.add_argument("--memory-size", type=int, default=DEFAULT_GEOMETRY.memory_size,
+                            help="memory words; large memories are paged and only allocated where used")
+    arg_parser.add_argument("--word-size", type=int, default=DEFAULT_GEOMETRY.word_size, help="bits per word")
+
+
+def parse_geometry(arg_parser: argparse.ArgumentParser, options):
+    try:
+        return make_geometry(options.memory_size, options.word_size)
+    except ValueError as error:
+        return arg_parser.error(str(error))
@@ -0,0 +1,61 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+from src.isa import AddressingMode, Opcode
+
+# Ticks of the operand fetch by addressing mode
+operand_ticks = {
+    AddressingMode.DIRECT: 1,
+    AddressingMode.ABSOLUTE: 2,
+    AddressingMode.RELATIVE: 4
+}
+
+# Ticks of an instruction besides its operand fetch. HLT stops the machine before its first tick.
+execute_ticks = {
+    Opcode.NOP: 1,
+    Opcode.DATA: 1,
+    Opcode.HLT: 0,
+    Opcode.LD: 2,
+    Opcode.ST: 3,
+    Opcode.ADD: 2,
+    Opcode.SUB: 2,
+    Opcode.MUL: 2,
+    Opcode.DIV: 2,
+    Opcode.MOD: 2,
+    Opcode.CMP: 2,
+    Opcode.INC: 3,
+    Opcode.DEC: 3,
+    Opcode.NEG: 3,
+    Opcode.CLA: 2,
+    Opcode.IN: 2,
+    Opcode.OUTC: 2,
+    Opcode.OUT: 2,
+    Opcode.JUMP: 1,
+    Opcode.LOOP: 1,
+    Opcode.BEQ: 1,
+    Opcode.BNE: 1,
+    Opcode.BGE: 1,
+    Opcode.BLE: 1,
+    Opcode.BL: 1,
+    Opcode.BG: 1
+}
+
+# Extra tick of LOOP when it skips the next instruction
+LOOP_SKIP_TICKS = 1
+
+# Instructions that always fetch their operand; conditional branches only fetch it when taken
+fetch_opcodes = frozenset((Opcode.LD, Opcode.ADD, Opcode.SUB, Opcode.MUL, Opcode.DIV, Opcode.MOD, Opcode.CMP,
+                           Opcode.JUMP, Opcode.LOOP))
+conditional_opcodes = frozenset((Opcode.BEQ, Opcode.BNE, Opcode.BGE, Opcode.BLE, Opcode.BL, Opcode.BG))
+
+
+# Ticks of one execution of an instruction, as ControlUnit counts them step by step. 'taken' is whether a conditional
+# branch jumps or a LOOP skips the next instruction.
+def instruction_ticks(opcode: Opcode, arg_mode: AddressingMode = None, taken: bool = False):
+    ticks = execute_ticks[opcode]
+    if opcode in fetch_opcodes or (taken and opcode in conditional_opcodes):
+        ticks += operand_ticks[arg_mode]
+    if taken and opcode is Opcode.LOOP:
+        ticks += LOOP_SKIP_TICKS
+    return ticks
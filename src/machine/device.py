@@ -3,16 +3,113 @@
 # pylint: disable=missing-function-docstring
 # pylint: disable=invalid-name
 
+import codecs
+import itertools
+import mmap
+import os
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+# Lazy character source over a text file, a binary file or mmap (decoded as UTF-8) or any iterable of strings.
+# Only one chunk is held in memory at a time.
+class InputStream:
+
+    def __init__(self, source, terminator: str = "", chunk_size: int = STREAM_CHUNK_SIZE):
+        self.position = 0
+        self.chars = itertools.chain.from_iterable(
+            itertools.chain(self.__chunks(source, chunk_size), [terminator]))
+
+    @staticmethod
+    def __chunks(source, chunk_size: int):
+        if not hasattr(source, "read"):
+            yield from source
+            return
+
+        decoder = None
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            if isinstance(chunk, str):
+                yield chunk
+            else:
+                decoder = decoder or codecs.getincrementaldecoder("utf-8")()
+                yield decoder.decode(chunk)
+        if decoder is not None:
+            yield decoder.decode(b"", final=True)
+
+    def read(self):
+        for char in self.chars:
+            self.position += 1
+            return char
+        raise EOFError("Buffer is empty")
+
+    def __repr__(self):
+        return f"<input stream at {self.position}>"
+
+
+# Memory-mapped input file; the mapping is released when the stream is closed
+class MappedInputStream(InputStream):
+
+    def __init__(self, filename: str, terminator: str = "", chunk_size: int = STREAM_CHUNK_SIZE):
+        with open(filename, "rb") as file:
+            # Empty files cannot be mapped
+            size = os.fstat(file.fileno()).st_size
+            self.mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        super().__init__(self.mapped if self.mapped is not None else [], terminator, chunk_size)
+
+    def close(self):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+
+
+# Output sink with the list interface Device uses: appended strings are written to a file descriptor as UTF-8
+# whenever 'chunk_size' characters have been collected, and on flush()
+class OutputSink:
+
+    def __init__(self, fd: int, chunk_size: int = STREAM_CHUNK_SIZE):
+        self.fd = fd
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.buffered = 0
+        self.written = 0
+
+    def append(self, text: str):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        data = memoryview("".join(self.buffer).encode("utf-8"))
+        while data:
+            data = data[os.write(self.fd, data):]
+        self.written += self.buffered
+        self.buffer = []
+        self.buffered = 0
+
+    def __len__(self):
+        return self.written + self.buffered
+
+    def __repr__(self):
+        return f"<output sink at {len(self)}>"
+
 
 class Device:
 
-    def __init__(self):
+    def __init__(self, output=None):
         self.io = 0
         self.input = []
-        self.output = []
+        self.output = [] if output is None else output
         self.read_ind = 0
 
     def read(self):
+        if isinstance(self.input, InputStream):
+            self.io = ord(self.input.read())
+            self.read_ind += 1
+            return
         if self.read_ind >= len(self.input):
             raise EOFError("Buffer is empty")
         self.io = ord(self.input[self.read_ind])
@@ -21,6 +118,7 @@ class Device:
     def write(self):
         self.output.append(self.io)
 
+    # A list is read by index; any other source is wrapped into an InputStream
     def load(self, data):
-        self.input = data
+        self.input = data if isinstance(data, (list, InputStream)) else InputStream(data)
         self.read_ind = 0
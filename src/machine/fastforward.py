@@ -0,0 +1,296 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=too-many-locals
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=too-many-instance-attributes
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+
+from src.exceptions import MachineException
+from src.isa import AddressingMode, Opcode, code_by_mode, code_by_opcode
+from src.machine.config import DEFAULT_GEOMETRY, Geometry
+from src.machine.device import Device
+from src.machine.machinery import DispatchControlUnit, alu_functions, branch_conditions, opcode_to_alu_operation
+from src.machine.trace import Tracer, TraceLevel
+
+MAX_PATH_LENGTH = 1024
+MAX_FAILURES = 3
+
+DIRECT_CODE = code_by_mode[AddressingMode.DIRECT]
+ABSOLUTE_CODE = code_by_mode[AddressingMode.ABSOLUTE]
+
+# Instructions a loop may consist of: no I/O, no HLT and no LOOP
+path_codes = frozenset(code_by_opcode[opcode] for opcode in (
+    Opcode.NOP, Opcode.DATA, Opcode.LD, Opcode.ST, Opcode.ADD, Opcode.SUB, Opcode.MUL, Opcode.DIV, Opcode.MOD,
+    Opcode.CMP, Opcode.INC, Opcode.DEC, Opcode.NEG, Opcode.CLA, Opcode.JUMP, Opcode.BEQ, Opcode.BNE, Opcode.BGE,
+    Opcode.BLE, Opcode.BL, Opcode.BG))
+
+opcodes_by_code = {code_by_opcode[opcode]: opcode for opcode in Opcode}
+
+# Symbol of ACC at the start of an iteration; memory cells are their own symbols
+ACC = "acc"
+
+
+# Linear forms over the values registers and cells have at the start of an iteration: {symbol: coefficient}, with the
+# constant term, always present, under None
+def constant(value: int):
+    return {None: value}
+
+
+def combine(left: dict, right: dict, sign: int = 1):
+    form = dict(left)
+    for symbol, coefficient in right.items():
+        form[symbol] = form.get(symbol, 0) + sign * coefficient
+    return {symbol: coefficient for symbol, coefficient in form.items() if coefficient or symbol is None}
+
+
+def scale(form: dict, factor: int):
+    return {symbol: coefficient * factor for symbol, coefficient in form.items() if coefficient * factor
+            or symbol is None}
+
+
+def is_constant(form: dict):
+    return all(symbol is None for symbol in form)
+
+
+# First iteration k >= 0 at which a + b * k leaves the word range
+def overflow_bound(a: int, b: int, min_word: int, max_word: int):
+    if not min_word <= a <= max_word:
+        return 0
+    if b > 0:
+        return (max_word - a) // b + 1
+    if b < 0:
+        return (a - min_word) // -b + 1
+    return None
+
+
+# First iteration k >= 1 at which a + b * k is no longer of the sign it has at k = 0, so flags may differ
+def sign_bound(a: int, b: int):
+    if b == 0 or (a > 0 and b > 0) or (a < 0 and b < 0):
+        return None
+    if a == 0:
+        return 1
+    return -(-abs(a) // abs(b))
+
+
+# Loop acceleration engine. When control goes back to an address, one iteration is run and recorded; if every cell the
+# recorded path reads is a loop invariant or an induction variable (changed by a constant each iteration), the
+# iterations that provably take the same path are skipped at once: cells, registers, ticks and the instruction count
+# are set from closed forms. The path is left to single steps at the first iteration that might branch elsewhere,
+# overflow or exceed the limit, so results and errors are exactly those of step-by-step execution.
+class FastForwardControlUnit(DispatchControlUnit):
+
+    def __init__(self, program: list, device: Device, geometry: Geometry = DEFAULT_GEOMETRY):
+        super().__init__(program, device, geometry)
+        self.failures = {}  # loop headers and the number of times their iterations could not be skipped
+        self.skipped = 0  # instructions executed in closed form
+
+    def run(self, limit: int, tracer: Tracer = None):
+        # Trace records need the state before every instruction
+        if tracer is not None and tracer.level != TraceLevel.OFF:
+            return super().run(limit, tracer)
+
+        handlers = self.handlers
+        failures = self.failures
+        instr_counter = 0
+        try:
+            while instr_counter <= limit:
+                pc = self.program_counter
+                handlers[pc]()
+                instr_counter += 1
+                if self.program_counter <= pc and failures.get(self.program_counter, 0) < MAX_FAILURES:
+                    instr_counter = self.__accelerate(self.program_counter, instr_counter, limit)
+            raise MachineException('Too long execution! Increase limit')
+        except StopIteration:
+            pass
+
+        return instr_counter
+
+    def __accelerate(self, header: int, instr_counter: int, limit: int):
+        tact = self.tact
+        path, instr_counter = self.__record(header, instr_counter, limit)
+        plan = self.__analyze(path, header) if path is not None else None
+        if plan is None:
+            self.failures[header] = self.failures.get(header, 0) + 1
+            return instr_counter
+
+        iterations, apply = plan
+        iterations = min(iterations, (limit - instr_counter + 1) // len(path))
+        if iterations >= 1:
+            apply(iterations - 1)
+            self.tact += iterations * (self.tact - tact)
+            instr_counter += iterations * len(path)
+            self.skipped += iterations * len(path)
+        return instr_counter
+
+    # Runs one iteration from 'header' back to it by single steps. The path is None when the iteration takes an
+    # instruction loops may not have, or too many of them
+    def __record(self, header: int, instr_counter: int, limit: int):
+        opcodes = self.memory.opcodes
+        handlers = self.handlers
+        path = []
+        while len(path) < MAX_PATH_LENGTH:
+            pc = self.program_counter
+            if not 0 <= pc < len(opcodes) or opcodes[pc] not in path_codes:
+                return None, instr_counter
+            if instr_counter > limit:
+                raise MachineException('Too long execution! Increase limit')
+            handlers[pc]()
+            instr_counter += 1
+            path.append(pc)
+            if self.program_counter == header:
+                return path, instr_counter
+        return None, instr_counter
+
+    # Runs the path symbolically from the current state. Returns None if the loop is not an induction loop, otherwise
+    # the number of iterations known to repeat the path and the function that sets the state after a given one
+    def __analyze(self, path: list, header: int):
+        memory = self.memory
+        opcodes, modes, args = memory.opcodes, memory.modes, memory.args
+        size = len(memory)
+
+        written = {args[pc] for pc in path if opcodes_by_code[opcodes[pc]] is Opcode.ST}
+        if written & set(path):
+            return None
+        cells = {addr: {addr: 1, None: 0} for addr in written}
+        acc = {ACC: 1, None: 0}
+        data_reg = addr_reg = flags = None
+        checked = []  # results that must stay in the word range
+        guards = []  # (flags, branch opcode, taken) of conditional branches
+
+        def cell(addr: int):
+            return cells[addr] if addr in cells else constant(args[addr])
+
+        for index, pc in enumerate(path):
+            opcode, mode, arg = opcodes_by_code[opcodes[pc]], modes[pc], args[pc]
+            next_pc = path[index + 1] if index + 1 < len(path) else header
+
+            if opcode in (Opcode.NOP, Opcode.DATA):
+                continue
+            if opcode is Opcode.ST:
+                cells[arg] = acc
+                addr_reg = constant(arg)
+                continue
+            if opcode is Opcode.CLA:
+                acc = constant(0)
+                continue
+            if opcode in (Opcode.INC, Opcode.DEC, Opcode.NEG):
+                data_reg = constant(1 if opcode is Opcode.INC else -1)
+                acc = scale(acc, -1) if opcode is Opcode.NEG else combine(acc, data_reg)
+                checked.append(acc)
+                flags = acc
+                continue
+
+            if opcode is Opcode.JUMP or opcode in branch_conditions:
+                taken = next_pc != pc + 1
+                if mode != DIRECT_CODE or (taken and next_pc != arg):
+                    return None
+                if opcode is not Opcode.JUMP:
+                    if flags is None:
+                        return None
+                    guards.append((flags, opcode, taken))
+                if taken:
+                    data_reg = constant(arg)
+                continue
+
+            # Operand fetch of LD and the ALU instructions
+            if mode == DIRECT_CODE:
+                value = constant(arg)
+            elif mode == ABSOLUTE_CODE:
+                addr_reg = constant(arg)
+                value = cell(arg)
+            else:
+                pointer = cell(arg)
+                if not is_constant(pointer) or not 0 <= pointer[None] < size:
+                    return None
+                addr_reg = pointer
+                value = cell(pointer[None])
+            data_reg = value
+
+            if opcode is Opcode.LD:
+                result = value
+            elif opcode in (Opcode.ADD, Opcode.SUB, Opcode.CMP):
+                result = combine(acc, value, 1 if opcode is Opcode.ADD else -1)
+            elif opcode is Opcode.MUL:
+                if is_constant(value):
+                    result = scale(acc, value[None])
+                elif is_constant(acc):
+                    result = scale(value, acc[None])
+                else:
+                    return None
+            else:
+                if not is_constant(acc) or not is_constant(value) or not value[None]:
+                    return None
+                result = constant(alu_functions[opcode_to_alu_operation[opcode]](acc[None], value[None]))
+            checked.append(result)
+            flags = result
+            if opcode is not Opcode.CMP:
+                acc = result
+
+        return self.__plan(cells, acc, data_reg, addr_reg, flags, checked, guards)
+
+    # Every symbol the path depends on has to be an induction variable: its value after an iteration is its value
+    # before plus a constant, or a constant equal to its current value
+    def __plan(self, cells: dict, acc: dict, data_reg, addr_reg, flags, checked: list, guards: list):
+        start = {ACC: self.acc}
+        ends = {ACC: acc}
+        for addr, form in cells.items():
+            start[addr] = self.memory.args[addr]
+            ends[addr] = form
+
+        used = set()
+        for form in checked + [form for form, _, _ in guards] + list(ends.values()):
+            used.update(symbol for symbol in form if symbol is not None)
+        steps = {}
+        for symbol in used:
+            end = ends[symbol]
+            if set(end) <= {symbol, None} and end.get(symbol) == 1:
+                steps[symbol] = end.get(None, 0)
+            elif is_constant(end) and end[None] == start[symbol]:
+                steps[symbol] = 0
+            else:
+                return None
+
+        # The value of a form in iteration k is a + b * k
+        def affine(form: dict):
+            a, b = form.get(None, 0), 0
+            for symbol, coefficient in form.items():
+                if symbol is not None:
+                    a += coefficient * start[symbol]
+                    b += coefficient * steps[symbol]
+            return a, b
+
+        bounds = []
+        for form in checked:
+            bounds.append(overflow_bound(*affine(form), self.min_word, self.max_word))
+        for form, opcode, taken in guards:
+            a, b = affine(form)
+            if branch_conditions[opcode](a == 0, a < 0) != taken:
+                return None
+            bounds.append(sign_bound(a, b))
+        bounds = [bound for bound in bounds if bound is not None]
+        iterations = min(bounds) if bounds else self.max_word
+
+        def value(form: dict, iteration: int):
+            a, b = affine(form)
+            return a + b * iteration
+
+        # State at the end of 'iteration', which is the start of the next one
+        def apply(iteration: int):
+            for addr, form in cells.items():
+                self.memory.write(addr, value(form, iteration))
+                self.invalidate(addr)
+            self.acc = value(acc, iteration)
+            if data_reg is not None:
+                self.data_reg = value(data_reg, iteration)
+            if addr_reg is not None:
+                self.addr_reg = value(addr_reg, iteration)
+            if flags is not None:
+                result = value(flags, iteration)
+                self.zero_flag = result == 0
+                self.negative_flag = result < 0
+
+        return iterations, apply
@@ -0,0 +1,192 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+
+import functools
+
+from src.exceptions import MachineException
+from src.isa import AddressingMode, Opcode, code_by_opcode
+from src.machine.compiler import alu_operators, branch_conditions, compile_block_source
+from src.machine.config import DEFAULT_GEOMETRY, Geometry
+from src.machine.costs import execute_ticks, instruction_ticks
+from src.machine.device import Device
+from src.machine.machinery import DispatchControlUnit
+from src.machine.memory import cell_table, flag_table
+from src.machine.trace import Tracer, TraceLevel
+
+FUSED_LENGTH = 3
+LD_CODE = code_by_opcode[Opcode.LD]
+
+output_conversions = {
+    Opcode.OUTC: "chr",
+    Opcode.OUT: "str"
+}
+
+
+# Python lines that put the operand into 'name' and set AR as the operand fetch does; DR is left to the caller
+def operand_source(name: str, arg: str, arg_mode: AddressingMode):
+    if arg_mode == AddressingMode.DIRECT:
+        return [f"{name} = {arg}"]
+    if arg_mode == AddressingMode.ABSOLUTE:
+        return [f"cu.addr_reg = {arg}", f"{name} = read({arg})"]
+    return [f"cu.addr_reg = pointer = read({arg})", f"{name} = read(pointer)"]
+
+
+# Values loaded from memory or from an argument always fit into a word, so LD itself never overflows.
+# A group that is about to fail returns step(), which runs it by the single handlers.
+def load_operate_store_source(load_mode: AddressingMode, operation: Opcode, operand_mode: AddressingMode):
+    load_ticks = instruction_ticks(Opcode.LD, load_mode)
+    lines = operand_source("left", "first", load_mode) + operand_source("right", "second", operand_mode)
+    if operation in (Opcode.DIV, Opcode.MOD):
+        lines.append("if not right: return step()")
+    lines += [f"res = left {alu_operators[operation]} right",
+              "if res > max_word or res < min_word: return step()",
+              "cu.data_reg = right",
+              "cu.zero_flag = res == 0",
+              "cu.negative_flag = res < 0",
+              "cu.acc = res",
+              "cu.addr_reg = third",
+              "write(third, res)",
+              "handlers[third] = undecoded",
+              "if grouped[third]: invalidate(third)",
+              f"cu.program_counter += {FUSED_LENGTH}",
+              f"cu.tact += {load_ticks + instruction_ticks(operation, operand_mode) + execute_ticks[Opcode.ST]}",
+              f"return {FUSED_LENGTH}"]
+    return lines
+
+
+def load_compare_branch_source(load_mode: AddressingMode, operand_mode: AddressingMode, branch: Opcode):
+    ticks = instruction_ticks(Opcode.LD, load_mode) + instruction_ticks(Opcode.CMP, operand_mode)
+    taken_ticks = ticks + instruction_ticks(branch, AddressingMode.DIRECT, True)
+    lines = operand_source("left", "first", load_mode) + operand_source("right", "second", operand_mode)
+    lines += ["res = left - right",
+              "if res > max_word or res < min_word: return step()",
+              "z = cu.zero_flag = res == 0",
+              "n = cu.negative_flag = res < 0",
+              "cu.acc = left",
+              f"if {branch_conditions[branch]}:",
+              "    cu.data_reg = third",
+              "    cu.program_counter = third",
+              f"    cu.tact += {taken_ticks}",
+              "else:",
+              "    cu.data_reg = right",
+              f"    cu.program_counter += {FUSED_LENGTH}",
+              f"    cu.tact += {ticks + instruction_ticks(branch)}",
+              f"return {FUSED_LENGTH}"]
+    return lines
+
+
+# Output can fail on the value, after the load and the branch are done
+def load_branch_output_source(load_mode: AddressingMode, branch: Opcode, output: Opcode):
+    ticks = instruction_ticks(Opcode.LD, load_mode)
+    lines = operand_source("value", "first", load_mode)
+    lines += ["z = cu.zero_flag = value == 0",
+              "n = cu.negative_flag = value < 0",
+              "cu.acc = value",
+              f"if {branch_conditions[branch]}:",
+              "    cu.data_reg = second",
+              "    cu.program_counter = second",
+              f"    cu.tact += {ticks + instruction_ticks(branch, AddressingMode.DIRECT, True)}",
+              "    return 2",
+              "cu.data_reg = value",
+              "cu.program_counter += 2",
+              f"cu.tact += {ticks + instruction_ticks(branch)}",
+              f"write_output({output_conversions[output]}(value))",
+              "cu.program_counter += 1",
+              f"cu.tact += {instruction_ticks(output)}",
+              f"return {FUSED_LENGTH}"]
+    return lines
+
+
+# Handler factory for one shape of group (opcodes and addressing modes), or None if the shape is not an idiom; the
+# arguments are bound per group
+@functools.lru_cache(maxsize=None)
+def handler_factory(first: Opcode, first_mode, second: Opcode, second_mode, third: Opcode, third_mode):
+    if first is not Opcode.LD:
+        return None
+    if second in alu_operators and third is Opcode.ST:
+        lines = load_operate_store_source(first_mode, second, second_mode)
+    elif second is Opcode.CMP and third in branch_conditions and third_mode == AddressingMode.DIRECT:
+        lines = load_compare_branch_source(first_mode, second_mode, third)
+    elif second in branch_conditions and second_mode == AddressingMode.DIRECT and third in output_conversions:
+        lines = load_branch_output_source(first_mode, second, third)
+    else:
+        return None
+    source = "def make(cu, read, write, handlers, undecoded, grouped, invalidate, write_output, step, max_word, " \
+             "min_word, first, second, third):\n    def handler():\n" + \
+             "".join("        " + line + "\n" for line in lines) + "    return handler\n"
+    namespace = {}
+    exec(compile_block_source(source), namespace)  # pylint: disable=exec-used
+    return namespace["make"]
+
+
+# Engine with superinstructions: at load time the idioms the translator emits all the time are found and each gets a
+# generated handler that does the work of its three instructions with a single dispatch:
+#   LD a; <ADD|SUB|MUL|DIV|MOD> b; ST c      (assignments)
+#   LD a; CMP b; B<cond> label               (conditions of 'if' and 'while')
+#   LD a; B<cond> label; <OUTC|OUT>          (string printing loops)
+# Registers, flags, memory, PC and ticks end up as after the single steps. A group that is about to fail is run by the
+# single handlers instead, so errors happen in the same state too. Writes into a group break it up for good.
+class FusedControlUnit(DispatchControlUnit):
+
+    def __init__(self, program: list, device: Device, geometry: Geometry = DEFAULT_GEOMETRY):
+        super().__init__(program, device, geometry)
+        self.fused = cell_table(self.memory, None)
+        self.grouped = flag_table(self.memory)  # cells that belong to a group
+        for addr in range(len(program) - FUSED_LENGTH + 1):
+            handler = self.fuse(addr)
+            if handler is not None:
+                self.fused[addr] = handler
+                self.grouped[addr:addr + FUSED_LENGTH] = b"\x01" * FUSED_LENGTH
+
+    def invalidate(self, addr: int):
+        super().invalidate(addr)
+        if self.grouped[addr]:
+            for start in range(max(addr - FUSED_LENGTH + 1, 0), addr + 1):
+                self.fused[start] = None
+
+    # Generated handler for the group at 'addr' or None; handlers return the number of instructions they executed
+    def fuse(self, addr: int):
+        if self.memory.opcodes[addr] != LD_CODE:
+            return None
+        (first, first_arg, first_mode), (second, second_arg, second_mode), (third, third_arg, third_mode) = \
+            (self.memory.fetch(cell) for cell in range(addr, addr + FUSED_LENGTH))
+        factory = handler_factory(first, first_mode, second, second_mode, third, third_mode)
+        if factory is None:
+            return None
+        return factory(self, self.memory.read, self.memory.write, self.handlers, self.undecoded, self.grouped,
+                       self.invalidate, self.write_output, self.step_group, self.max_word, self.min_word, first_arg,
+                       second_arg, third_arg)
+
+    # Runs the group at PC by the single handlers, for the cases where one of its instructions fails
+    def step_group(self):
+        for _ in range(FUSED_LENGTH):
+            self.handlers[self.program_counter]()
+        return FUSED_LENGTH
+
+    def run(self, limit: int, tracer: Tracer = None):
+        # Trace records need the state before every instruction
+        if tracer is not None and tracer.level != TraceLevel.OFF:
+            return super().run(limit, tracer)
+
+        handlers = self.handlers
+        fused = self.fused
+        instr_counter = 0
+        try:
+            while True:
+                pc = self.program_counter
+                # A group is only used when all of its instructions are within the limit
+                handler = fused[pc] if instr_counter + FUSED_LENGTH - 1 <= limit else None
+                if handler is not None:
+                    instr_counter += handler()
+                elif instr_counter <= limit:
+                    handlers[pc]()
+                    instr_counter += 1
+                else:
+                    raise MachineException('Too long execution! Increase limit')
+        except StopIteration:
+            pass
+
+        return instr_counter
@@ -6,15 +6,26 @@
 # pylint: disable=logging-not-lazy
 # pylint: disable=too-many-branches
 # pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+# pylint: disable=too-many-locals
 
+import argparse
 import enum
+import functools
 import logging
+import operator
 import sys
 
 from src.exceptions import MachineException
-from src.machine.config import MEMORY_SIZE, WORD_INIT, START_ADDR, MAX_WORD, MIN_WORD
-from src.isa import read_code, Opcode, AddressingMode
-from src.machine.device import Device
+from src.machine.costs import LOOP_SKIP_TICKS, execute_ticks, operand_ticks
+from src.machine.config import START_ADDR, DEFAULT_GEOMETRY, Geometry, add_geometry_arguments, parse_geometry
+from src.isa import load_program, Opcode, AddressingMode
+from src.machine.device import Device, MappedInputStream, OutputSink
+from src.machine.memory import cell_table, make_memory
+from src.machine.trace import Tracer, TraceLevel, IoLog, BufferRenderer, IO_INPUT, IO_OUTPUT, branch_codes, \
+    format_state
 
 
 class AluOperation(str, enum.Enum):
@@ -34,13 +45,37 @@ opcode_to_alu_operation = {
     Opcode.CMP: AluOperation.SUB
 }
 
+alu_functions = {
+    AluOperation.ADD: operator.add,
+    AluOperation.SUB: operator.sub,
+    AluOperation.MUL: operator.mul,
+    AluOperation.DIV: operator.floordiv,
+    AluOperation.MOD: operator.mod
+}
+
+alu_zero_errors = {
+    AluOperation.DIV: 'Error! Trying to get DIV operation from 0',
+    AluOperation.MOD: 'Error! Trying to get MOD operation from 0'
+}
+
+# Branch condition on (zero_flag, negative_flag)
+branch_conditions = {
+    Opcode.BEQ: lambda zero, negative: zero,
+    Opcode.BNE: lambda zero, negative: not zero,
+    Opcode.BGE: lambda zero, negative: not negative,
+    Opcode.BLE: lambda zero, negative: zero | negative,
+    Opcode.BL: lambda zero, negative: negative,
+    Opcode.BG: lambda zero, negative: not zero | negative
+}
+
 
 class ControlUnit:
 
-    def __init__(self, program: list, device: Device):
-        self.memory = program
-        for _ in range(len(self.memory), MEMORY_SIZE):
-            self.memory.append({'opcode': Opcode.DATA, 'arg': WORD_INIT, 'arg_mode': AddressingMode.DIRECT})
+    def __init__(self, program: list, device: Device, geometry: Geometry = DEFAULT_GEOMETRY):
+        self.memory = make_memory(program, geometry)
+        self.geometry = geometry
+        self.max_word = geometry.max_word
+        self.min_word = geometry.min_word
 
         self.program_counter = START_ADDR
         self.acc = 0
@@ -50,9 +85,15 @@ class ControlUnit:
         self.device = device
         self.zero_flag = False
         self.negative_flag = False
+        self.tracer = None
+        self.io_log = None
+
+    def __tick(self):  # pylint: disable=method-hidden
+        self.tact += 1
 
-    def __tick(self):
+    def __traced_tick(self):
         self.tact += 1
+        self.tracer.record(self)
 
     def set_zero_flag(self, val: int):
         self.zero_flag = val == 0
@@ -75,9 +116,8 @@ class ControlUnit:
         else:
             self.program_counter = self.data_reg
 
-    @staticmethod
-    def check_value(val: int):
-        if val > MAX_WORD or val < MIN_WORD:
+    def check_value(self, val: int):
+        if val > self.max_word or val < self.min_word:
             raise MachineException('Overflow error!')
         return val
 
@@ -115,23 +155,39 @@ class ControlUnit:
         elif arg_mode == AddressingMode.ABSOLUTE:
             self.latch_addr_reg(arg)
             self.__tick()
-            self.latch_data_reg(self.memory[self.addr_reg]['arg'])
+            self.latch_data_reg(self.memory.read(self.addr_reg))
             self.__tick()
         elif arg_mode == AddressingMode.RELATIVE:
             self.latch_addr_reg(arg)
             self.__tick()
-            self.latch_data_reg(self.memory[self.addr_reg]['arg'])
+            self.latch_data_reg(self.memory.read(self.addr_reg))
             self.__tick()
             self.latch_addr_reg(self.data_reg)
             self.__tick()
-            self.latch_data_reg(self.memory[self.addr_reg]['arg'])
+            self.latch_data_reg(self.memory.read(self.addr_reg))
             self.__tick()
 
+    def read_input(self):
+        self.device.read()
+        val = self.device.io
+        if self.io_log is not None:
+            self.__log_io(IO_INPUT, self.device.read_ind - 1, val)
+        return val
+
+    def write_output(self, val: str):
+        self.device.io = val
+        self.device.write()
+        if self.io_log is not None:
+            self.__log_io(IO_OUTPUT, len(self.device.output) - 1, val)
+
+    def __log_io(self, direction: int, position: int, val):
+        # Rendered trace lines go out before the I/O event so the log keeps execution order
+        if self.tracer is not None:
+            self.tracer.flush()
+        self.io_log.record(direction, position, val)
+
     def decode_and_execute_instruction(self):
-        instr = self.memory[self.program_counter]
-        opcode = instr['opcode']
-        arg = instr['arg'] if 'arg' in instr else None
-        arg_mode = instr['arg_mode'] if 'arg' in instr else None
+        opcode, arg, arg_mode = self.memory.fetch(self.program_counter)
 
         if opcode is Opcode.HLT:
             raise StopIteration()
@@ -152,7 +208,7 @@ class ControlUnit:
         elif opcode is Opcode.ST:
             self.latch_addr_reg(arg)
             self.__tick()
-            self.memory[self.addr_reg] = {'opcode': Opcode.DATA, 'arg': self.acc, 'arg_mode': AddressingMode.DIRECT}
+            self.memory.write(self.addr_reg, self.acc)
             self.__tick()
 
             self.latch_program_counter(True)
@@ -206,9 +262,7 @@ class ControlUnit:
             self.__tick()
 
         elif opcode == Opcode.IN:
-            self.device.read()
-            val = self.device.io
-            logging.info(f"{{info_buffer: {self.device.input} >> {val}}}")
+            val = self.read_input()
             self.latch_acc(val)
             self.__tick()
 
@@ -216,20 +270,14 @@ class ControlUnit:
             self.__tick()
 
         elif opcode == Opcode.OUTC:
-            val = chr(self.acc)
-            self.device.io = val
-            self.device.write()
-            logging.info(f"{{output_buffer: {self.device.output} << {val}}}")
+            self.write_output(chr(self.acc))
             self.__tick()
 
             self.latch_program_counter(True)
             self.__tick()
 
         elif opcode == Opcode.OUT:
-            val = str(self.acc)
-            self.device.io = val
-            self.device.write()
-            logging.info(f"{{output_buffer: {self.device.output} << {val}}}")
+            self.write_output(str(self.acc))
             self.__tick()
 
             self.latch_program_counter(True)
@@ -305,50 +353,331 @@ class ControlUnit:
             self.latch_program_counter(True)
             self.__tick()
 
+    # Executes instructions until HLT and returns the number of executed instructions
+    def run(self, limit: int, tracer: Tracer = None):
+        if tracer is not None and tracer.level != TraceLevel.OFF:
+            return self.__run_traced(limit, tracer)
+
+        instr_counter = 0
+        try:
+            while True:
+                if instr_counter > limit:
+                    raise MachineException('Too long execution! Increase limit')
+
+                self.decode_and_execute_instruction()
+                instr_counter += 1
+        except StopIteration:
+            pass
+
+        return instr_counter
+
+    def __run_traced(self, limit: int, tracer: Tracer):
+        self.tracer = tracer
+        step = self.decode_and_execute_instruction
+        if tracer.level >= TraceLevel.TICK:
+            # Only the interpreter advances ticks one by one, so tick tracing always runs it
+            self.__tick = self.__traced_tick
+            step = functools.partial(ControlUnit.decode_and_execute_instruction, self)
+        every_instruction = tracer.level >= TraceLevel.INSTRUCTION
+        opcodes = self.memory.opcodes
+
+        instr_counter = 0
+        try:
+            while True:
+                if instr_counter > limit:
+                    raise MachineException('Too long execution! Increase limit')
+
+                if every_instruction or opcodes[self.program_counter] in branch_codes:
+                    tracer.record(self)
+                step()
+                instr_counter += 1
+        except StopIteration:
+            pass
+
+        return instr_counter
+
     def __repr__(self):
-        state = f"{{TICK: {self.tact}, PC: {self.program_counter}, AR: {self.addr_reg}, DR: {self.data_reg}" \
-                f", ACC: {self.acc}, IO: {self.device.io}, N: {self.negative_flag}, Z: {self.zero_flag}}}"
-
-        instr = self.memory[self.program_counter]
-        opcode = instr['opcode']
-        if 'arg' in instr:
-            arg = instr['arg']
-            arg_mode = instr['arg_mode']
-            action = f"{{{opcode}, {arg}, {arg_mode}}}"
-        else:
-            action = f"{{{opcode}}}"
+        opcode, arg, arg_mode = self.memory.fetch(self.program_counter)
+        return format_state(self.tact, self.program_counter, self.addr_reg, self.data_reg, self.acc, self.device.io,
+                            self.negative_flag, self.zero_flag, opcode, arg, arg_mode)
+
+
+# Alternative engine: every memory cell is pre-decoded into a bound handler, so a step is a single indexed call.
+# Handlers reproduce the register and flag effects of decode_and_execute_instruction exactly and add the ticks of the
+# cost tables at once.
+class DispatchControlUnit(ControlUnit):
+
+    def __init__(self, program: list, device: Device, geometry: Geometry = DEFAULT_GEOMETRY):
+        super().__init__(program, device, geometry)
+        # Cells past the loaded program are decoded lazily on first execution
+        self.undecoded = self.__decode_and_execute
+        self.handlers = cell_table(self.memory, self.undecoded)
+        for addr in range(len(program)):
+            self.handlers[addr] = self.decode(addr)
+
+    def decode_and_execute_instruction(self):
+        self.handlers[self.program_counter]()
+
+    def __decode_and_execute(self):
+        handler = self.handlers[self.program_counter] = self.decode(self.program_counter)
+        handler()
+
+    # Called after ST overwrites a cell so the table never runs stale code; the cell is re-decoded on next execution
+    def invalidate(self, addr: int):
+        self.handlers[addr] = self.undecoded
+
+    def decode(self, addr: int):
+        opcode, arg, arg_mode = self.memory.fetch(addr)
+
+        if opcode is Opcode.HLT:
+            return self.__halt
+        if opcode in (Opcode.NOP, Opcode.DATA):
+            return self.__make_skip(execute_ticks[opcode])
+        if opcode is Opcode.LD:
+            return self.__make_load(*self.__make_fetch(arg, arg_mode))
+        if opcode is Opcode.ST:
+            return self.__make_store(arg)
+        if opcode in opcode_to_alu_operation:
+            return self.__make_alu(opcode, *self.__make_fetch(arg, arg_mode))
+        if opcode is Opcode.INC:
+            return self.__make_unary(1, operator.add, execute_ticks[opcode])
+        if opcode is Opcode.DEC:
+            return self.__make_unary(-1, operator.add, execute_ticks[opcode])
+        if opcode is Opcode.NEG:
+            return self.__make_unary(-1, operator.mul, execute_ticks[opcode])
+        if opcode is Opcode.CLA:
+            return self.__make_clear()
+        if opcode is Opcode.IN:
+            return self.__make_input()
+        if opcode is Opcode.OUTC:
+            return self.__make_output(chr, execute_ticks[opcode])
+        if opcode is Opcode.OUT:
+            return self.__make_output(str, execute_ticks[opcode])
+        if opcode is Opcode.JUMP:
+            return self.__make_jump(*self.__make_fetch(arg, arg_mode))
+        if opcode is Opcode.LOOP:
+            return self.__make_loop(*self.__make_fetch(arg, arg_mode))
+        return self.__make_branch(branch_conditions[opcode], *self.__make_fetch(arg, arg_mode), execute_ticks[opcode])
+
+    @staticmethod
+    def __halt():
+        raise StopIteration()
+
+    # Returns the operand fetch action together with the number of ticks it takes
+    def __make_fetch(self, arg: int, arg_mode: AddressingMode):
+        read = self.memory.read
+
+        def fetch_direct():
+            self.data_reg = arg
+
+        def fetch_absolute():
+            self.addr_reg = arg
+            self.data_reg = read(arg)
+
+        def fetch_relative():
+            self.addr_reg = arg
+            self.addr_reg = read(arg)
+            self.data_reg = read(self.addr_reg)
+
+        if arg_mode == AddressingMode.DIRECT:
+            return fetch_direct, operand_ticks[arg_mode]
+        if arg_mode == AddressingMode.ABSOLUTE:
+            return fetch_absolute, operand_ticks[arg_mode]
+        return fetch_relative, operand_ticks[AddressingMode.RELATIVE]
+
+    def __latch_flags(self, res: int):
+        self.zero_flag = res == 0
+        self.negative_flag = res < 0
+        if res > self.max_word or res < self.min_word:
+            raise MachineException('Overflow error!')
+
+    def __make_skip(self, ticks: int):
+        def handler():
+            self.program_counter += 1
+            self.tact += ticks
+        return handler
+
+    def __make_load(self, fetch, fetch_ticks: int):
+        ticks = fetch_ticks + execute_ticks[Opcode.LD]
 
-        return f"{state} {action}"
+        def handler():
+            fetch()
+            res = self.data_reg
+            self.__latch_flags(res)
+            self.acc = res
+            self.program_counter += 1
+            self.tact += ticks
+        return handler
+
+    def __make_store(self, addr: int):
+        write = self.memory.write
+        ticks = execute_ticks[Opcode.ST]
+
+        def handler():
+            self.addr_reg = addr
+            write(addr, self.acc)
+            self.invalidate(addr)
+            self.program_counter += 1
+            self.tact += ticks
+        return handler
+
+    def __make_alu(self, opcode: Opcode, fetch, fetch_ticks: int):
+        operation = alu_functions[opcode_to_alu_operation[opcode]]
+        zero_error = alu_zero_errors.get(opcode_to_alu_operation[opcode])
+        latch = opcode is not Opcode.CMP
+        ticks = fetch_ticks + execute_ticks[opcode]
+
+        def handler():
+            fetch()
+            right = self.data_reg
+            if zero_error and not right:
+                raise MachineException(zero_error)
+            res = operation(self.acc, right)
+            self.__latch_flags(res)
+            if latch:
+                self.acc = res
+            self.program_counter += 1
+            self.tact += ticks
+        return handler
+
+    def __make_unary(self, right: int, operation, ticks: int):
+        def handler():
+            self.data_reg = right
+            res = operation(self.acc, right)
+            self.__latch_flags(res)
+            self.acc = res
+            self.program_counter += 1
+            self.tact += ticks
+        return handler
+
+    def __make_clear(self):
+        ticks = execute_ticks[Opcode.CLA]
 
+        def handler():
+            self.acc = 0
+            self.program_counter += 1
+            self.tact += ticks
+        return handler
 
-def simulation(input_buffer: list, instructions: list, limit: int):
-    if len(instructions) > MEMORY_SIZE:
+    def __make_input(self):
+        ticks = execute_ticks[Opcode.IN]
+
+        def handler():
+            self.acc = int(self.read_input())
+            self.program_counter += 1
+            self.tact += ticks
+        return handler
+
+    def __make_output(self, convert, ticks: int):
+        def handler():
+            self.write_output(convert(self.acc))
+            self.program_counter += 1
+            self.tact += ticks
+        return handler
+
+    def __make_jump(self, fetch, fetch_ticks: int):
+        ticks = fetch_ticks + execute_ticks[Opcode.JUMP]
+
+        def handler():
+            fetch()
+            self.program_counter = self.data_reg
+            self.tact += ticks
+        return handler
+
+    def __make_loop(self, fetch, fetch_ticks: int):
+        ticks = fetch_ticks + execute_ticks[Opcode.LOOP]
+        skip_ticks = ticks + LOOP_SKIP_TICKS
+
+        def handler():
+            fetch()
+            if self.data_reg > 0:
+                self.program_counter += 2
+                self.tact += skip_ticks
+            else:
+                self.program_counter += 1
+                self.tact += ticks
+        return handler
+
+    def __make_branch(self, condition, fetch, fetch_ticks: int, ticks: int):
+        taken_ticks = fetch_ticks + ticks
+
+        def handler():
+            if condition(self.zero_flag, self.negative_flag):
+                fetch()
+                self.program_counter = self.data_reg
+                self.tact += taken_ticks
+            else:
+                self.program_counter += 1
+                self.tact += ticks
+        return handler
+
+
+# Errors a run of translated code can end with: the machine's own MachineException, and the errors of the Python
+# operations it runs on, such as reading past the input, an address outside of memory or OUTC of a value that is
+# not a character. Callers that report failed runs as results catch these.
+run_errors = (MachineException, EOFError, LookupError, ValueError, ArithmeticError)
+
+
+# Message of one of run_errors, as results report it
+def run_error_message(exception: Exception):
+    return exception.get_msg() if isinstance(exception, MachineException) else str(exception)
+
+
+# 'input_buffer' is a list of characters or any streaming source accepted by Device.load; with an 'output' sink the
+# produced text goes there instead of into a list and is flushed when the simulation ends. 'geometry' sets the memory
+# and word size of the machine.
+def simulation(input_buffer, instructions, limit: int, engine=ControlUnit, tracer: Tracer = None, output=None,
+               io_log: IoLog = None, geometry: Geometry = DEFAULT_GEOMETRY):
+    if len(instructions) > geometry.memory_size:
         raise MachineException('Program is too large')
 
-    device = Device()
+    device = Device(output)
     device.load(input_buffer)
-    control_unit = ControlUnit(instructions, device)
+    control_unit = engine(instructions, device, geometry)
 
-    instr_counter = 0
-    try:
-        while True:
-            if instr_counter > limit:
-                raise MachineException('Too long execution! Increase limit')
+    # Without an explicit log, I/O events are logged as deltas at INFO
+    if io_log is None and logging.getLogger().isEnabledFor(logging.INFO):
+        io_log = IoLog(sink=logging.info)
+    control_unit.io_log = io_log
 
-            logging.debug(control_unit)
-            control_unit.decode_and_execute_instruction()
-            instr_counter += 1
-    except StopIteration:
-        pass
+    # Without an explicit tracer the per-instruction trace follows the logging configuration, as DEBUG messages
+    if tracer is None and logging.getLogger().isEnabledFor(logging.DEBUG):
+        tracer = Tracer(TraceLevel.INSTRUCTION, sink=logging.debug)
+    try:
+        instr_counter = control_unit.run(limit, tracer)
+    finally:
+        if tracer is not None:
+            tracer.flush()
+        if output is not None:
+            output.flush()
 
     return device.output, control_unit.tact, instr_counter
 
 
 def main(args):
-    assert len(args) == 2, "Wrong arguments: machinery.py <code_file> <input_file>"
-    code_file, input_file = args
+    arg_parser = argparse.ArgumentParser(prog="machinery.py")
+    arg_parser.add_argument("code_file")
+    arg_parser.add_argument("input_file")
+    arg_parser.add_argument("--trace", choices=[level.name.lower() for level in TraceLevel],
+                            help="trace level logged at DEBUG (default: per instruction when DEBUG logging is on)")
+    arg_parser.add_argument("--stream", action="store_true",
+                            help="map the input file and write the output to stdout in chunks instead of buffering")
+    arg_parser.add_argument("--limit", type=int, default=100000)
+    arg_parser.add_argument("--io-log", choices=["delta", "buffers"], default="delta",
+                            help="I/O events logged at INFO: position and value only, or the whole buffers each time")
+    add_geometry_arguments(arg_parser)
+    options = arg_parser.parse_args(args)
+    code_file, input_file = options.code_file, options.input_file
+    geometry = parse_geometry(arg_parser, options)
+    tracer = None
+    if options.trace is not None:
+        tracer = Tracer(TraceLevel[options.trace.upper()], sink=logging.debug)
+
+    code = load_program(code_file)
+    if options.stream:
+        stream_simulation(input_file, code, options.limit, tracer, options.io_log, geometry)
+        return
 
-    code = read_code(code_file)
     input_buffer = []
     with open(input_file, encoding="utf-8") as file:
         input_text = file.read()
@@ -357,7 +686,8 @@ def main(args):
     input_buffer.append("\0")
 
     try:
-        output, ticks, instructions = simulation(input_buffer, code, 100000)
+        output, ticks, instructions = simulation(input_buffer, code, options.limit, tracer=tracer,
+                                                 io_log=make_io_log(options.io_log, input_buffer), geometry=geometry)
         print("Output:", ''.join(output))
         print("Instructions:", instructions)
         print("Ticks:", ticks)
@@ -365,6 +695,31 @@ def main(args):
         logging.error(exception.get_msg())
 
 
+def make_io_log(io_log_format: str, input_buffer):
+    if io_log_format == "buffers" and logging.getLogger().isEnabledFor(logging.INFO):
+        return IoLog(sink=logging.info, render=BufferRenderer(input_buffer))
+    return None
+
+
+# Same report as main, with the output written while the program runs and never held in memory as a whole
+def stream_simulation(input_file: str, code, limit: int, tracer: Tracer = None, io_log_format: str = "delta",
+                      geometry: Geometry = DEFAULT_GEOMETRY):
+    input_stream = MappedInputStream(input_file, terminator="\0")
+    print("Output: ", end="", flush=True)
+    try:
+        _, ticks, instructions = simulation(input_stream, code, limit, tracer=tracer,
+                                            output=OutputSink(sys.stdout.fileno()),
+                                            io_log=make_io_log(io_log_format, input_stream), geometry=geometry)
+        print()
+        print("Instructions:", instructions)
+        print("Ticks:", ticks)
+    except MachineException as exception:
+        print()
+        logging.error(exception.get_msg())
+    finally:
+        input_stream.close()
+
+
 if __name__ == '__main__':
     FORMAT = '%(levelname)s    root:%(module)s:%(funcName)s:%(lineno)d %(message)s'
     logging.basicConfig(format=FORMAT)
@@ -0,0 +1,202 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+from array import array
+
+from src.exceptions import MachineException
+from src.isa import ObjectImage, Opcode, AddressingMode, opcode_by_code, code_by_opcode, mode_by_code, code_by_mode
+from src.machine.config import MEMORY_SIZE, WORD_SIZE, WORD_INIT, PAGE_SIZE, DEFAULT_GEOMETRY, Geometry
+
+PAGE_SHIFT = PAGE_SIZE.bit_length() - 1
+PAGE_MASK = PAGE_SIZE - 1
+
+DATA_CODE = code_by_opcode[Opcode.DATA]
+DIRECT_CODE = code_by_mode[AddressingMode.DIRECT]
+
+
+def word_typecode(word_size: int):
+    return 'i' if word_size <= 32 else 'q'
+
+
+WORD_TYPECODE = word_typecode(WORD_SIZE)
+
+
+# Machine memory kept in parallel typed arrays: opcode codes, addressing mode codes and argument words
+class Memory:
+
+    def __init__(self, program, size: int = MEMORY_SIZE, word_size: int = WORD_SIZE):
+        if len(program) > size:
+            raise MachineException('Program is too large')
+        self.min_word = -2 ** (word_size - 1)
+        self.max_word = 2 ** (word_size - 1) - 1
+        if isinstance(program, ObjectImage):
+            self.check_words(program.args)
+        self.allocate(program, size, word_typecode(word_size))
+
+        # Hot path for operand fetch: a bound C method instead of a Python-level call
+        self.read = self.args.__getitem__
+
+    def allocate(self, program, size: int, typecode: str):
+        if isinstance(program, ObjectImage):
+            # Object file columns are copied as whole slices
+            padding = size - len(program)
+            self.opcodes = bytearray(program.opcodes) + bytearray([DATA_CODE]) * padding
+            self.modes = bytearray(program.modes) + bytearray([DIRECT_CODE]) * padding
+            self.args = array(typecode, program.args) + array(typecode, [WORD_INIT]) * padding
+        else:
+            self.opcodes = bytearray([DATA_CODE]) * size
+            self.modes = bytearray([DIRECT_CODE]) * size
+            self.args = array(typecode, [WORD_INIT]) * size
+            for addr, instr in enumerate(program):
+                self.load(addr, instr)
+
+    def __len__(self):
+        return len(self.args)
+
+    def check_words(self, words):
+        if len(words) and (max(words) > self.max_word or min(words) < self.min_word):
+            raise MachineException('Overflow error!')
+
+    def load(self, addr: int, instr: dict):
+        self.opcodes[addr] = code_by_opcode[instr['opcode']]
+        if 'arg' in instr:
+            self.check_words((instr['arg'],))
+            self.modes[addr] = code_by_mode[instr['arg_mode']]
+            self.args[addr] = instr['arg']
+        else:
+            self.modes[addr] = 0
+            self.args[addr] = WORD_INIT
+
+    # Same effect as ST: the cell becomes a data word in direct mode
+    def write(self, addr: int, val: int):
+        self.args[addr] = val
+        self.opcodes[addr] = DATA_CODE
+        self.modes[addr] = DIRECT_CODE
+
+    # Decoded cell as (opcode, arg, arg_mode); arg and arg_mode are None for unaddressed instructions
+    def fetch(self, addr: int):
+        mode = self.modes[addr]
+        if mode:
+            return opcode_by_code[self.opcodes[addr]], self.args[addr], mode_by_code[mode]
+        return opcode_by_code[self.opcodes[addr]], None, None
+
+    # Cells that may differ from the initial contents: everything past them is still a zero data word
+    def allocated(self):
+        return len(self)
+
+    # Number of cells up to the last one that is not a zero data word
+    def extent(self):
+        used = self.allocated()
+        while used and self.opcodes[used - 1] == DATA_CODE and self.modes[used - 1] == DIRECT_CODE \
+                and self.args[used - 1] == WORD_INIT:
+            used -= 1
+        return used
+
+
+# Sequence of 'size' cells kept in pages that are only allocated on first write; untouched cells read as 'fill'.
+# Indexing behaves as on the flat columns: negative addresses count from the end and the others out of range raise
+# IndexError. Slices come back as the page type.
+class PagedColumn:
+
+    def __init__(self, size: int, fill, make_page):
+        self.size = size
+        self.fill = fill
+        self.make_page = make_page
+        self.blank = make_page()
+        self.pages = {}
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, addr):
+        if isinstance(addr, slice):
+            return self.__slice(*addr.indices(self.size))
+        if addr < 0:
+            addr += self.size
+            if addr < 0:
+                raise IndexError('memory address out of range')
+        elif addr >= self.size:
+            raise IndexError('memory address out of range')
+        page = self.pages.get(addr >> PAGE_SHIFT)
+        return self.fill if page is None else page[addr & PAGE_MASK]
+
+    def __setitem__(self, addr, value):
+        if isinstance(addr, slice):
+            for cell, item in zip(range(*addr.indices(self.size)), value):
+                self[cell] = item
+            return
+        if addr < 0:
+            addr += self.size
+            if addr < 0:
+                raise IndexError('memory address out of range')
+        elif addr >= self.size:
+            raise IndexError('memory address out of range')
+        page = self.pages.get(addr >> PAGE_SHIFT)
+        if page is None:
+            page = self.pages[addr >> PAGE_SHIFT] = self.make_page()
+        page[addr & PAGE_MASK] = value
+
+    # Copies 'values' of the page type into the first cells; pages that would only hold the fill stay unallocated
+    def load(self, values):
+        for start in range(0, len(values), PAGE_SIZE):
+            chunk = values[start:start + PAGE_SIZE]
+            if chunk != self.blank[:len(chunk)]:
+                page = self.pages.get(start >> PAGE_SHIFT)
+                if page is None:
+                    page = self.pages[start >> PAGE_SHIFT] = self.make_page()
+                page[:len(chunk)] = chunk
+
+    def __slice(self, start: int, stop: int, step: int):
+        result = self.blank[:0]
+        if step != 1:
+            result.extend(self[addr] for addr in range(start, stop, step))
+            return result
+        # Whole page runs at once
+        while start < stop:
+            end = min((start | PAGE_MASK) + 1, stop)
+            page = self.pages.get(start >> PAGE_SHIFT, self.blank)
+            result += page[start & PAGE_MASK:(end - 1 & PAGE_MASK) + 1]
+            start = end
+        return result
+
+
+# Memory for large address spaces: the columns of Memory split into pages, so only the pages the program is loaded
+# into and the pages written at run time take space
+class PagedMemory(Memory):
+
+    def allocate(self, program, size: int, typecode: str):
+        self.opcodes = PagedColumn(size, DATA_CODE, lambda: bytearray([DATA_CODE]) * PAGE_SIZE)
+        self.modes = PagedColumn(size, DIRECT_CODE, lambda: bytearray([DIRECT_CODE]) * PAGE_SIZE)
+        self.args = PagedColumn(size, WORD_INIT, lambda: array(typecode, [WORD_INIT]) * PAGE_SIZE)
+        if isinstance(program, ObjectImage):
+            self.opcodes.load(bytearray(program.opcodes))
+            self.modes.load(bytearray(program.modes))
+            self.args.load(array(typecode, program.args))
+        else:
+            for addr, instr in enumerate(program):
+                self.load(addr, instr)
+
+    def allocated(self):
+        pages = set(self.opcodes.pages) | set(self.modes.pages) | set(self.args.pages)
+        return min((max(pages) + 1) * PAGE_SIZE, len(self)) if pages else 0
+
+
+def make_memory(program, geometry: Geometry = DEFAULT_GEOMETRY):
+    memory_class = PagedMemory if geometry.paged else Memory
+    return memory_class(program, geometry.memory_size, geometry.word_size)
+
+
+# Per-cell table of an engine, such as its decoded handlers: a list for flat memories and paged for paged ones, so
+# cells that are never executed cost nothing
+def cell_table(memory: Memory, fill):
+    if isinstance(memory, PagedMemory):
+        return PagedColumn(len(memory), fill, lambda: [fill] * PAGE_SIZE)
+    return [fill] * len(memory)
+
+
+# Per-cell flags of an engine, zero at first
+def flag_table(memory: Memory):
+    if isinstance(memory, PagedMemory):
+        return PagedColumn(len(memory), 0, lambda: bytearray(PAGE_SIZE))
+    return bytearray(len(memory))
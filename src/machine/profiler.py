@@ -0,0 +1,220 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=too-many-instance-attributes
+# pylint: disable=too-many-locals
+
+import argparse
+import bisect
+import os
+import sys
+from array import array
+
+from src.exceptions import MachineException
+from src.isa import AddressingMode, Opcode, code_by_mode, code_by_opcode, opcode_by_code, is_object_file, \
+    read_code, read_object, read_source_map, source_map_file
+from src.machine.costs import fetch_opcodes
+from src.machine.machinery import branch_conditions, simulation
+from src.machine.trace import TraceLevel, branch_codes
+
+HLT_CODE = code_by_opcode[Opcode.HLT]
+ST_CODE = code_by_opcode[Opcode.ST]
+ABSOLUTE_CODE = code_by_mode[AddressingMode.ABSOLUTE]
+RELATIVE_CODE = code_by_mode[AddressingMode.RELATIVE]
+
+fetch_codes = frozenset(code_by_opcode[opcode] for opcode in fetch_opcodes)
+conditions_by_code = {code_by_opcode[opcode]: condition for opcode, condition in branch_conditions.items()}
+
+
+# Execution profile collected through the tracer interface: pass it as the tracer of simulation() or
+# ControlUnit.run. It is called with the state before every instruction, so ticks of an instruction are the
+# difference to the next record, and the memory accesses follow from the instruction and the state it starts in.
+class Profiler:
+
+    def __init__(self):
+        self.level = TraceLevel.INSTRUCTION
+        self.control_unit = None
+        self.counts = array("q")
+        self.ticks = array("q")
+        self.reads = array("q")
+        self.writes = array("q")
+        self.taken = array("q")
+        self.not_taken = array("q")
+        self.opcode_counts = {}
+        self.opcode_ticks = {}
+        self.pending = None  # (pc, opcode code, tick) of the instruction being executed
+
+    def __close(self, tact: int, next_pc):
+        pc, opcode, start = self.pending
+        self.pending = None
+        self.ticks[pc] += tact - start
+        self.opcode_ticks[opcode] = self.opcode_ticks.get(opcode, 0) + tact - start
+        if opcode in branch_codes and next_pc is not None:
+            if next_pc == pc + 1:
+                self.not_taken[pc] += 1
+            else:
+                self.taken[pc] += 1
+
+    def record(self, control_unit):
+        memory = control_unit.memory
+        if self.control_unit is None:
+            self.control_unit = control_unit
+            for counters in (self.counts, self.ticks, self.reads, self.writes, self.taken, self.not_taken):
+                counters.extend([0] * len(memory))
+
+        pc = control_unit.program_counter
+        if self.pending is not None:
+            self.__close(control_unit.tact, pc)
+        # The machine fails on a bad address by itself
+        if not 0 <= pc < len(memory) or memory.opcodes[pc] == HLT_CODE:
+            return
+
+        opcode, mode, arg = memory.opcodes[pc], memory.modes[pc], memory.args[pc]
+        self.pending = (pc, opcode, control_unit.tact)
+        self.counts[pc] += 1
+        self.opcode_counts[opcode] = self.opcode_counts.get(opcode, 0) + 1
+
+        if opcode == ST_CODE:
+            if 0 <= arg < len(memory):
+                self.writes[arg] += 1
+        elif opcode in fetch_codes or (opcode in conditions_by_code and conditions_by_code[opcode](
+                control_unit.zero_flag, control_unit.negative_flag)):
+            if mode in (ABSOLUTE_CODE, RELATIVE_CODE) and 0 <= arg < len(memory):
+                self.reads[arg] += 1
+                if mode == RELATIVE_CODE and 0 <= memory.args[arg] < len(memory):
+                    self.reads[memory.args[arg]] += 1
+
+    # Trace lines are flushed around I/O events; a profile has nothing to render
+    def flush(self):
+        pass
+
+    # Charges the last executed instruction with the ticks up to the end of the run
+    def finish(self):
+        if self.pending is not None:
+            self.__close(self.control_unit.tact, None)
+
+    def instructions(self):
+        self.finish()
+        return sum(self.counts)
+
+    def total_ticks(self):
+        self.finish()
+        return sum(self.ticks)
+
+    # Executed addresses as (pc, count, ticks), the most expensive first
+    def hot_spots(self):
+        self.finish()
+        spots = [(pc, count, self.ticks[pc]) for pc, count in enumerate(self.counts) if count]
+        return sorted(spots, key=lambda spot: (-spot[2], spot[0]))
+
+    # Executed conditional and unconditional jumps as (pc, taken, not taken)
+    def branches(self):
+        self.finish()
+        return [(pc, self.taken[pc], self.not_taken[pc]) for pc in range(len(self.counts))
+                if self.taken[pc] or self.not_taken[pc]]
+
+    # Counts and ticks summed by key(pc); addresses with a None key are left out
+    def aggregate(self, key):
+        self.finish()
+        totals = {}
+        for pc, count in enumerate(self.counts):
+            group = key(pc) if count else None
+            if group is not None:
+                total = totals.setdefault(group, [0, 0])
+                total[0] += count
+                total[1] += self.ticks[pc]
+        return totals
+
+
+# Key function for Profiler.aggregate: the nearest symbol at or before the address, such as a loop label
+def region_of(symbols: dict):
+    addresses = sorted((addr, name) for name, addr in symbols.items())
+    starts = [addr for addr, _ in addresses]
+
+    def key(pc: int):
+        index = bisect.bisect_right(starts, pc) - 1
+        return addresses[index][1] if index >= 0 else None
+    return key
+
+
+def percent(part: int, whole: int):
+    return f"{100 * part / whole:.1f}%" if whole else "-"
+
+
+# Hot-spot report text. With 'symbols' the costs are also summed by code region, with 'lines' ({address: line}) by
+# source line.
+def render_report(profiler: Profiler, symbols: dict = None, lines: dict = None, top: int = 10):
+    total = profiler.total_ticks()
+    report = [f"Profile: {profiler.instructions()} instructions, {total} ticks", "Hot spots:"]
+    memory = profiler.control_unit.memory if profiler.control_unit is not None else None
+    for pc, count, ticks in profiler.hot_spots()[:top]:
+        opcode = opcode_by_code[memory.opcodes[pc]].name
+        report.append(f"  {pc:5} {opcode:5} count {count:8} ticks {ticks:9} {percent(ticks, total):>6}")
+
+    report.append("Opcodes:")
+    for opcode, ticks in sorted(profiler.opcode_ticks.items(), key=lambda item: -item[1]):
+        report.append(f"  {opcode_by_code[opcode].name:5} count {profiler.opcode_counts[opcode]:8} "
+                      f"ticks {ticks:9} {percent(ticks, total):>6}")
+
+    report.append("Branches:")
+    for pc, taken, not_taken in profiler.branches():
+        report.append(f"  {pc:5} taken {taken:8} not taken {not_taken:8} {percent(taken, taken + not_taken):>6}")
+
+    report.append("Memory:")
+    accessed = [(addr, profiler.reads[addr], profiler.writes[addr]) for addr in range(len(profiler.reads))
+                if profiler.reads[addr] or profiler.writes[addr]]
+    for addr, reads, writes in sorted(accessed, key=lambda access: -(access[1] + access[2]))[:top]:
+        report.append(f"  {addr:5} reads {reads:8} writes {writes:8}")
+
+    for title, key in (("Regions:", region_of(symbols) if symbols else None),
+                       ("Source lines:", lines.get if lines else None)):
+        if key is None:
+            continue
+        report.append(title)
+        for group, (count, ticks) in sorted(profiler.aggregate(key).items(), key=lambda item: -item[1][1])[:top]:
+            report.append(f"  {group!s:>12} count {count:8} ticks {ticks:9} {percent(ticks, total):>6}")
+    return report
+
+
+# Program of a code file with its symbols and source lines ({address: line}), which are None when unknown
+def load_annotated_program(code_file: str):
+    # Object files carry the symbol table, which gives the code regions
+    symbols = None
+    if is_object_file(code_file):
+        code = read_object(code_file, with_symbols=True)
+        symbols = code.symbols
+    else:
+        code = read_code(code_file)
+    # A source map written by the translator gives the source lines, and the symbols of JSON programs
+    lines = None
+    if os.path.exists(source_map_file(code_file)):
+        spans, map_symbols = read_source_map(code_file)
+        lines = {addr: span.line for addr, span in spans.items()}
+        symbols = symbols or map_symbols
+    return code, symbols, lines
+
+
+def main(args):
+    arg_parser = argparse.ArgumentParser(prog="profiler.py")
+    arg_parser.add_argument("code_file")
+    arg_parser.add_argument("input_file")
+    arg_parser.add_argument("--limit", type=int, default=100000)
+    arg_parser.add_argument("--top", type=int, default=10, help="rows per report section")
+    options = arg_parser.parse_args(args)
+
+    code, symbols, lines = load_annotated_program(options.code_file)
+    with open(options.input_file, encoding="utf-8") as file:
+        input_buffer = list(file.read()) + ["\0"]
+
+    profiler = Profiler()
+    try:
+        output, _, _ = simulation(input_buffer, code, options.limit, tracer=profiler)
+        print("Output:", ''.join(output))
+    except MachineException as exception:
+        print("Error:", exception.get_msg())
+    if profiler.control_unit is not None:
+        print("\n".join(render_report(profiler, symbols, lines, top=options.top)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
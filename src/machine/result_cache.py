@@ -0,0 +1,88 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+
+import hashlib
+import json
+import os
+
+from src.exceptions import MachineException
+from src.machine.config import DEFAULT_GEOMETRY, Geometry
+from src.machine.machinery import ControlUnit, simulation
+from src.machine.memory import make_memory
+from src.machine.trace import Tracer
+from src.translator.cache import CACHE_ROOT, DEFAULT_CACHE_SIZE, TranslationCache, sources_version
+
+DEFAULT_RESULT_CACHE_DIR = os.path.join(CACHE_ROOT, "al3-results")
+
+# Everything a run depends on besides the memory image, the input, the limit and the geometry. All engines give the
+# results of ControlUnit, so a run on any engine answers for the others, and a change to any of them or to the cost
+# tables they count ticks with makes the entries stale.
+machine_sources = ("isa.py", "machine/config.py", "machine/memory.py", "machine/device.py", "machine/machinery.py",
+                   "machine/costs.py", "machine/trace.py", "machine/compiler.py", "machine/fastforward.py",
+                   "machine/fusion.py", "machine/vector.py")
+
+
+# Hash of the memory a program is loaded into: instruction lists and object images of the same program hash the same
+def image_digest(program, geometry: Geometry = DEFAULT_GEOMETRY):
+    memory = make_memory(program, geometry)
+    used = memory.extent()
+    digest = hashlib.sha256()
+    digest.update(bytes(memory.opcodes[:used]))
+    digest.update(bytes(memory.modes[:used]))
+    digest.update(memory.args[:used].tobytes())
+    return digest.hexdigest()
+
+
+# On-disk cache of simulation results, kept in a translation cache store: the payload is the output list as JSON
+# and the header holds the counters and the error. The machine is deterministic, so a hit stands for the whole run.
+class ResultCache:
+
+    def __init__(self, directory: str = DEFAULT_RESULT_CACHE_DIR, max_size: int = DEFAULT_CACHE_SIZE):
+        self.disk = TranslationCache(directory, max_size)
+
+    @staticmethod
+    def key(program, input_buffer, limit: int, geometry: Geometry = DEFAULT_GEOMETRY):
+        digest = hashlib.sha256(sources_version(machine_sources).encode())
+        digest.update(json.dumps({"limit": limit, "geometry": list(geometry)}, sort_keys=True).encode())
+        digest.update(image_digest(program, geometry).encode())
+        digest.update("".join(input_buffer).encode("utf-8", "surrogatepass"))
+        return digest.hexdigest()
+
+    # (output, ticks, instructions, error) of a cached run or None
+    def lookup(self, key: str):
+        entry = self.disk.load(key)
+        if entry is None:
+            return None
+        payload, header = entry
+        try:
+            return json.loads(payload), header["ticks"], header["instructions"], header["error"]
+        except (ValueError, KeyError):
+            return None
+
+    def record(self, key: str, output: list, ticks: int, instructions: int, error: str):
+        header = {"ticks": ticks, "instructions": instructions, "error": error}
+        self.disk.store(key, json.dumps(output).encode(), header)
+
+
+# simulation() behind a result cache: a hit returns the output and counters or raises the MachineException of the
+# cached run without running anything, a miss runs and records the outcome. Hits are neither traced nor logged.
+def memoized_simulation(cache: ResultCache, input_buffer, instructions, limit: int, engine=ControlUnit,
+                        tracer: Tracer = None, geometry: Geometry = DEFAULT_GEOMETRY):
+    key = cache.key(instructions, input_buffer, limit, geometry)
+    hit = cache.lookup(key)
+    if hit is not None:
+        output, ticks, instr_counter, error = hit
+        if error is not None:
+            raise MachineException(error)
+        return output, ticks, instr_counter
+
+    try:
+        output, ticks, instr_counter = simulation(input_buffer, instructions, limit, engine, tracer, geometry=geometry)
+    except MachineException as exception:
+        cache.record(key, [], None, None, exception.get_msg())
+        raise
+    cache.record(key, output, ticks, instr_counter, None)
+    return output, ticks, instr_counter
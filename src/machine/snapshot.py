@@ -0,0 +1,149 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=too-many-locals
+
+import json
+import struct
+import zlib
+from array import array
+from collections import namedtuple
+
+from src.exceptions import MachineException
+from src.isa import ObjectImage, Opcode, code_by_opcode
+from src.machine.config import DEFAULT_GEOMETRY, Geometry
+from src.machine.device import Device
+from src.machine.machinery import ControlUnit, run_error_message, run_errors
+from src.machine.memory import word_typecode
+from src.machine.trace import IO_CHAR, IO_TEXT, encode_io
+
+SNAPSHOT_MAGIC = b"AL3S"
+SNAPSHOT_VERSION = 2
+
+# Compressed part of a snapshot: version, flags, word size, pc, acc, ar, dr, tick, executed instructions, io kind,
+# io value, memory size, stored cells, then the stored cells as opcode, mode and argument columns and the consumed
+# input and the output as length-prefixed JSON
+snapshot_header = struct.Struct("<HBBqqqqqqBqII")
+snapshot_length = struct.Struct("<I")
+
+NEGATIVE_FLAG = 1
+ZERO_FLAG = 2
+
+IN_CODE = code_by_opcode[Opcode.IN]
+
+
+# Outcome of one continuation of a snapshot; 'error' holds the message of the error a failed run ended with
+class ForkResult(namedtuple("ForkResult", "output ticks instructions error")):
+    pass
+
+
+# Serializes the whole machine state into a compact blob. Only list-backed devices can be saved: streamed input and
+# output are not kept in memory.
+def snapshot(control_unit: ControlUnit, instructions: int = 0):
+    device = control_unit.device
+    if not isinstance(device.input, list) or not isinstance(device.output, list):
+        raise ValueError("Only devices with list input and output can be snapshotted")
+
+    memory = control_unit.memory
+    # Untouched cells at the end of memory are restored as padding
+    used = memory.extent()
+
+    flags = (NEGATIVE_FLAG if control_unit.negative_flag else 0) | (ZERO_FLAG if control_unit.zero_flag else 0)
+    io_kind, io_value = encode_io(device.io)
+    body = bytearray(snapshot_header.pack(
+        SNAPSHOT_VERSION, flags, control_unit.geometry.word_size, control_unit.program_counter, control_unit.acc,
+        control_unit.addr_reg, control_unit.data_reg, control_unit.tact, instructions, io_kind, io_value, len(memory),
+        used))
+    body += memory.opcodes[:used] + memory.modes[:used] + memory.args[:used].tobytes()
+    for values in (device.input[:device.read_ind], device.output):
+        text = json.dumps(values).encode("utf-8")
+        body += snapshot_length.pack(len(text)) + text
+    return SNAPSHOT_MAGIC + zlib.compress(bytes(body))
+
+
+# Rebuilds a machine of the saved geometry from a snapshot on any engine. The device gets the input consumed before the
+# snapshot followed by 'input_buffer', so I/O positions carry on. Returns the control unit and the instructions executed
+# before the snapshot.
+def restore(blob: bytes, input_buffer, engine=ControlUnit, output=None):
+    if blob[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise ValueError("Not a machine snapshot")
+    body = zlib.decompress(blob[len(SNAPSHOT_MAGIC):])
+    version, flags, word_size, program_counter, acc, addr_reg, data_reg, tact, instructions, io_kind, io_value, size, \
+        used = snapshot_header.unpack_from(body)
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {version}")
+
+    offset = snapshot_header.size
+    opcodes = body[offset:offset + used]
+    modes = body[offset + used:offset + 2 * used]
+    offset += 2 * used
+    args = array(word_typecode(word_size))
+    args.frombytes(body[offset:offset + used * args.itemsize])
+    offset += used * args.itemsize
+    consumed, produced = [], []
+    for values in (consumed, produced):
+        (length,) = snapshot_length.unpack_from(body, offset)
+        offset += snapshot_length.size
+        values += json.loads(body[offset:offset + length].decode("utf-8"))
+        offset += length
+
+    device = Device(output)
+    device.load(consumed + list(input_buffer))
+    device.read_ind = len(consumed)
+    for text in produced:
+        device.output.append(text)
+    if io_kind == IO_CHAR:
+        device.io = chr(io_value)
+    elif io_kind == IO_TEXT:
+        device.io = str(io_value)
+    else:
+        device.io = io_value
+
+    control_unit = engine(ObjectImage(opcodes, modes, args), device, Geometry(size, word_size))
+    control_unit.program_counter = program_counter
+    control_unit.acc = acc
+    control_unit.addr_reg = addr_reg
+    control_unit.data_reg = data_reg
+    control_unit.tact = tact
+    control_unit.negative_flag = bool(flags & NEGATIVE_FLAG)
+    control_unit.zero_flag = bool(flags & ZERO_FLAG)
+    return control_unit, instructions
+
+
+# Runs the part of the program that only depends on 'common_input': stops right before the instruction that would
+# read past it, or at HLT. Errors and the instruction limit are handled as in ControlUnit.run.
+def run_prefix(instructions, limit: int, common_input=(), engine=ControlUnit, geometry: Geometry = DEFAULT_GEOMETRY):
+    device = Device()
+    device.load(list(common_input))
+    control_unit = engine(instructions, device, geometry)
+    opcodes = control_unit.memory.opcodes
+    size = len(opcodes)
+
+    instr_counter = 0
+    try:
+        while True:
+            pc = control_unit.program_counter
+            if 0 <= pc < size and opcodes[pc] == IN_CODE and device.read_ind >= len(device.input):
+                break
+            if instr_counter > limit:
+                raise MachineException('Too long execution! Increase limit')
+            control_unit.decode_and_execute_instruction()
+            instr_counter += 1
+    except StopIteration:
+        pass
+
+    return snapshot(control_unit, instr_counter)
+
+
+# Continues one snapshot with every input; the limit counts the instructions executed before the snapshot as well
+def fork(blob: bytes, input_buffers, limit: int, engine=ControlUnit):
+    results = []
+    for input_buffer in input_buffers:
+        control_unit, instructions = restore(blob, input_buffer, engine)
+        try:
+            instructions += control_unit.run(limit - instructions)
+        except run_errors as exception:
+            results.append(ForkResult(None, None, None, run_error_message(exception)))
+            continue
+        results.append(ForkResult(control_unit.device.output, control_unit.tact, instructions, None))
+    return results
@@ -0,0 +1,367 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=too-many-locals
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-return-statements
+
+import argparse
+import math
+import sys
+from collections import namedtuple
+
+from src.isa import AddressingMode, Opcode
+from src.machine.config import START_ADDR, DEFAULT_GEOMETRY, Geometry, add_geometry_arguments, parse_geometry
+from src.machine.costs import conditional_opcodes, instruction_ticks
+from src.machine.fastforward import sign_bound
+from src.machine.machinery import branch_conditions
+from src.machine.memory import make_memory
+from src.machine.profiler import load_annotated_program
+
+# Edge targets that are not blocks: the program halts, or control goes where the analysis cannot follow (indirect
+# jumps and addresses past the program)
+HALT = "halt"
+UNKNOWN = "?"
+
+block_end_opcodes = conditional_opcodes | {Opcode.HLT, Opcode.JUMP, Opcode.LOOP}
+step_signs = {
+    Opcode.ADD: 1,
+    Opcode.SUB: -1
+}
+
+
+# Way out of a basic block with the ticks of the whole block when it is taken
+class Edge(namedtuple("Edge", "target ticks")):
+    pass
+
+
+class BasicBlock(namedtuple("BasicBlock", "start end edges")):
+    pass
+
+
+# Natural loop: 'bound' is the most iterations (back edges taken) per entry, None when unknown, and 'iteration_ticks'
+# the ticks of the most expensive iteration, inner loops included
+class LoopCost(namedtuple("LoopCost", "header body bound inferred iteration_ticks")):
+    pass
+
+
+# 'worst_case' is None when it is unbounded: a loop bound is unknown or control may go where it cannot be followed
+class CostReport(namedtuple("CostReport", "blocks loops worst_case")):
+    pass
+
+
+def basic_blocks(memory, size: int):
+    def target(arg: int, arg_mode: AddressingMode):
+        return arg if arg_mode == AddressingMode.DIRECT and 0 <= arg < size else UNKNOWN
+
+    leaders = {START_ADDR}
+    for addr in range(size):
+        opcode, arg, arg_mode = memory.fetch(addr)
+        if opcode in block_end_opcodes:
+            leaders.add(addr + 1)
+            if opcode is Opcode.LOOP:
+                leaders.add(addr + 2)
+            elif opcode is not Opcode.HLT and arg_mode == AddressingMode.DIRECT:
+                leaders.add(arg)
+
+    blocks = {}
+    for start in sorted(leader for leader in leaders if 0 <= leader < size):
+        ticks = 0
+        addr = start
+        opcode, arg, arg_mode = memory.fetch(addr)
+        while opcode not in block_end_opcodes and addr + 1 < size and addr + 1 not in leaders:
+            ticks += instruction_ticks(opcode, arg_mode)
+            addr += 1
+            opcode, arg, arg_mode = memory.fetch(addr)
+
+        if opcode is Opcode.HLT:
+            edges = (Edge(HALT, ticks),)
+        elif opcode is Opcode.JUMP:
+            edges = (Edge(target(arg, arg_mode), ticks + instruction_ticks(opcode, arg_mode)),)
+        elif opcode is Opcode.LOOP:
+            edges = (Edge(target(addr + 1, AddressingMode.DIRECT), ticks + instruction_ticks(opcode, arg_mode)),
+                     Edge(target(addr + 2, AddressingMode.DIRECT), ticks + instruction_ticks(opcode, arg_mode, True)))
+        elif opcode in conditional_opcodes:
+            edges = (Edge(target(arg, arg_mode), ticks + instruction_ticks(opcode, arg_mode, True)),
+                     Edge(target(addr + 1, AddressingMode.DIRECT), ticks + instruction_ticks(opcode)))
+        else:
+            edges = (Edge(target(addr + 1, AddressingMode.DIRECT), ticks + instruction_ticks(opcode, arg_mode)),)
+        blocks[start] = BasicBlock(start, addr, edges)
+    return blocks
+
+
+def successors(block: BasicBlock, blocks: dict):
+    return [edge.target for edge in block.edges if edge.target in blocks]
+
+
+# Blocks reachable from the entry, in breadth-first order
+def reachable_blocks(blocks: dict, entry: int):
+    seen = {entry}
+    order = [entry]
+    index = 0
+    while index < len(order):
+        for target in successors(blocks[order[index]], blocks):
+            if target not in seen:
+                seen.add(target)
+                order.append(target)
+        index += 1
+    return order
+
+
+def dominators(blocks: dict, entry: int):
+    order = reachable_blocks(blocks, entry)
+    predecessors = {node: [] for node in order}
+    for node in order:
+        for target in successors(blocks[node], blocks):
+            predecessors[target].append(node)
+    everything = frozenset(order)
+    dominated_by = {node: everything for node in order}
+    dominated_by[entry] = frozenset((entry,))
+    changed = True
+    while changed:
+        changed = False
+        for node in order[1:]:
+            sets = [dominated_by[pred] for pred in predecessors[node]]
+            new = frozenset.intersection(*sets) | {node} if sets else frozenset((node,))
+            if new != dominated_by[node]:
+                dominated_by[node] = new
+                changed = True
+    return dominated_by, predecessors
+
+
+# Natural loops as {header: (body, latches)}: loops with the same header are merged, and the latches are the blocks
+# with a back edge to the header
+def natural_loops(blocks: dict, entry: int = START_ADDR):
+    if entry not in blocks:
+        return {}
+    dominated_by, predecessors = dominators(blocks, entry)
+    loops = {}
+    for node in dominated_by:
+        for header in successors(blocks[node], blocks):
+            if header not in dominated_by[node]:
+                continue
+            body, latches = loops.setdefault(header, ({header}, set()))
+            latches.add(node)
+            stack = [node]
+            while stack:
+                member = stack.pop()
+                if member not in body:
+                    body.add(member)
+                    stack.extend(predecessors[member])
+    return {header: (frozenset(body), frozenset(latches)) for header, (body, latches) in loops.items()}
+
+
+# First n >= 0 at which flags of a + c * n satisfy 'exits'; None if they never do
+def first_exit(a: int, c: int, exits):
+    candidates = [0]
+    if c:
+        bound = sign_bound(a, c)
+        if bound is not None:
+            candidates += [bound, bound + 1]
+    for n in candidates:
+        value = a + c * n
+        if exits(value == 0, value < 0):
+            return n
+    return None
+
+
+# Iteration bound of a counted loop as the translator emits 'while' loops: the header block ends with
+#   LD x; CMP k; B<cond> exit
+# where k is an argument or a cell no instruction writes, and the body changes x once per iteration by
+#   LD x; ADD|SUB c; ST x
+# in a block that is on every iteration. Other writes to x have to be constants stored outside of the loop; the loop
+# is entered with one of them or with the loaded value of x. Returns None for any other loop.
+def infer_bound(memory, size: int, blocks: dict, header: int, loops: dict):
+    body, latches = loops[header]
+    block = blocks[header]
+    if block.end - block.start < 2 or len(block.edges) != 2:
+        return None
+    (load, cell, load_mode), (compare, right, right_mode), (branch, _, _) = \
+        [memory.fetch(addr) for addr in range(block.end - 2, block.end + 1)]
+    if load is not Opcode.LD or load_mode != AddressingMode.ABSOLUTE or compare is not Opcode.CMP \
+            or branch not in conditional_opcodes:
+        return None
+    taken, fallen = (edge.target in body for edge in block.edges)
+    if taken == fallen:
+        return None
+    condition = branch_conditions[branch]
+
+    def exits(zero: bool, negative: bool):
+        return condition(zero, negative) != taken
+
+    stores = {}
+    for addr in range(size):
+        opcode, arg, _ = memory.fetch(addr)
+        if opcode is Opcode.ST:
+            stores.setdefault(arg, []).append(addr)
+    if right_mode == AddressingMode.ABSOLUTE and 0 <= right < size and right not in stores:
+        right = memory.args[right]
+    elif right_mode != AddressingMode.DIRECT:
+        return None
+
+    # The block of an instruction and whether it runs once in every iteration of this loop
+    starts = sorted(blocks)
+
+    def block_of(addr: int):
+        for start in reversed(starts):
+            if start <= addr:
+                return blocks[start] if addr <= blocks[start].end else None
+        return None
+    dominated_by, _ = dominators(blocks, START_ADDR)
+    inner = [other for other, (other_body, _) in loops.items() if other != header and other_body < body]
+
+    starts_with = [memory.args[cell]] if 0 <= cell < size else [0]
+    step = None
+    for addr in stores.get(cell, []):
+        holder = block_of(addr)
+        if holder is None or addr - holder.start < 1:
+            return None
+        previous = memory.fetch(addr - 1)
+        if holder.start in body:
+            before = memory.fetch(addr - 2) if addr - holder.start >= 2 else None
+            increment = before == (Opcode.LD, cell, AddressingMode.ABSOLUTE) and previous[0] in step_signs \
+                and previous[2] == AddressingMode.DIRECT
+            if step is not None or not increment:
+                return None
+            if any(holder.start in loops[other][0] for other in inner) \
+                    or not all(holder.start in dominated_by[latch] for latch in latches):
+                return None
+            step = step_signs[previous[0]] * previous[1]
+        elif previous[0] is Opcode.LD and previous[2] == AddressingMode.DIRECT:
+            starts_with.append(previous[1])
+        elif previous[0] is Opcode.CLA:
+            starts_with.append(0)
+        else:
+            return None
+    if step is None:
+        return None
+
+    iterations = [first_exit(start - right, step, exits) for start in starts_with]
+    return None if None in iterations else max(iterations)
+
+
+# Longest distances from 'source' over the edges of 'graph' ({node: [(target, ticks)]}) between 'inside' nodes,
+# not following edges back to 'source'. None if these edges have a cycle.
+def longest_paths(graph: dict, source, inside: set):
+    order = []
+    state = {source: 1}
+    stack = [(source, iter(graph[source]))]
+    while stack:
+        node, edges = stack[-1]
+        for target, _ in edges:
+            if target == source or target not in inside:
+                continue
+            if state.get(target) == 1:
+                return None
+            if target not in state:
+                state[target] = 1
+                stack.append((target, iter(graph[target])))
+                break
+        else:
+            stack.pop()
+            state[node] = 2
+            order.append(node)
+
+    distances = {source: 0}
+    for node in reversed(order):
+        for target, ticks in graph[node]:
+            if target != source and target in inside:
+                distances[target] = max(distances.get(target, -math.inf), distances[node] + ticks)
+    return distances
+
+
+# Per-block costs, loops and the worst-case ticks of a whole run. Loop bounds ({header address: iterations}) override
+# the inferred ones. The analysis takes the code as loaded: instructions that a program writes over are not followed.
+def analyze(program, loop_bounds: dict = None, geometry: Geometry = DEFAULT_GEOMETRY):
+    memory = make_memory(program, geometry)
+    size = len(program)
+    blocks = basic_blocks(memory, size)
+    loops = natural_loops(blocks)
+
+    # Loops are collapsed into their headers from the innermost out, and their exits get the cost of all iterations
+    graph = {start: [(edge.target, edge.ticks) for edge in block.edges] for start, block in blocks.items()}
+    owner = {start: start for start in blocks}
+    costs = []
+    for header in sorted(loops, key=lambda header: len(loops[header][0])):
+        body = {owner[node] for node in loops[header][0]}
+        bound, inferred = (loop_bounds or {}).get(header), False
+        if bound is None:
+            bound = infer_bound(memory, size, blocks, header, loops)
+            inferred = bound is not None
+
+        distances = longest_paths(graph, header, body)
+        iteration = None
+        exits = {}
+        if distances is not None:
+            iteration = max((distance + ticks for node, distance in distances.items() for target, ticks in graph[node]
+                             if target == header), default=None)
+            for node, distance in distances.items():
+                for target, ticks in graph[node]:
+                    if target not in body:
+                        exits[target] = max(exits.get(target, -math.inf), distance + ticks)
+        if iteration == math.inf:
+            iteration = None
+        costs.append(LoopCost(header, loops[header][0], bound, inferred, iteration))
+
+        per_entry = 0 if bound == 0 else math.inf if bound is None or iteration is None else bound * iteration
+        graph[header] = [(target, per_entry + ticks) for target, ticks in exits.items()] or [(UNKNOWN, math.inf)]
+        for node in body - {header}:
+            del graph[node]
+        for node in loops[header][0]:
+            owner[node] = header
+
+    worst_case = None
+    if START_ADDR in graph:
+        distances = longest_paths(graph, START_ADDR, set(graph))
+        if distances is not None:
+            worst_case = max(distance + ticks if target == HALT else math.inf
+                             for node, distance in distances.items() for target, ticks in graph[node]
+                             if target not in graph)
+            worst_case = None if worst_case == math.inf else worst_case
+    return CostReport(blocks, sorted(costs, key=lambda cost: cost.header), worst_case)
+
+
+def render_costs(report: CostReport, symbols: dict = None):
+    names = {addr: name for name, addr in (symbols or {}).items()}
+
+    def label(addr):
+        return f"{addr} ({names[addr]})" if addr in names else str(addr)
+
+    worst_case = "unbounded" if report.worst_case is None else f"{report.worst_case} ticks"
+    lines = [f"Worst case: {worst_case}", "Blocks:"]
+    for block in report.blocks.values():
+        edges = ", ".join(f"-> {label(edge.target)} {edge.ticks}" for edge in block.edges)
+        lines.append(f"  {block.start:5}..{block.end:<5} {edges}")
+    lines.append("Loops:")
+    for loop in report.loops:
+        bound = "unknown" if loop.bound is None else f"{loop.bound}{' (inferred)' if loop.inferred else ''}"
+        iteration = "-" if loop.iteration_ticks is None else loop.iteration_ticks
+        lines.append(f"  {label(loop.header):>12} blocks {len(loop.body):4} bound {bound:>16} "
+                     f"iteration {iteration} ticks")
+    return lines
+
+
+def main(args):
+    arg_parser = argparse.ArgumentParser(prog="tick_analyzer.py")
+    arg_parser.add_argument("code_file")
+    arg_parser.add_argument("--bound", action="append", default=[], metavar="HEADER=N",
+                            help="iterations of the loop at an address or label, instead of the inferred bound")
+    add_geometry_arguments(arg_parser)
+    options = arg_parser.parse_args(args)
+    geometry = parse_geometry(arg_parser, options)
+
+    code, symbols, _ = load_annotated_program(options.code_file)
+    loop_bounds = {}
+    for bound in options.bound:
+        header, _, iterations = bound.partition("=")
+        if header in (symbols or {}):
+            header = symbols[header]
+        try:
+            loop_bounds[int(header)] = int(iterations)
+        except ValueError:
+            arg_parser.error(f"bad loop bound {bound}")
+    print("\n".join(render_costs(analyze(code, loop_bounds, geometry), symbols)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
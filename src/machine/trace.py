@@ -0,0 +1,151 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+
+import enum
+import struct
+from array import array
+
+from src.isa import Opcode, opcode_by_code, mode_by_code, code_by_opcode
+
+
+class TraceLevel(enum.IntEnum):
+    OFF = 0
+    BRANCH = 1
+    INSTRUCTION = 2
+    TICK = 3
+
+
+branch_codes = frozenset(code_by_opcode[opcode] for opcode in (
+    Opcode.JUMP, Opcode.LOOP, Opcode.BEQ, Opcode.BNE, Opcode.BGE, Opcode.BLE, Opcode.BL, Opcode.BG))
+
+# Fixed-size trace record: tick, pc, ar, dr, acc, io value, arg, opcode code, mode code, io kind, flags
+trace_record = struct.Struct("<qqqqqqqBBBB")
+
+IO_INT = 0
+IO_CHAR = 1
+IO_TEXT = 2
+
+NEGATIVE_FLAG = 1
+ZERO_FLAG = 2
+
+
+# The text form used by ControlUnit.__repr__ and by rendered trace records
+def format_state(tick, program_counter, addr_reg, data_reg, acc, io, negative_flag, zero_flag, opcode, arg, arg_mode):
+    state = f"{{TICK: {tick}, PC: {program_counter}, AR: {addr_reg}, DR: {data_reg}" \
+            f", ACC: {acc}, IO: {io}, N: {negative_flag}, Z: {zero_flag}}}"
+    if arg_mode is not None:
+        action = f"{{{opcode}, {arg}, {arg_mode}}}"
+    else:
+        action = f"{{{opcode}}}"
+    return f"{state} {action}"
+
+
+# The IO register holds an int after IN and the printed text after OUTC/OUT
+def encode_io(io):
+    if isinstance(io, int):
+        return IO_INT, io
+    if len(io) == 1:
+        return IO_CHAR, ord(io)
+    return IO_TEXT, int(io)
+
+
+def decode_io(kind: int, value: int):
+    return chr(value) if kind == IO_CHAR else value
+
+
+# Records machine state into a preallocated ring buffer and renders text only on demand.
+# With a sink the buffer is rendered into it whenever it fills up and on flush(); without one it keeps the
+# last 'capacity' records.
+class Tracer:
+
+    def __init__(self, level: TraceLevel = TraceLevel.INSTRUCTION, capacity: int = 4096, sink=None):
+        self.level = level
+        self.capacity = capacity
+        self.sink = sink
+        self.buffer = bytearray(capacity * trace_record.size)
+        self.total = 0
+        self.flushed = 0
+
+    def record(self, control_unit):
+        memory = control_unit.memory
+        pc = control_unit.program_counter
+        io_kind, io_value = encode_io(control_unit.device.io)
+        flags = (NEGATIVE_FLAG if control_unit.negative_flag else 0) | (ZERO_FLAG if control_unit.zero_flag else 0)
+        trace_record.pack_into(self.buffer, (self.total % self.capacity) * trace_record.size,
+                               control_unit.tact, pc, control_unit.addr_reg, control_unit.data_reg, control_unit.acc,
+                               io_value, memory.args[pc], memory.opcodes[pc], memory.modes[pc], io_kind, flags)
+        self.total += 1
+        if self.sink is not None and self.total - self.flushed == self.capacity:
+            self.flush()
+
+    # Buffered records from the oldest one, as tuples in trace_record field order
+    def records(self):
+        count = min(self.total - self.flushed, self.capacity)
+        for index in range(self.total - count, self.total):
+            yield trace_record.unpack_from(self.buffer, (index % self.capacity) * trace_record.size)
+
+    def render(self):
+        for tick, pc, addr_reg, data_reg, acc, io_value, arg, opcode, mode, io_kind, flags in self.records():
+            yield format_state(tick, pc, addr_reg, data_reg, acc, decode_io(io_kind, io_value),
+                               bool(flags & NEGATIVE_FLAG), bool(flags & ZERO_FLAG),
+                               opcode_by_code[opcode], arg, mode_by_code[mode])
+
+    def flush(self):
+        if self.sink is None:
+            return
+        for line in self.render():
+            self.sink(line)
+        self.flushed = self.total
+
+
+IO_INPUT = 0
+IO_OUTPUT = 1
+
+
+# One line per I/O event with only what changed: the buffer position and the value
+def render_io_delta(direction: int, position: int, value):
+    if direction == IO_INPUT:
+        return f"{{input[{position}] >> {value}}}"
+    return f"{{output[{position}] << {value}}}"
+
+
+# Renders events in the original form that shows the whole input and output buffers on every event.
+# The text grows quadratically with the amount of I/O, so it is only meant for short runs such as the golden tests.
+class BufferRenderer:  # pylint: disable=too-few-public-methods
+
+    def __init__(self, input_buffer):
+        self.input_buffer = input_buffer
+        self.output = []
+
+    def __call__(self, direction: int, position: int, value):
+        if direction == IO_INPUT:
+            return f"{{info_buffer: {self.input_buffer} >> {value}}}"
+        self.output.append(value)
+        return f"{{output_buffer: {self.output} << {value}}}"
+
+
+# I/O event log: (direction, position, value) per event. With a sink every event is rendered into it right away.
+class IoLog:
+
+    def __init__(self, sink=None, render=render_io_delta):
+        self.sink = sink
+        self.render = render
+        self.directions = bytearray()
+        self.positions = array("q")
+        self.values = []
+
+    def record(self, direction: int, position: int, value):
+        self.directions.append(direction)
+        self.positions.append(position)
+        self.values.append(value)
+        if self.sink is not None:
+            self.sink(self.render(direction, position, value))
+
+    def events(self):
+        return zip(self.directions, self.positions, self.values)
+
+    def __len__(self):
+        return len(self.values)
@@ -0,0 +1,339 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=too-many-instance-attributes
+
+from collections import namedtuple
+
+from src.exceptions import MachineException
+from src.isa import Opcode, AddressingMode, code_by_opcode, code_by_mode
+from src.machine.config import START_ADDR, DEFAULT_GEOMETRY, PAGED_MEMORY_SIZE, Geometry
+from src.machine.costs import LOOP_SKIP_TICKS, execute_ticks, operand_ticks
+from src.machine.machinery import opcode_to_alu_operation, alu_zero_errors, AluOperation
+from src.machine.memory import make_memory, DATA_CODE, DIRECT_CODE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ABSOLUTE_CODE = code_by_mode[AddressingMode.ABSOLUTE]
+RELATIVE_CODE = code_by_mode[AddressingMode.RELATIVE]
+HLT_CODE = code_by_opcode[Opcode.HLT]
+
+# Same results as the numpy ufuncs with Python int semantics (floor division, modulo with the sign of the divisor)
+alu_ufuncs = {
+    AluOperation.ADD: "add",
+    AluOperation.SUB: "subtract",
+    AluOperation.MUL: "multiply",
+    AluOperation.DIV: "floor_divide",
+    AluOperation.MOD: "mod"
+}
+
+# Branch condition on the (zero, negative) flag arrays
+lane_branch_conditions = {
+    Opcode.BEQ: lambda zero, negative: zero,
+    Opcode.BNE: lambda zero, negative: ~zero,
+    Opcode.BGE: lambda zero, negative: ~negative,
+    Opcode.BLE: lambda zero, negative: zero | negative,
+    Opcode.BL: lambda zero, negative: negative,
+    Opcode.BG: lambda zero, negative: ~(zero | negative)
+}
+
+
+# Outcome of one lane; 'error' holds the exception the scalar simulation would have raised for this input
+class LaneResult(namedtuple("LaneResult", "output ticks instructions error")):
+    pass
+
+
+# Lockstep engine: runs one program over many input streams at once. Every register is a NumPy array with one lane
+# per input and every lane has its own copy of memory, so self-modifying programs stay independent.
+# Each step fetches the current cell of every running lane and executes every opcode once for the lanes that hold it,
+# whatever their PC is; a lane that fails is stopped with the exception ControlUnit would raise and the rest go on.
+# Lane memories are flat, so paged geometries are refused rather than allocated for every lane.
+class LockstepControlUnit:
+
+    def __init__(self, program, input_buffers: list, geometry: Geometry = DEFAULT_GEOMETRY):
+        if np is None:
+            raise ImportError("The lockstep engine requires NumPy")
+        if geometry.paged:
+            raise ValueError(f"The lockstep engine keeps a flat memory per lane and runs memories of up to "
+                             f"{PAGED_MEMORY_SIZE} words, got {geometry.memory_size}")
+
+        memory = make_memory(program, geometry)
+        self.max_word = geometry.max_word
+        self.min_word = geometry.min_word
+        lanes = len(input_buffers)
+        # Products of two words fit into int64 only for words up to 32 bits; wider ones fall back to Python ints
+        register_dtype = np.int64 if geometry.word_size <= 32 else object
+        # Memory is stored cell-major (cell * width + lane), so lanes at the same address touch adjacent words
+        self.opcodes = np.repeat(np.frombuffer(memory.opcodes, dtype=np.uint8), lanes)
+        self.modes = np.repeat(np.frombuffer(memory.modes, dtype=np.uint8), lanes)
+        self.args = np.repeat(np.array(memory.args, dtype=register_dtype), lanes)
+        self.size = len(memory)
+        self.width = lanes
+
+        self.program_counter = np.full(lanes, START_ADDR, dtype=np.int64)
+        self.acc = np.zeros(lanes, dtype=register_dtype)
+        self.addr_reg = np.zeros(lanes, dtype=register_dtype)
+        self.data_reg = np.zeros(lanes, dtype=register_dtype)
+        self.tact = np.zeros(lanes, dtype=np.int64)
+        self.instr_counter = np.zeros(lanes, dtype=np.int64)
+        self.zero_flag = np.zeros(lanes, dtype=bool)
+        self.negative_flag = np.zeros(lanes, dtype=bool)
+        # Argument and mode of the instruction being executed
+        self.arg = np.zeros(lanes, dtype=register_dtype)
+        self.mode = np.zeros(lanes, dtype=np.uint8)
+        # Operand fetch ticks by mode code; code 0 (no argument) fetches nothing
+        self.fetch_ticks = np.zeros(len(code_by_mode) + 1, dtype=np.int64)
+        for mode, ticks in operand_ticks.items():
+            self.fetch_ticks[code_by_mode[mode]] = ticks
+
+        # Input streams as a padded matrix of character codes
+        self.input_length = np.array([len(buffer) for buffer in input_buffers], dtype=np.int64)
+        self.input = np.zeros((lanes, max(self.input_length, default=0)), dtype=np.int64)
+        for lane, buffer in enumerate(input_buffers):
+            self.input[lane, :len(buffer)] = [ord(char) for char in buffer]
+        self.read_ind = np.zeros(lanes, dtype=np.int64)
+        # Output is kept as (lanes, values, as_char) events and turned into per-lane lists at the end
+        self.output_events = []
+
+        self.running = np.ones(lanes, dtype=bool)
+        self.stopped = False
+        self.errors = [None] * lanes
+
+        self.handlers = [self.__data] * len(code_by_opcode)
+        for opcode, handler in (
+                (Opcode.NOP, self.__data),
+                (Opcode.LD, self.__load),
+                (Opcode.ST, self.__store),
+                (Opcode.INC, self.__increment),
+                (Opcode.DEC, self.__decrement),
+                (Opcode.NEG, self.__negate),
+                (Opcode.CLA, self.__clear),
+                (Opcode.IN, self.__input),
+                (Opcode.OUTC, self.__output_char),
+                (Opcode.OUT, self.__output),
+                (Opcode.JUMP, self.__jump),
+                (Opcode.LOOP, self.__loop)):
+            self.handlers[code_by_opcode[opcode]] = handler
+        for opcode, operation in opcode_to_alu_operation.items():
+            self.handlers[code_by_opcode[opcode]] = self.__make_alu(opcode, operation)
+        for opcode, condition in lane_branch_conditions.items():
+            self.handlers[code_by_opcode[opcode]] = self.__make_branch(opcode, condition)
+
+    # Stops the selected lanes with an error and returns the remaining ones
+    def fail(self, lanes, mask, error: Exception):
+        for lane in lanes[mask].tolist():
+            self.errors[lane] = error
+        self.stop(lanes[mask])
+        return lanes[~mask]
+
+    def stop(self, lanes):
+        self.running[lanes] = False
+        self.stopped = True
+
+    def check_value(self, lanes, res):
+        overflow = (res > self.max_word) | (res < self.min_word)
+        if overflow.any():
+            return self.fail(lanes, overflow, MachineException('Overflow error!')), res[~overflow]
+        return lanes, res
+
+    def set_flags(self, lanes, res):
+        self.zero_flag[lanes] = res == 0
+        self.negative_flag[lanes] = res < 0
+
+    # Flat memory indices of (lane, address) pairs; lanes with an address outside of memory fail with 'message'.
+    # Negative addresses wrap around like list indices do in Memory.
+    def cells(self, lanes, addr, message: str):
+        outside = (addr >= self.size) | (addr < -self.size)
+        if outside.any():
+            lanes = self.fail(lanes, outside, IndexError(message))
+            addr = addr[~outside]
+        return lanes, (addr % self.size).astype(np.int64) * self.width + lanes
+
+    def read(self, lanes, addr):
+        lanes, cells = self.cells(lanes, addr, 'array index out of range')
+        return lanes, self.args.take(cells)
+
+    # Ticks of the whole fetch are counted at once, so a lane failing on a read reports the full fetch
+    def operand_fetch(self, lanes):
+        mode = self.mode[lanes]
+        self.tact[lanes] += self.fetch_ticks.take(mode)
+
+        direct = lanes[mode == DIRECT_CODE]
+        self.data_reg[direct] = self.arg[direct]
+
+        indirect = lanes[(mode == ABSOLUTE_CODE) | (mode == RELATIVE_CODE)]
+        if indirect.size:
+            self.addr_reg[indirect] = self.arg[indirect]
+            indirect, values = self.read(indirect, self.addr_reg[indirect])
+            self.data_reg[indirect] = values
+
+            relative = indirect[self.mode[indirect] == RELATIVE_CODE]
+            if relative.size:
+                self.addr_reg[relative] = self.data_reg[relative]
+                relative, values = self.read(relative, self.addr_reg[relative])
+                self.data_reg[relative] = values
+
+        # Lanes without an argument keep their data register
+        return lanes[self.running[lanes]] if self.stopped else lanes
+
+    def next_instruction(self, lanes, ticks: int):
+        self.program_counter[lanes] += 1
+        self.tact[lanes] += ticks
+
+    def __data(self, lanes):
+        self.next_instruction(lanes, execute_ticks[Opcode.DATA])
+
+    def __load(self, lanes):
+        lanes = self.operand_fetch(lanes)
+        res = self.data_reg[lanes]
+        self.set_flags(lanes, res)
+        lanes, res = self.check_value(lanes, res)
+        self.acc[lanes] = res
+        self.next_instruction(lanes, execute_ticks[Opcode.LD])
+
+    def __store(self, lanes):
+        addr = self.arg[lanes]
+        self.addr_reg[lanes] = addr
+        lanes, cells = self.cells(lanes, addr, 'array assignment index out of range')
+        self.args.put(cells, self.acc[lanes])
+        self.opcodes.put(cells, DATA_CODE)
+        self.modes.put(cells, DIRECT_CODE)
+        self.next_instruction(lanes, execute_ticks[Opcode.ST])
+
+    def __make_alu(self, opcode: Opcode, operation: AluOperation):
+        ufunc = getattr(np, alu_ufuncs[operation])
+        zero_error = alu_zero_errors.get(operation)
+        latch = opcode is not Opcode.CMP
+        ticks = execute_ticks[opcode]
+
+        def execute(lanes):
+            lanes = self.operand_fetch(lanes)
+            if zero_error:
+                zero = self.data_reg[lanes] == 0
+                if zero.any():
+                    lanes = self.fail(lanes, zero, MachineException(zero_error))
+            res = ufunc(self.acc[lanes], self.data_reg[lanes])
+            self.set_flags(lanes, res)
+            lanes, res = self.check_value(lanes, res)
+            if latch:
+                self.acc[lanes] = res
+            self.next_instruction(lanes, ticks)
+
+        return execute
+
+    def __accumulate(self, lanes, data: int, ufunc, ticks: int):
+        self.data_reg[lanes] = data
+        res = ufunc(self.acc[lanes], data)
+        self.set_flags(lanes, res)
+        lanes, res = self.check_value(lanes, res)
+        self.acc[lanes] = res
+        self.next_instruction(lanes, ticks)
+
+    def __increment(self, lanes):
+        self.__accumulate(lanes, 1, np.add, execute_ticks[Opcode.INC])
+
+    def __decrement(self, lanes):
+        self.__accumulate(lanes, -1, np.add, execute_ticks[Opcode.DEC])
+
+    def __negate(self, lanes):
+        self.__accumulate(lanes, -1, np.multiply, execute_ticks[Opcode.NEG])
+
+    def __clear(self, lanes):
+        self.acc[lanes] = 0
+        self.next_instruction(lanes, execute_ticks[Opcode.CLA])
+
+    def __input(self, lanes):
+        empty = self.read_ind[lanes] >= self.input_length[lanes]
+        if empty.any():
+            lanes = self.fail(lanes, empty, EOFError("Buffer is empty"))
+        self.acc[lanes] = self.input[lanes, self.read_ind[lanes]]
+        self.read_ind[lanes] += 1
+        self.next_instruction(lanes, execute_ticks[Opcode.IN])
+
+    def __output_char(self, lanes):
+        values = self.acc[lanes]
+        invalid = (values < 0) | (values > 0x10FFFF)
+        if invalid.any():
+            lanes = self.fail(lanes, invalid, ValueError("chr() arg not in range(0x110000)"))
+            values = values[~invalid]
+        self.output_events.append((lanes, values, True))
+        self.next_instruction(lanes, execute_ticks[Opcode.OUTC])
+
+    def __output(self, lanes):
+        self.output_events.append((lanes, self.acc[lanes], False))
+        self.next_instruction(lanes, execute_ticks[Opcode.OUT])
+
+    def __jump(self, lanes):
+        lanes = self.operand_fetch(lanes)
+        self.program_counter[lanes] = self.data_reg[lanes]
+        self.tact[lanes] += execute_ticks[Opcode.JUMP]
+
+    def __loop(self, lanes):
+        lanes = self.operand_fetch(lanes)
+        skip = (self.data_reg[lanes] > 0).astype(np.int64)
+        self.program_counter[lanes] += skip + 1
+        self.tact[lanes] += skip * LOOP_SKIP_TICKS + execute_ticks[Opcode.LOOP]
+
+    def __make_branch(self, opcode: Opcode, condition):
+        ticks = execute_ticks[opcode]
+
+        def execute(lanes):
+            taken = condition(self.zero_flag[lanes], self.negative_flag[lanes])
+            jumping = self.operand_fetch(lanes[taken])
+            self.program_counter[jumping] = self.data_reg[jumping]
+            self.tact[jumping] += ticks
+            self.next_instruction(lanes[~taken], ticks)
+
+        return execute
+
+    # Runs every lane until it halts or fails; 'limit' applies to each lane separately as in ControlUnit.run
+    def run(self, limit: int):
+        handlers = self.handlers
+        lanes = np.flatnonzero(self.running)
+        while lanes.size:
+            exhausted = self.instr_counter[lanes] > limit
+            if exhausted.any():
+                lanes = self.fail(lanes, exhausted, MachineException('Too long execution! Increase limit'))
+            lanes, opcodes = self.__fetch(lanes)
+
+            halted = opcodes == HLT_CODE
+            if halted.any():
+                self.stop(lanes[halted])
+                lanes, opcodes = lanes[~halted], opcodes[~halted]
+            self.instr_counter[lanes] += 1
+
+            codes = np.flatnonzero(np.bincount(opcodes, minlength=len(handlers)))
+            if codes.size == 1:
+                handlers[codes[0]](lanes)
+            else:
+                for code in codes:
+                    handlers[code](lanes[opcodes == code])
+
+            # The set of running lanes is only rebuilt after some of them stopped
+            if self.stopped:
+                self.stopped = False
+                lanes = np.flatnonzero(self.running)
+
+    def __fetch(self, lanes):
+        lanes, cells = self.cells(lanes, self.program_counter[lanes], 'bytearray index out of range')
+        self.arg[lanes] = self.args.take(cells)
+        self.mode[lanes] = self.modes.take(cells)
+        return lanes, self.opcodes.take(cells)
+
+    def results(self):
+        outputs = [[] for _ in self.errors]
+        for lanes, values, as_char in self.output_events:
+            for lane, value in zip(lanes.tolist(), values.tolist()):
+                outputs[lane].append(chr(value) if as_char else str(value))
+        return [LaneResult(output, ticks, instructions, error) for output, ticks, instructions, error
+                in zip(outputs, self.tact.tolist(), self.instr_counter.tolist(), self.errors)]
+
+
+# Lockstep counterpart of machinery.simulation for many input buffers of one program
+def simulate_lanes(input_buffers: list, instructions, limit: int, geometry: Geometry = DEFAULT_GEOMETRY):
+    control_unit = LockstepControlUnit(instructions, input_buffers, geometry)
+    control_unit.run(limit)
+    return control_unit.results()
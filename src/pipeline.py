@@ -0,0 +1,55 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+
+import functools
+from collections import namedtuple
+
+from src.exceptions import TranslationException
+from src.machine.config import DEFAULT_GEOMETRY, Geometry
+from src.machine.machinery import ControlUnit, run_error_message, run_errors, simulation
+from src.machine.result_cache import ResultCache, memoized_simulation
+from src.machine.trace import Tracer, TraceLevel
+from src.translator.lex import RegexLexer
+from src.translator.optimize import optimize as optimize_code
+from src.translator.parse import Parser
+
+
+# Outcome of a pipeline run: the translated code, the output text and the counters. 'error' holds the message of the
+# TranslationException or of the run error that stopped it, and the fields left unknown are None
+class RunResult(namedtuple("RunResult", "code output ticks instructions error")):
+    pass
+
+
+# Instruction list of a source text, as machines load it: nothing is written to or read from files
+def compile_source(source: str, optimize: bool = False, lexer=RegexLexer, geometry: Geometry = DEFAULT_GEOMETRY):
+    code = Parser(lexer(source), geometry).program()
+    if optimize:
+        code, _ = optimize_code(code, geometry)
+    return code
+
+
+# Runs translated code on 'input_text', any iterable of characters; the terminating "\0" is added as machinery.main
+# does. Runs are not traced unless a tracer is given. With a result cache, a run done before is not repeated.
+def run_code(code: list, input_text="", limit: int = 100000, engine=ControlUnit, geometry: Geometry = DEFAULT_GEOMETRY,
+             tracer: Tracer = None, cache: ResultCache = None):
+    run = simulation if cache is None else functools.partial(memoized_simulation, cache)
+    try:
+        output, ticks, instructions = run(list(input_text) + ["\0"], code, limit, engine,
+                                          tracer or Tracer(TraceLevel.OFF), geometry=geometry)
+    except run_errors as exception:
+        return RunResult(code, None, None, None, run_error_message(exception))
+    return RunResult(code, ''.join(output), ticks, instructions, None)
+
+
+# Translates and runs a program in one process: the instruction list goes from the parser to the machine as it is
+def compile_and_run(source: str, input_text="", limit: int = 100000, engine=ControlUnit, optimize: bool = False,
+                    lexer=RegexLexer, geometry: Geometry = DEFAULT_GEOMETRY, tracer: Tracer = None,
+                    cache: ResultCache = None):
+    try:
+        code = compile_source(source, optimize, lexer, geometry)
+    except TranslationException as exception:
+        return RunResult(None, None, None, None, exception.get_msg())
+    return run_code(code, input_text, limit, engine, geometry, tracer, cache)
@@ -0,0 +1,273 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=too-many-instance-attributes
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from src.exceptions import MachineException, TranslationException
+from src.machine.batch import engines
+from src.machine.config import make_geometry, MEMORY_SIZE, WORD_SIZE
+from src.machine.device import Device, OutputSink
+from src.pipeline import compile_source
+
+# Instructions run between two checks for cancellation and the tick limit
+SLICE_SIZE = 20000
+EVENT_CHUNK_SIZE = 4096
+DEFAULT_LIMIT = 100000
+
+TOO_LONG = 'Too long execution! Increase limit'
+CANCELLED = 'Cancelled'
+TICK_LIMIT = 'Tick limit exceeded'
+
+# Events that end a request
+FINAL_EVENTS = ("result", "code", "error")
+
+# Event queue and cancelled request keys shared with the server, set up in every worker process
+_worker = {}
+
+
+# Output sink of a run in a worker: text goes to the server as "output" events of the request
+class EventSink(OutputSink):
+
+    def __init__(self, key: str, events, chunk_size: int = EVENT_CHUNK_SIZE):
+        super().__init__(None, chunk_size)
+        self.key = key
+        self.events = events
+
+    def flush(self):
+        if self.buffer:
+            self.events.put((self.key, {"event": "output", "text": "".join(self.buffer)}))
+        self.written += self.buffered
+        self.buffer = []
+        self.buffered = 0
+
+
+# Runs a machine to HLT as ControlUnit.run(limit) does, in slices of at most 'slice_size' + 1 instructions. A slice
+# ends with the limit error of run(), raised between two instructions, so the next one goes on from the same state.
+# After every slice 'stop' is asked for the reason to give up, if any.
+def run_in_slices(control_unit, limit: int, stop, slice_size: int = SLICE_SIZE):
+    executed = 0
+    while True:
+        budget = min(slice_size, limit - executed)
+        try:
+            return executed + control_unit.run(budget)
+        except MachineException as exception:
+            if exception.get_msg() != TOO_LONG or budget == limit - executed:
+                raise
+        executed += budget + 1
+        reason = stop()
+        if reason is not None:
+            raise MachineException(reason)
+
+
+def _init_worker(events, cancelled):
+    _worker['events'] = events
+    _worker['cancelled'] = cancelled
+
+
+def _execute(key: str, request: dict):
+    geometry = make_geometry(request.get("memory_size", MEMORY_SIZE), request.get("word_size", WORD_SIZE))
+    try:
+        code = compile_source(request["source"], request.get("optimize", False), geometry=geometry)
+    except TranslationException as exception:
+        return {"event": "result", "error": exception.get_msg()}
+    if request["op"] == "compile":
+        return {"event": "code", "code": code}
+
+    sink = EventSink(key, _worker['events'])
+    device = Device(sink)
+    device.load(list(request.get("input", "")) + ["\0"])
+    control_unit = engines[request.get("engine", "interpreter")](code, device, geometry)
+    tick_limit = request.get("tick_limit")
+
+    def stop():
+        sink.flush()
+        if key in _worker['cancelled']:
+            return CANCELLED
+        if tick_limit is not None and control_unit.tact > tick_limit:
+            return TICK_LIMIT
+        return None
+
+    try:
+        instructions = run_in_slices(control_unit, request.get("limit", DEFAULT_LIMIT), stop)
+        reason = stop()
+    except MachineException as exception:
+        instructions, reason = None, exception.get_msg()
+    finally:
+        sink.flush()
+    if reason is not None:
+        return {"event": "result", "error": reason}
+    return {"event": "result", "ticks": control_unit.tact, "instructions": instructions, "error": None}
+
+
+# One request in a worker process. The final event is queued after the output of the run, so the server sends them
+# in order
+def _job(key: str, request: dict):
+    if key in _worker['cancelled']:
+        event = {"event": "result", "error": CANCELLED}
+    else:
+        try:
+            event = _execute(key, request)
+        except KeyError as exception:
+            event = {"event": "error", "error": f"Unknown engine {exception}"}
+        except (ValueError, EOFError) as exception:
+            event = {"event": "error", "error": str(exception)}
+    _worker['events'].put((key, event))
+
+
+# Warm simulation server: the translator and the machine are imported once, and requests run on a pool of worker
+# processes. Clients send one JSON request per line and get JSON events per line, tagged with the 'id' of their
+# request:
+#   {"id": 1, "op": "run", "source": "...", "input": "...", "limit": 100000, "tick_limit": 5000, "engine": "compiled",
+#    "optimize": false, "memory_size": 2048, "word_size": 32}
+#       -> {"id": 1, "event": "output", "text": "..."} while the program runs, then
+#          {"id": 1, "event": "result", "ticks": 274, "instructions": 100, "error": null}
+#   {"id": 2, "op": "compile", "source": "..."} -> {"id": 2, "event": "code", "code": [...]}
+#   {"id": 1, "op": "cancel"} -> the run of request 1 ends with the error "Cancelled"
+# Only "op" and "source" are required. Bad requests are answered with an "error" event. A connection may have many
+# requests in flight; the instruction limit is exact, the tick limit and cancellation are checked between slices.
+class SimulationServer:
+
+    def __init__(self, workers: int = None):
+        self.workers = workers
+        self.manager = None
+        self.events = None
+        self.cancelled = None
+        self.executor = None
+        self.server = None
+        self.pump = None
+        self.path = None
+        self.writers = {}  # request keys and the writers of their connections
+        self.finished = {}  # request keys and the futures done when their final event is sent
+        self.connections = 0
+
+    # Listens on a Unix socket at 'path', or on TCP 'host':'port' (port 0 picks a free one); returns the address
+    async def start(self, path: str = None, host: str = "127.0.0.1", port: int = 0):
+        # Spawned, not forked: forked workers would keep copies of the client sockets open
+        context = multiprocessing.get_context("spawn")
+        self.manager = context.Manager()
+        self.events = self.manager.Queue()
+        self.cancelled = self.manager.dict()
+        self.executor = ProcessPoolExecutor(self.workers, context, _init_worker, (self.events, self.cancelled))
+        # The whole pool starts with the first job, so the workers are warm before the first request
+        await asyncio.get_event_loop().run_in_executor(self.executor, int)
+        self.pump = threading.Thread(target=self.__pump, args=(asyncio.get_event_loop(),), daemon=True)
+        self.pump.start()
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.__serve, path)
+            self.path = path
+            return path
+        self.server = await asyncio.start_server(self.__serve, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        await self.server.serve_forever()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        if self.path is not None:
+            os.unlink(self.path)
+        for key in self.finished:
+            self.cancelled[key] = True
+        self.executor.shutdown(cancel_futures=True)
+        self.events.put(None)
+        await asyncio.get_event_loop().run_in_executor(None, self.pump.join)
+        self.manager.shutdown()
+
+    # Thread that hands the events queued by the workers over to the event loop
+    def __pump(self, loop):
+        while True:
+            item = self.events.get()
+            if item is None:
+                return
+            loop.call_soon_threadsafe(self.__deliver, *item)
+
+    def __deliver(self, key: str, event: dict):
+        if key not in self.writers:
+            return
+        self.__send(self.writers[key], key, event)
+        if event["event"] in FINAL_EVENTS:
+            del self.writers[key]
+            self.finished[key].set_result(None)
+
+    @staticmethod
+    def __send(writer, key: str, event: dict):
+        if not writer.is_closing():
+            request_id = json.loads(key.split(":", 1)[1])
+            writer.write(json.dumps(dict(event, id=request_id)).encode() + b"\n")
+
+    async def __serve(self, reader, writer):
+        self.connections += 1
+        connection = self.connections
+        tasks = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                key = f"{connection}:{json.dumps(request.get('id'))}"
+            except (ValueError, AttributeError):
+                self.__send(writer, "0:null", {"event": "error", "error": "Malformed request"})
+                continue
+            if request.get("op") == "cancel":
+                if key in self.finished:
+                    self.cancelled[key] = True
+            elif key in self.finished:
+                self.__send(writer, key, {"event": "error", "error": "Request id is in use"})
+            elif request.get("op") in ("run", "compile") and isinstance(request.get("source"), str):
+                self.writers[key] = writer
+                self.finished[key] = asyncio.get_event_loop().create_future()
+                tasks.append(asyncio.ensure_future(self.__run(key, request)))
+            else:
+                self.__send(writer, key, {"event": "error", "error": "Unknown request"})
+            await writer.drain()
+
+        await asyncio.gather(*tasks)
+        writer.close()
+
+    async def __run(self, key: str, request: dict):
+        try:
+            await asyncio.get_event_loop().run_in_executor(self.executor, _job, key, request)
+        except Exception as exception:  # pylint: disable=broad-except
+            # The worker died or the pool is shut down: the request ends here, after the events it has queued
+            self.events.put((key, {"event": "error", "error": str(exception) or type(exception).__name__}))
+        await self.finished[key]
+        del self.finished[key]
+        self.cancelled.pop(key, None)
+
+
+async def serve(path: str = None, host: str = "127.0.0.1", port: int = 0, workers: int = None):
+    server = SimulationServer(workers)
+    address = await server.start(path, host, port)
+    print(f"Listening on {address}", flush=True)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+def main(args):
+    arg_parser = argparse.ArgumentParser(prog="server.py")
+    arg_parser.add_argument("--socket", help="Unix socket path; TCP on --host and --port otherwise")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=0)
+    arg_parser.add_argument("--workers", type=int, default=None)
+    options = arg_parser.parse_args(args)
+    try:
+        asyncio.run(serve(options.socket, options.host, options.port, options.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,99 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+import functools
+import hashlib
+import json
+import os
+import tempfile
+
+CACHE_ROOT = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+DEFAULT_CACHE_DIR = os.path.join(CACHE_ROOT, "al3-translator")
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+ENTRY_SUFFIX = ".entry"
+
+# Everything the translator output depends on besides the source and the options
+translator_sources = ("translator/lex.py", "translator/parse.py", "translator/tree.py", "translator/optimize.py",
+                      "isa.py", "machine/config.py")
+
+
+# Hash of source files under src/
+@functools.lru_cache(maxsize=None)
+def sources_version(names: tuple):
+    digest = hashlib.sha256()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for name in names:
+        with open(os.path.join(root, name), "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+# Hash of the translator's own code, so entries made by another version of it are never hit
+def translator_version():
+    return sources_version(translator_sources)
+
+
+# On-disk cache of translated programs. An entry holds the target file contents and a JSON header with the debug
+# info (instruction count and symbols). Hits refresh the modification time, and the least recently used entries are
+# evicted once the cache grows over 'max_size' bytes.
+# The cache is best effort: an unreadable or unwritable directory behaves as an empty cache.
+class TranslationCache:
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_size: int = DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    @staticmethod
+    def key(source: str, options: dict):
+        digest = hashlib.sha256(translator_version().encode())
+        digest.update(json.dumps(options, sort_keys=True).encode())
+        digest.update(source.encode("utf-8"))
+        return digest.hexdigest()
+
+    def __path(self, key: str):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    # (payload, header) of a cached entry or None
+    def load(self, key: str):
+        path = self.__path(key)
+        try:
+            with open(path, "rb") as file:
+                header, payload = file.read().split(b"\n", 1)
+            header = json.loads(header)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return payload, header
+
+    def store(self, key: str, payload: bytes, header: dict):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Written aside and renamed, so concurrent translations never see a partial entry
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as file:
+                file.write(json.dumps(header).encode() + b"\n" + payload)
+            os.replace(temp_path, self.__path(key))
+            self.evict()
+        except OSError:
+            pass
+
+    def entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(ENTRY_SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -4,8 +4,12 @@
 # pylint: disable=too-few-public-methods
 # pylint: disable=too-many-branches
 # pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
 
 import enum
+import re
 
 from src.exceptions import TranslationException
 
@@ -50,17 +54,20 @@ class TokenType(enum.Enum):
 
 
 class Token:
-    def __init__(self, token_text: str, token_kind: TokenType):
+    def __init__(self, token_text: str, token_kind: TokenType, line: int = 0, column: int = 0, end_column: int = 0):
         self.text = token_text  # The token's actual text. Used for identifiers, strings, and numbers
         self.kind = token_kind  # The TokenType that this token is classified as
+        self.line = line  # Position in the source: line and first and last columns, counted from 1
+        self.column = column
+        self.end_column = end_column
 
     @staticmethod
     def check_if_keyword(token_text: str):
-        for kind in TokenType:
-            # Relies on all keyword enum values being 1XX
-            if kind.name == token_text.upper() and 100 <= kind.value < 200:
-                return kind
-        return None
+        return keywords.get(token_text.upper())
+
+
+# Relies on all keyword enum values being 1XX
+keywords = {kind.name: kind for kind in TokenType if 100 <= kind.value < 200}
 
 
 class Lexer:
@@ -68,6 +75,8 @@ class Lexer:
         self.source = inp + '\n'
         self.cur_char = ''
         self.cur_pos = -1
+        self.line = 1
+        self.line_start = 0
         self.__next_char()
 
     def __next_char(self):
@@ -94,6 +103,7 @@ class Lexer:
     def get_token(self):
         self.__skip_whitespace()
         self.__skip_comment()
+        start = self.cur_pos
 
         if self.cur_char == '+':
             if self.__peek() == '=':
@@ -224,5 +234,117 @@ class Lexer:
         else:
             raise TranslationException("Unknown token: " + self.cur_char)
 
+        token.line = self.line
+        token.column = start - self.line_start + 1
+        token.end_column = self.cur_pos - self.line_start + 1
         self.__next_char()
+        if token.kind == TokenType.NEWLINE:
+            self.line += 1
+            self.line_start = self.cur_pos
+        return token
+
+
+operators = {
+    '+': TokenType.PLUS,
+    '+=': TokenType.PLUSEQ,
+    '-': TokenType.MINUS,
+    '-=': TokenType.MINUSEQ,
+    '*': TokenType.ASTERISK,
+    '*=': TokenType.ASTERISKEQ,
+    '/': TokenType.SLASH,
+    '/=': TokenType.SLASHEQ,
+    '%': TokenType.MOD,
+    '%=': TokenType.MODEQ,
+    '=': TokenType.EQ,
+    '==': TokenType.EQEQ,
+    '>': TokenType.GT,
+    '>=': TokenType.GTEQ,
+    '<': TokenType.LT,
+    '<=': TokenType.LTEQ,
+    '!=': TokenType.NOTEQ,
+    '(': TokenType.OPEN_PAREN_ROUND,
+    ')': TokenType.CLOSE_PAREN_ROUND,
+    ',': TokenType.COMMA
+}
+
+# Whitespace and a comment, then one token. Numbers and identifiers only match when they are plain ASCII,
+# anything else is left to the character checks Lexer uses
+token_pattern = re.compile(r"""[ \t\r]*(?://[^\n]*)?(?:
+    (?P<operator>[-+*/%=<>]=?|!=|[(),])
+    | (?P<newline>\n)
+    | (?P<eof>\0)
+    | "(?P<word>[^"\r\n\t\\%]*)"
+    | (?P<number>[0-9]+)(?![^\0-\x7f]|[0-9.])
+    | (?P<ident>[A-Za-z][A-Za-z0-9]*)(?![^\0-\x7f]|[A-Za-z0-9])
+)?""", re.VERBOSE)
+
+
+# Same token stream and errors as Lexer, but each token takes a single match of a compiled regex
+class RegexLexer:
+    def __init__(self, inp: str):
+        self.source = inp + '\n'
+        self.cur_pos = 0
+        self.line = 1
+        self.line_start = 0
+
+    def __scan(self, predicate):
+        start = self.cur_pos
+        while self.cur_pos < len(self.source) and predicate(self.source[self.cur_pos]):
+            self.cur_pos += 1
+        return self.source[start:self.cur_pos]
+
+    # Sets the position of a token that ends right before cur_pos. EOF takes no characters, but is given one column
+    # as Lexer does
+    def __place(self, token: Token, start: int):
+        token.line = self.line
+        token.column = start - self.line_start + 1
+        token.end_column = max(self.cur_pos - self.line_start, token.column)
+        if token.kind == TokenType.NEWLINE:
+            self.line += 1
+            self.line_start = self.cur_pos
         return token
+
+    def get_token(self):
+        match = token_pattern.match(self.source, self.cur_pos)
+        kind = match.lastgroup
+        self.cur_pos = match.end()
+        if kind is not None:
+            # The quotes of a word are outside of its group
+            return self.__place(self.__token(match, kind), match.start(kind) - (kind == 'word'))
+        start = self.cur_pos
+        return self.__place(self.__fallback_token(), start)
+
+    @staticmethod
+    def __token(match, kind: str):
+        if kind == 'ident':
+            tok_text = match.group(kind)
+            return Token(tok_text, keywords.get(tok_text.upper(), TokenType.IDENT))
+        if kind == 'operator':
+            tok_text = match.group(kind)
+            return Token(tok_text, operators[tok_text])
+        if kind == 'newline':
+            return Token('\n', TokenType.NEWLINE)
+        if kind == 'number':
+            return Token(match.group(kind), TokenType.NUMBER)
+        if kind == 'word':
+            return Token(match.group(kind), TokenType.WORD)
+        return Token('', TokenType.EOF)
+
+    # Nothing matched at the current character
+    def __fallback_token(self):
+        if self.cur_pos >= len(self.source):
+            return Token('', TokenType.EOF)
+        char = self.source[self.cur_pos]
+        if char == '!':
+            raise TranslationException("Expected !=, got !" + (self.source[self.cur_pos + 1:self.cur_pos + 2] or '\0'))
+        if char == '\"':
+            raise TranslationException("Illegal character in string")
+        if char.isdigit():
+            tok_text = self.__scan(str.isdigit)
+            if self.source[self.cur_pos:self.cur_pos + 1] == '.':
+                raise TranslationException("Only integers allowed")
+            return Token(tok_text, TokenType.NUMBER)
+        if char.isalpha():
+            tok_text = self.__scan(str.isalnum)
+            return Token(tok_text, keywords.get(tok_text.upper(), TokenType.IDENT))
+        raise TranslationException("Unknown token: " + char)
@@ -0,0 +1,398 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=too-many-instance-attributes
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+
+import operator
+
+from src.isa import AddressingMode, Opcode
+from src.machine.config import DEFAULT_GEOMETRY, Geometry
+
+branch_opcodes = (Opcode.JUMP, Opcode.BEQ, Opcode.BNE, Opcode.BGE, Opcode.BLE, Opcode.BL, Opcode.BG)
+
+alu_opcodes = {
+    Opcode.ADD: operator.add,
+    Opcode.SUB: operator.sub,
+    Opcode.MUL: operator.mul,
+    Opcode.DIV: operator.floordiv,
+    Opcode.MOD: operator.mod,
+    Opcode.CMP: operator.sub
+}
+
+# Instructions that only set ACC and flags and can never fail, so they may go when both are overwritten unread
+removable_acc_opcodes = (Opcode.LD, Opcode.CLA)
+
+ACC = 'acc'
+FLAGS = 'flags'
+
+
+def in_word_range(value: int, geometry: Geometry = DEFAULT_GEOMETRY):
+    return geometry.min_word <= value <= geometry.max_word
+
+
+# Peephole optimizer over translated code. The code starts with data cells followed by instructions; instructions are
+# split into basic blocks and rewritten until nothing changes:
+#  - values are numbered inside a block, so loads of a cell holding a known constant become DIRECT operands, loads of
+#    a copy of another cell read that cell, and loads of the value already in ACC are dropped;
+#  - global liveness of ACC, flags and scalar cells removes stores nobody reads and loads whose result is overwritten;
+#  - jumps and branches to the next instruction are dropped.
+# Scratch cells left without references are removed and all addresses are relocated.
+class Optimizer:
+
+    def __init__(self, code: list, geometry: Geometry = DEFAULT_GEOMETRY):
+        self.code = code
+        self.geometry = geometry
+        self.data_size = 0
+        while self.data_size < len(code) and code[self.data_size]['opcode'] is Opcode.DATA:
+            self.data_size += 1
+        self.data = [dict(cell) for cell in code[:self.data_size]]
+        self.instructions = [dict(instr, origin=addr) for addr, instr in enumerate(code) if addr >= self.data_size]
+        self.scalars = set()
+        self.changed = False
+
+    # Checks the code looks like translator output: direct branches into the code, data accesses into the data.
+    # Anything else (computed jumps, LOOP, self-modification, running off the end) is left alone.
+    def supported(self):
+        # Execution must not run past the end of the code into the memory padding
+        if not self.instructions or self.instructions[-1]['opcode'] is not Opcode.HLT:
+            return False
+        for cell in self.data:
+            if cell.get('arg_mode') is AddressingMode.ABSOLUTE and not 0 <= cell['arg'] < self.data_size:
+                return False
+        for instr in self.instructions:
+            opcode, arg, mode = instr['opcode'], instr.get('arg'), instr.get('arg_mode')
+            if opcode in (Opcode.DATA, Opcode.LOOP):
+                return False
+            if opcode in branch_opcodes:
+                if mode is not AddressingMode.DIRECT or not self.data_size <= arg < len(self.code):
+                    return False
+            elif opcode is Opcode.ST or (arg is not None and mode is not AddressingMode.DIRECT):
+                if not 0 <= arg < self.data_size:
+                    return False
+        return True
+
+    # Scalar cells: accessed only by absolute loads, stores and ALU operands, never through a pointer.
+    # Only their stores may be removed and only they may be dropped from the data.
+    def find_scalars(self):
+        accessed, excluded = set(), set()
+        for cell in self.data:
+            if cell.get('arg_mode') is AddressingMode.ABSOLUTE:
+                # A pointer: its target and everything up to the string terminator may be read through it
+                addr = cell['arg']
+                while 0 <= addr < self.data_size:
+                    excluded.add(addr)
+                    if self.data[addr]['arg'] == 0:
+                        break
+                    addr += 1
+        for instr in self.instructions:
+            if instr['opcode'] in branch_opcodes or 'arg' not in instr:
+                continue
+            if instr['arg_mode'] is AddressingMode.RELATIVE:
+                excluded.add(instr['arg'])
+            elif instr['opcode'] is Opcode.ST or instr['arg_mode'] is AddressingMode.ABSOLUTE:
+                accessed.add(instr['arg'])
+        self.scalars = accessed - excluded
+
+    def link_targets(self):
+        for instr in self.instructions:
+            if instr['opcode'] in branch_opcodes:
+                instr['target'] = self.instructions[instr['arg'] - self.data_size]
+
+    def blocks(self):
+        targets = {id(instr['target']) for instr in self.instructions if 'target' in instr}
+        blocks, block = [], []
+        for instr in self.instructions:
+            if block and id(instr) in targets:
+                blocks.append(block)
+                block = []
+            block.append(instr)
+            if instr['opcode'] in branch_opcodes or instr['opcode'] is Opcode.HLT:
+                blocks.append(block)
+                block = []
+        if block:
+            blocks.append(block)
+        return blocks
+
+    def remove(self, instr: dict):
+        instr['removed'] = True
+        self.changed = True
+
+    def rewrite(self, instr: dict, arg: int, mode: AddressingMode):
+        if instr['arg'] != arg or instr['arg_mode'] is not mode:
+            instr['arg'] = arg
+            instr['arg_mode'] = mode
+            self.changed = True
+
+    # Drops removed instructions; branches to a removed instruction go to the next one that is kept
+    def sweep(self):
+        replacement = {}
+        kept = []
+        following = None
+        for instr in reversed(self.instructions):
+            if instr.get('removed'):
+                replacement[id(instr)] = following
+            else:
+                following = instr
+                kept.append(instr)
+        kept.reverse()
+        for instr in kept:
+            if 'target' in instr:
+                instr['target'] = replacement.get(id(instr['target']), instr['target'])
+        self.instructions = kept
+
+    def number_values(self, block: list):
+        values = ValueTable(self.geometry)
+        acc = values.fresh()
+        flags_from_acc = False
+        for instr in block:
+            opcode, mode = instr['opcode'], instr.get('arg_mode')
+
+            if opcode is Opcode.LD:
+                if mode is AddressingMode.RELATIVE:
+                    value = values.fresh()
+                else:
+                    value = self.fold_operand(instr, values)
+                    if value is None:
+                        value = values.fresh()
+                if value == acc and flags_from_acc:
+                    self.remove(instr)
+                acc, flags_from_acc = value, True
+
+            elif opcode is Opcode.ST:
+                if values.cell(instr['arg']) == acc:
+                    self.remove(instr)
+                values.store(instr['arg'], acc)
+
+            elif opcode in alu_opcodes:
+                operand = None if mode is AddressingMode.RELATIVE else self.fold_operand(instr, values)
+                result = values.fold(alu_opcodes[opcode], acc, operand)
+                if opcode is Opcode.CMP:
+                    zero_operand = operand is not None and values.constant(operand) == 0
+                    if zero_operand and flags_from_acc:
+                        self.remove(instr)
+                    flags_from_acc = zero_operand
+                else:
+                    acc, flags_from_acc = result, True
+
+            elif opcode in (Opcode.INC, Opcode.DEC, Opcode.NEG):
+                acc, flags_from_acc = values.fresh(), True
+
+            elif opcode is Opcode.CLA:
+                acc, flags_from_acc = values.constant_value(0), False
+
+            elif opcode is Opcode.IN:
+                acc, flags_from_acc = values.fresh(), False
+
+    # Rewrites the operand of a load or ALU instruction and returns its value number
+    def fold_operand(self, instr: dict, values):
+        if instr['arg_mode'] is AddressingMode.DIRECT:
+            if not in_word_range(instr['arg'], self.geometry):
+                return None
+            return values.constant_value(instr['arg'])
+
+        value = values.cell(instr['arg'])
+        constant = values.constant(value)
+        if constant is not None:
+            self.rewrite(instr, constant, AddressingMode.DIRECT)
+        else:
+            # A copy is read from the cell it was taken from, which may leave the copy unused
+            home = values.home(value)
+            if home is not None and home != instr['arg']:
+                self.rewrite(instr, home, AddressingMode.ABSOLUTE)
+        return value
+
+    # Per-instruction (uses, definitions) for liveness; only scalar cells are tracked among memory
+    def effects(self, instr: dict):
+        opcode, arg, mode = instr['opcode'], instr.get('arg'), instr.get('arg_mode')
+        operand = {arg} if mode is AddressingMode.ABSOLUTE and arg in self.scalars else set()
+        if opcode is Opcode.LD:
+            return operand, {ACC, FLAGS}
+        if opcode is Opcode.ST:
+            return {ACC}, {arg} & self.scalars
+        if opcode is Opcode.CMP:
+            return operand | {ACC}, {FLAGS}
+        if opcode in alu_opcodes or opcode in (Opcode.INC, Opcode.DEC, Opcode.NEG):
+            return operand | {ACC}, {ACC, FLAGS}
+        if opcode in (Opcode.CLA, Opcode.IN):
+            return set(), {ACC}
+        if opcode in (Opcode.OUT, Opcode.OUTC):
+            return {ACC}, set()
+        if opcode in branch_opcodes and opcode is not Opcode.JUMP:
+            return {FLAGS}, set()
+        return set(), set()
+
+    @staticmethod
+    def successors(blocks: list, starts: dict, index: int):
+        last = blocks[index][-1]
+        result = []
+        if 'target' in last:
+            result.append(starts[id(last['target'])])
+        if last['opcode'] not in (Opcode.JUMP, Opcode.HLT) and index + 1 < len(blocks):
+            result.append(index + 1)
+        return result
+
+    def live_outs(self, blocks: list):
+        starts = {id(block[0]): index for index, block in enumerate(blocks)}
+        successors = [self.successors(blocks, starts, index) for index in range(len(blocks))]
+        live_in = [set() for _ in blocks]
+        changed = True
+        while changed:
+            changed = False
+            for index in reversed(range(len(blocks))):
+                live = set().union(*(live_in[succ] for succ in successors[index]))
+                for instr in reversed(blocks[index]):
+                    uses, defs = self.effects(instr)
+                    live = (live - defs) | uses
+                if live != live_in[index]:
+                    live_in[index] = live
+                    changed = True
+        return [set().union(*(live_in[succ] for succ in successors[index])) for index in range(len(blocks))]
+
+    def eliminate_dead_code(self, block: list, live: set):
+        live = set(live)
+        for instr in reversed(block):
+            uses, defs = self.effects(instr)
+            opcode = instr['opcode']
+            if opcode is Opcode.ST and instr['arg'] in self.scalars and instr['arg'] not in live:
+                self.remove(instr)
+                continue
+            if opcode in removable_acc_opcodes and not defs & live:
+                # Relative loads may fail on a bad pointer and out of range constants on overflow
+                mode = instr.get('arg_mode')
+                if mode is None or mode is AddressingMode.ABSOLUTE or in_word_range(instr['arg'], self.geometry) \
+                        and mode is AddressingMode.DIRECT:
+                    self.remove(instr)
+                    continue
+            if opcode is Opcode.NOP:
+                self.remove(instr)
+                continue
+            live = (live - defs) | uses
+
+    def remove_jumps_to_next(self):
+        for instr, following in zip(self.instructions, self.instructions[1:]):
+            if instr['opcode'] in branch_opcodes and instr['target'] is following:
+                self.remove(instr)
+
+    def run(self):
+        if not self.supported():
+            return None
+        self.find_scalars()
+        self.link_targets()
+
+        self.changed = True
+        while self.changed:
+            self.changed = False
+            for block in self.blocks():
+                self.number_values(block)
+            self.sweep()
+            blocks = self.blocks()
+            for block, live in zip(blocks, self.live_outs(blocks)):
+                self.eliminate_dead_code(block, live)
+            self.sweep()
+            self.remove_jumps_to_next()
+            self.sweep()
+        return self.layout()
+
+    # Final code and the new address of every old one (None for removed data cells)
+    def layout(self):
+        referenced = {instr['arg'] for instr in self.instructions
+                      if 'arg' in instr and instr['opcode'] not in branch_opcodes
+                      and (instr['opcode'] is Opcode.ST or instr['arg_mode'] is not AddressingMode.DIRECT)}
+        relocation = {}
+        data = []
+        for addr, cell in enumerate(self.data):
+            if addr in self.scalars and addr not in referenced:
+                relocation[addr] = None
+            else:
+                relocation[addr] = len(data)
+                data.append(cell)
+
+        # A removed instruction is relocated to the next instruction that is kept
+        new_addr = {instr['origin']: len(data) + index for index, instr in enumerate(self.instructions)}
+        following = len(data) + len(self.instructions)
+        for addr in reversed(range(self.data_size, len(self.code))):
+            following = new_addr.get(addr, following)
+            relocation[addr] = following
+
+        code = []
+        for cell in data:
+            if cell.get('arg_mode') is AddressingMode.ABSOLUTE:
+                cell['arg'] = relocation[cell['arg']]
+            code.append(cell)
+        for instr in self.instructions:
+            instr = dict(instr)
+            instr.pop('removed', None)
+            instr.pop('origin')
+            target = instr.pop('target', None)
+            if target is not None:
+                instr['arg'] = new_addr[target['origin']]
+            elif 'arg' in instr and (instr['opcode'] is Opcode.ST or instr['arg_mode'] is not AddressingMode.DIRECT):
+                instr['arg'] = relocation[instr['arg']]
+            code.append(instr)
+        return code, relocation
+
+
+# Value numbers of ACC and memory cells inside a basic block
+class ValueTable:
+
+    def __init__(self, geometry: Geometry = DEFAULT_GEOMETRY):
+        self.geometry = geometry
+        self.count = 0
+        self.cells = {}
+        self.constants = {}
+        self.numbers = {}
+        self.homes = {}
+
+    def fresh(self):
+        self.count += 1
+        return self.count
+
+    def constant_value(self, constant: int):
+        if constant not in self.numbers:
+            value = self.fresh()
+            self.numbers[constant] = value
+            self.constants[value] = constant
+        return self.numbers[constant]
+
+    def constant(self, value: int):
+        return self.constants.get(value)
+
+    # Value of a cell; a cell read for the first time holds its own value from the block entry
+    def cell(self, addr: int):
+        if addr not in self.cells:
+            value = self.fresh()
+            self.cells[addr] = value
+            self.homes[value] = addr
+        return self.cells[addr]
+
+    def store(self, addr: int, value: int):
+        self.cells[addr] = value
+        self.homes.setdefault(value, addr)
+
+    # The cell that still holds 'value', if there is one
+    def home(self, value: int):
+        addr = self.homes.get(value)
+        if addr is not None and self.cells.get(addr) == value:
+            return addr
+        return None
+
+    # Value number of 'function(acc, operand)'; constants are folded when the machine would not fail on them
+    def fold(self, function, acc: int, operand):
+        left, right = self.constant(acc), None if operand is None else self.constant(operand)
+        if left is None or right is None or (function in (operator.floordiv, operator.mod) and right == 0):
+            return self.fresh()
+        result = function(left, right)
+        return self.constant_value(result) if in_word_range(result, self.geometry) else self.fresh()
+
+
+# Returns the optimized code and the relocation of old addresses (None for removed cells).
+# Code the optimizer does not understand is returned unchanged.
+def optimize(code: list, geometry: Geometry = DEFAULT_GEOMETRY):
+    optimizer = Optimizer(code, geometry)
+    result = optimizer.run()
+    if result is None:
+        return list(code), {addr: addr for addr in range(len(code))}
+    return result
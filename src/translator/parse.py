@@ -8,22 +8,57 @@
 import re
 
 from src.exceptions import TranslationException
-from src.isa import AddressingMode, Opcode, addressed_commands
+from src.isa import AddressingMode, Opcode, SourceSpan, addressed_commands
+from src.machine.config import DEFAULT_GEOMETRY, Geometry
 from src.translator.lex import Lexer, TokenType
+from src.translator.optimize import in_word_range
+from src.translator.tree import Assign, Binary, Comparison, If, Input, Negate, Number, Print, Variable, While, \
+    decide, evaluate, fold, identity_operands, is_constant
+
+# Branch that leaves the block when the comparison is false
+comparison_branches = {
+    "==": Opcode.BNE,
+    "!=": Opcode.BEQ,
+    ">=": Opcode.BL,
+    "<=": Opcode.BG,
+    "<": Opcode.BGE,
+    ">": Opcode.BLE
+}
+
+term_opcodes = {
+    TokenType.ASTERISK: Opcode.MUL,
+    TokenType.SLASH: Opcode.DIV,
+    TokenType.MOD: Opcode.MOD
+}
+
+# None stands for a plain assignment
+assignment_opcodes = {
+    TokenType.EQ: None,
+    TokenType.PLUSEQ: Opcode.ADD,
+    TokenType.MINUSEQ: Opcode.SUB,
+    TokenType.ASTERISKEQ: Opcode.MUL,
+    TokenType.SLASHEQ: Opcode.DIV,
+    TokenType.MODEQ: Opcode.MOD
+}
 
 
 # Parser object keeps track of current token and checks if the code matches the grammar
 class Parser:
-    def __init__(self, lexer: Lexer):
+    def __init__(self, lexer: Lexer, geometry: Geometry = DEFAULT_GEOMETRY):
         self.lexer = lexer
+        self.geometry = geometry  # memory the program has to fit in and word range of its constants
 
         self.integers = {}
         self.strings = {}
         self.loop_ind = 0
         self.if_ind = 0
-        self.exp_ind = 0
+        self.exp_depth = 0  # scratch cells currently in use
         self.instructions = []
-        self.last_comparison_instr = None
+        self.assigned = set()  # integers changed at run time
+        self.constants = {}  # integers that keep their initial values
+        self.declarations = {}  # variables and the spans of their declarations
+        self.spans = []  # spans of the instructions, filled in as statements are generated
+        self.span = None  # span of the statement being generated
 
         self.labels_indx = {}  # labels and their indexes
         self.var_indx = {}  # variables and their indexes
@@ -31,6 +66,7 @@ class Parser:
 
         self.cur_token = None
         self.peek_token = None
+        self.last_token = None
         self.__next_token()
         self.__next_token()
 
@@ -43,6 +79,7 @@ class Parser:
         self.__next_token()
 
     def __next_token(self):
+        self.last_token = self.cur_token
         self.cur_token = self.peek_token
         self.peek_token = self.lexer.get_token()
 
@@ -57,6 +94,14 @@ class Parser:
             TokenType.MINUSEQ) or self.__check_token(
             TokenType.PLUSEQ)
 
+    # Span from the 'first' token to the last one matched
+    def __span(self, first):
+        return SourceSpan(first.line, first.column, self.last_token.line, self.last_token.end_column)
+
+    # Give the instructions generated since the last mark the 'span'
+    def __mark(self, span):
+        self.spans += [span] * (len(self.instructions) - len(self.spans))
+
     @staticmethod
     def loop_begin(number: int):
         return 'loop' + str(number)
@@ -98,16 +143,23 @@ class Parser:
             self.variables.append(
                 {'opcode': Opcode.DATA, 'arg': 0, 'arg_mode': AddressingMode.DIRECT})
 
-    # Create extra variable for data store for the calculation process; put it in Term format to the 'variables' array
-    def __create_exp_op(self):
-        self.exp_ind += 1
-        exp = self.exp_op(self.exp_ind)
-        self.var_indx[exp] = len(self.variables)
-        self.variables.append({'opcode': Opcode.DATA, 'arg': 0, 'arg_mode': AddressingMode.DIRECT})
+    # Take a scratch cell for the calculation process. Intermediate values live from their store to their last load
+    # and those ranges nest, so cells are handed out as a stack: the cell at the current depth is reused, and a new
+    # one is only put in Term format to the 'variables' array when the expression nests deeper than ever before
+    def __acquire_exp_op(self):
+        self.exp_depth += 1
+        exp = self.exp_op(self.exp_depth)
+        if exp not in self.var_indx:
+            self.var_indx[exp] = len(self.variables)
+            self.variables.append({'opcode': Opcode.DATA, 'arg': 0, 'arg_mode': AddressingMode.DIRECT})
         return exp
 
-    def __create_and_save_to_exp_op(self):
-        exp = self.__create_exp_op()
+    # Free the last 'count' acquired cells once their values have been loaded for the last time
+    def __release_exp_op(self, count: int = 1):
+        self.exp_depth -= count
+
+    def __acquire_and_save_to_exp_op(self):
+        exp = self.__acquire_exp_op()
         self.instructions.append({'opcode': Opcode.ST, 'arg': exp, 'arg_mode': AddressingMode.ABSOLUTE})
         return exp
 
@@ -118,6 +170,136 @@ class Parser:
         if exp_res is not None:
             self.instructions.append({'opcode': Opcode.ST, 'arg': exp_res, 'arg_mode': AddressingMode.ABSOLUTE})
 
+    # Operand an instruction can take as it is: an in-range constant or a variable, otherwise None
+    def __operand(self, node):
+        if is_constant(node, self.geometry):
+            return node.value, AddressingMode.DIRECT
+        if isinstance(node, Variable):
+            return node.name, AddressingMode.ABSOLUTE
+        return None
+
+    # Put the value of a folded expression tree to ACC
+    def __generate_value(self, node):
+        if isinstance(node, Number):
+            self.instructions.append({'opcode': Opcode.LD, 'arg': node.value, 'arg_mode': AddressingMode.DIRECT})
+        elif isinstance(node, Variable):
+            self.instructions.append({'opcode': Opcode.LD, 'arg': node.name, 'arg_mode': AddressingMode.ABSOLUTE})
+        elif isinstance(node, Negate):
+            self.__generate_value(node.operand)
+            self.instructions.append({'opcode': Opcode.NEG})
+        else:
+            self.__generate_value(node.left)
+            self.__generate_operation(node.opcode, node.right)
+
+    # Apply 'opcode' to ACC and the value of 'node'. A value that needs code of its own is computed between
+    # two scratch cells: one keeps ACC, the other gets the value
+    def __generate_operation(self, opcode, node):
+        operand = self.__operand(node)
+        if operand is not None:
+            self.instructions.append({'opcode': opcode, 'arg': operand[0], 'arg_mode': operand[1]})
+            return
+        exp1 = self.__acquire_and_save_to_exp_op()
+        self.__generate_value(node)
+        exp2 = self.__acquire_and_save_to_exp_op()
+        self.__create_exp_evaluation(opcode=opcode, exp1=exp1, exp2=exp2, exp_res=None)
+        self.__release_exp_op(2)
+
+    # Leave to 'target' when the condition is false
+    def __generate_condition(self, condition: Comparison, target: str):
+        self.__generate_value(fold(condition.left, self.constants, self.geometry))
+        self.__generate_operation(Opcode.CMP, fold(condition.right, self.constants, self.geometry))
+        self.instructions.append({'opcode': condition.branch, 'arg': target, 'arg_mode': AddressingMode.DIRECT})
+
+    def __generate_block(self, statements: list):
+        for statement in statements:
+            self.__generate_statement(statement)
+
+    # Instructions get the span of the innermost statement they are generated for: the code of an enclosing
+    # statement is marked before the nested ones start and again when they are done
+    def __generate_statement(self, statement):
+        # Declarations have no code
+        if statement is None:
+            return
+        outer = self.span
+        self.__mark(outer)
+        self.span = statement.span
+        self.__generate_statement_code(statement)
+        self.__mark(statement.span)
+        self.span = outer
+
+    def __generate_statement_code(self, statement):
+        if isinstance(statement, Print):
+            if not statement.is_string:
+                self.__generate_value(fold(Variable(statement.ident), self.constants, self.geometry))
+                self.instructions.append({'opcode': statement.output})
+            else:
+                self.loop_ind += 1
+                l_begin = self.loop_begin(self.loop_ind)
+                l_end = self.loop_end(self.loop_ind)
+                ptr = self.mk_ptr(statement.ident)
+                self.labels_indx[l_begin] = len(self.instructions)
+                self.instructions.append({'opcode': Opcode.LD, 'arg': ptr, 'arg_mode': AddressingMode.RELATIVE})
+                self.instructions.append({'opcode': Opcode.BEQ, 'arg': l_end, 'arg_mode': AddressingMode.DIRECT})
+                self.instructions.append({'opcode': statement.output})
+                self.instructions.append({'opcode': Opcode.LD, 'arg': ptr, 'arg_mode': AddressingMode.ABSOLUTE})
+                self.instructions.append({'opcode': Opcode.INC})
+                self.instructions.append({'opcode': Opcode.ST, 'arg': ptr, 'arg_mode': AddressingMode.ABSOLUTE})
+                self.instructions.append({'opcode': Opcode.JUMP, 'arg': l_begin, 'arg_mode': AddressingMode.DIRECT})
+                self.labels_indx[l_end] = len(self.instructions)
+
+        elif isinstance(statement, If):
+            decision = decide(statement.condition, self.constants, self.geometry)
+            # The body of an always false 'if' is unreachable
+            if decision is False:
+                return
+            if decision is None:
+                self.if_ind += 1
+                if_end = self.if_done(self.if_ind)
+                self.__generate_condition(statement.condition, if_end)
+            self.__generate_block(statement.body)
+            if decision is None:
+                self.labels_indx[if_end] = len(self.instructions)
+
+        elif isinstance(statement, While):
+            decision = decide(statement.condition, self.constants, self.geometry)
+            if decision is False:
+                return
+            self.loop_ind += 1
+            l_begin = self.loop_begin(self.loop_ind)
+            l_end = self.loop_end(self.loop_ind)
+            self.labels_indx[l_begin] = len(self.instructions)
+            # An always true loop has no exit check
+            if decision is None:
+                self.__generate_condition(statement.condition, l_end)
+            self.__generate_block(statement.body)
+            self.instructions.append({'opcode': Opcode.JUMP, 'arg': l_begin, 'arg_mode': AddressingMode.DIRECT})
+            self.labels_indx[l_end] = len(self.instructions)
+
+        elif isinstance(statement, Assign):
+            expression = fold(statement.expression, self.constants, self.geometry)
+            if statement.opcode is None:
+                self.__generate_value(expression)
+                self.instructions.append(
+                    {'opcode': Opcode.ST, 'arg': statement.ident, 'arg_mode': AddressingMode.ABSOLUTE})
+            elif is_constant(expression, self.geometry) and identity_operands.get(statement.opcode) == expression.value:
+                # x += 0, x *= 1 and alike change nothing
+                return
+            elif self.__operand(expression) is not None:
+                self.__generate_value(Variable(statement.ident))
+                self.__generate_operation(statement.opcode, expression)
+                self.instructions.append(
+                    {'opcode': Opcode.ST, 'arg': statement.ident, 'arg_mode': AddressingMode.ABSOLUTE})
+            else:
+                self.__generate_value(expression)
+                exp = self.__acquire_and_save_to_exp_op()
+                self.__create_exp_evaluation(opcode=statement.opcode, exp1=statement.ident, exp2=exp,
+                                             exp_res=statement.ident)
+                self.__release_exp_op()
+
+        elif isinstance(statement, Input):
+            self.instructions.append({'opcode': Opcode.IN})
+            self.instructions.append({'opcode': Opcode.ST, 'arg': statement.ident, 'arg_mode': AddressingMode.ABSOLUTE})
+
     # Generate final code in Term format - add variables to the head, change variables and labels to their addresses
     def __generate_machine_code_arr(self):
         self.__add_variables()
@@ -137,20 +319,60 @@ class Parser:
             code.append(instr)
         return code
 
+    # Variables and labels with their final addresses, available after program()
+    def symbols(self):
+        symbols = dict(self.var_indx)
+        for label, indx in self.labels_indx.items():
+            symbols[label] = indx + len(self.variables)
+        return symbols
+
+    # Addresses of the program and the spans they come from, available after program(). Scratch cells and the final
+    # HLT have none; the cells of a variable get the span of its declaration
+    def source_map(self):
+        source_map = {}
+        for var in self.integers:
+            source_map[self.var_indx[var]] = self.declarations[var]
+        for var, value in self.strings.items():
+            for addr in range(self.var_indx[self.mk_ptr(var)], self.var_indx[var] + len(value) + 1):
+                source_map[addr] = self.declarations[var]
+        for indx, span in enumerate(self.spans):
+            if span is not None:
+                source_map[indx + len(self.variables)] = span
+        return source_map
+
     # Production rules.
 
     # <program> ::= {<statement>}
+    # The whole program is parsed into a tree first, so integers that are never assigned or read into are known
+    # to keep their initial values and are folded into the code as constants
     def program(self):
         while self.__check_token(TokenType.NEWLINE):
             self.__next_token()
 
+        statements = []
         while not self.__check_token(TokenType.EOF):
-            self.statement()
+            statements.append(self.statement())
 
+        self.constants = {var: value for var, value in self.integers.items()
+                          if var not in self.assigned and in_word_range(value, self.geometry)}
+        self.__generate_block(statements)
         self.instructions.append({'opcode': Opcode.HLT})
-        return self.__generate_machine_code_arr()
+        self.__mark(None)
+        code = self.__generate_machine_code_arr()
+        if len(code) > self.geometry.memory_size:
+            raise TranslationException(f"Program is too large: {len(code)} words for a memory of "
+                                       f"{self.geometry.memory_size}")
+        # Memory holds words of the configured size only, so an out of range constant could not even be loaded
+        for instr in code:
+            if 'arg' in instr and not in_word_range(instr['arg'], self.geometry):
+                raise TranslationException(f"Constant {instr['arg']} does not fit into a word of "
+                                           f"{self.geometry.word_size} bits")
+        return code
 
+    # <statement> ::= ... <nl>. Returns a statement node, None for declarations
     def statement(self):
+        node = None
+        first = self.cur_token
 
         # "PRINT" "(" "IDENT" "," ["STRING" | "INT"] ")"
         if self.__check_token(TokenType.PRINT):
@@ -164,83 +386,49 @@ class Parser:
             self.__next_token()
             self.__match(TokenType.CLOSE_PAREN_ROUND)
 
-            if ident in self.integers:
-                self.instructions.append({'opcode': Opcode.LD, 'arg': ident, 'arg_mode': AddressingMode.ABSOLUTE})
-                if print_type == TokenType.STRING:
-                    self.instructions.append({'opcode': Opcode.OUTC})
-                elif print_type == TokenType.INT:
-                    self.instructions.append({'opcode': Opcode.OUT})
-                else:
-                    raise TranslationException("Incorrect type in print()")
-
-            elif ident in self.strings:
-                self.loop_ind += 1
-                l_begin = self.loop_begin(self.loop_ind)
-                l_end = self.loop_end(self.loop_ind)
-                ptr = self.mk_ptr(ident)
-                self.labels_indx[l_begin] = len(self.instructions)
-                self.instructions.append({'opcode': Opcode.LD, 'arg': ptr, 'arg_mode': AddressingMode.RELATIVE})
-                self.instructions.append({'opcode': Opcode.BEQ, 'arg': l_end, 'arg_mode': AddressingMode.DIRECT})
-
-                if print_type == TokenType.STRING:
-                    self.instructions.append({'opcode': Opcode.OUTC})
-                elif print_type == TokenType.INT:
-                    self.instructions.append({'opcode': Opcode.OUT})
-                else:
-                    raise TranslationException("Incorrect type in print()")
-                self.instructions.append({'opcode': Opcode.LD, 'arg': ptr, 'arg_mode': AddressingMode.ABSOLUTE})
-                self.instructions.append({'opcode': Opcode.INC})
-                self.instructions.append({'opcode': Opcode.ST, 'arg': ptr, 'arg_mode': AddressingMode.ABSOLUTE})
-                self.instructions.append({'opcode': Opcode.JUMP, 'arg': l_begin, 'arg_mode': AddressingMode.DIRECT})
-                self.labels_indx[l_end] = len(self.instructions)
-
-            else:
+            if ident not in self.integers and ident not in self.strings:
                 raise TranslationException("Invalid operation - try to print not defined variable - " + ident)
+            if print_type == TokenType.STRING:
+                output = Opcode.OUTC
+            elif print_type == TokenType.INT:
+                output = Opcode.OUT
+            else:
+                raise TranslationException("Incorrect type in print()")
+            node = Print(ident, output, ident not in self.integers, self.__span(first))
 
         # "IF" "(" <comparison> ")" <nl> {<statement>} "ENDIF"
         elif self.__check_token(TokenType.IF):
             self.__next_token()
             self.__match(TokenType.OPEN_PAREN_ROUND)
-
-            self.if_ind += 1
-            if_end = self.if_done(self.if_ind)
-
-            self.comparison()
+            condition = self.comparison()
             self.__match(TokenType.CLOSE_PAREN_ROUND)
+            header = self.__span(first)
             self.new_line()
-            opcode = self.last_comparison_instr
-            self.instructions.append({'opcode': opcode, 'arg': if_end, 'arg_mode': AddressingMode.DIRECT})
 
             # Zero or more statements in the body
+            body = []
             while not self.__check_token(TokenType.ENDIF):
-                self.statement()
+                body.append(self.statement())
 
             self.__match(TokenType.ENDIF)
-            self.labels_indx[if_end] = len(self.instructions)
+            node = If(condition, body, header)
 
         # "WHILE" "(" <comparison> ")" <nl> {<statement>} "ENDWHILE"
         elif self.__check_token(TokenType.WHILE):
             self.__next_token()
             self.__match(TokenType.OPEN_PAREN_ROUND)
-
-            self.loop_ind += 1
-            l_begin = self.loop_begin(self.loop_ind)
-            l_end = self.loop_end(self.loop_ind)
-
-            self.labels_indx[l_begin] = len(self.instructions)
-            self.comparison()
+            condition = self.comparison()
             self.__match(TokenType.CLOSE_PAREN_ROUND)
+            header = self.__span(first)
             self.new_line()
-            opcode = self.last_comparison_instr
-            self.instructions.append({'opcode': opcode, 'arg': l_end, 'arg_mode': AddressingMode.DIRECT})
 
             # Zero or more statements in the loop body
+            body = []
             while not self.__check_token(TokenType.ENDWHILE):
-                self.statement()
+                body.append(self.statement())
 
             self.__match(TokenType.ENDWHILE)
-            self.instructions.append({'opcode': Opcode.JUMP, 'arg': l_begin, 'arg_mode': AddressingMode.DIRECT})
-            self.labels_indx[l_end] = len(self.instructions)
+            node = While(condition, body, header)
 
         # "INT" "IDENT" "=" <expression>
         elif self.__check_token(TokenType.INT):
@@ -249,6 +437,7 @@ class Parser:
             self.__match(TokenType.IDENT)
             self.__match(TokenType.EQ)
             self.integers[ident] = self.evaluate_expression()
+            self.declarations[ident] = self.__span(first)
 
         # "STRING" "IDENT" "=" "WORD"
         elif self.__check_token(TokenType.STRING):
@@ -260,6 +449,7 @@ class Parser:
             word = self.cur_token.text
             self.strings[ident] = word
             self.__next_token()
+            self.declarations[ident] = self.__span(first)
 
         # "IDENT" "[ + | - | / | * | % ]=" <expression> (for int only)
         elif self.__check_token(TokenType.IDENT):
@@ -268,23 +458,9 @@ class Parser:
             operator = self.cur_token.kind
             if self.__is_eq_operator():
                 self.__next_token()
-                self.expression()
-                if operator == TokenType.EQ:
-                    self.instructions.append({'opcode': Opcode.ST, 'arg': ident, 'arg_mode': AddressingMode.ABSOLUTE})
-                else:
-                    exp = self.__create_and_save_to_exp_op()
-                    if operator == TokenType.PLUSEQ:
-                        self.__create_exp_evaluation(opcode=Opcode.ADD, exp1=ident, exp2=exp, exp_res=ident)
-                    elif operator == TokenType.MINUSEQ:
-                        self.__create_exp_evaluation(opcode=Opcode.SUB, exp1=ident, exp2=exp, exp_res=ident)
-                    elif operator == TokenType.SLASHEQ:
-                        self.__create_exp_evaluation(opcode=Opcode.DIV, exp1=ident, exp2=exp, exp_res=ident)
-                    elif operator == TokenType.ASTERISKEQ:
-                        self.__create_exp_evaluation(opcode=Opcode.MUL, exp1=ident, exp2=exp, exp_res=ident)
-                    elif operator == TokenType.MODEQ:
-                        self.__create_exp_evaluation(opcode=Opcode.MOD, exp1=ident, exp2=exp, exp_res=ident)
-                    else:
-                        raise TranslationException("Invalid operator in assignment - " + ident)
+                expression = self.expression()
+                node = Assign(ident, assignment_opcodes[operator], expression, self.__span(first))
+                self.assigned.add(ident)
             else:
                 raise TranslationException("Invalid operation " + self.cur_token.text)
 
@@ -299,10 +475,9 @@ class Parser:
                 raise TranslationException("Invalid operation - try to read in not defined variable - " + ident)
 
             self.__match(TokenType.IDENT)
-            self.instructions.append({'opcode': Opcode.IN})
-            self.instructions.append({'opcode': Opcode.ST, 'arg': ident, 'arg_mode': AddressingMode.ABSOLUTE})
-
             self.__match(TokenType.CLOSE_PAREN_ROUND)
+            node = Input(ident, self.__span(first))
+            self.assigned.add(ident)
 
         # This is not a valid statement. Error!
         else:
@@ -311,6 +486,7 @@ class Parser:
 
         # Newline
         self.new_line()
+        return node
 
     # <nl> ::= '\n'+
     def new_line(self):
@@ -320,150 +496,63 @@ class Parser:
 
     # <comparison> ::= <expression> | (<expression> ("==" | "!=" | ">" | ">=" | "<" | "<=") <expression>)
     def comparison(self):
-        self.expression()
+        left = self.expression()
 
         if self.__is_comparison_operator():
-            exp_id1 = self.__create_and_save_to_exp_op()
-            operator = self.cur_token.text
+            branch = comparison_branches[self.cur_token.text]
             self.__next_token()
-            self.expression()
-            exp_id2 = self.__create_and_save_to_exp_op()
-            self.__create_exp_evaluation(opcode=Opcode.CMP, exp1=exp_id1, exp2=exp_id2, exp_res=None)
-            if operator == "==":
-                self.last_comparison_instr = Opcode.BNE
-            elif operator == "!=":
-                self.last_comparison_instr = Opcode.BEQ
-            elif operator == ">=":
-                self.last_comparison_instr = Opcode.BL
-            elif operator == "<=":
-                self.last_comparison_instr = Opcode.BG
-            elif operator == "<":
-                self.last_comparison_instr = Opcode.BGE
-            elif operator == ">":
-                self.last_comparison_instr = Opcode.BLE
-        else:
-            raise TranslationException("Expected comparison operator at: " + self.cur_token.text)
+            return Comparison(branch, left, self.expression())
+        raise TranslationException("Expected comparison operator at: " + self.cur_token.text)
 
     # <expression> ::= <term> {( "-" | "+" ) <term>}
     def expression(self):
-        self.term()
+        node = self.term()
 
         # Can have 0 or more +/- and expressions
-        if self.__check_token(TokenType.PLUS) or self.__check_token(TokenType.MINUS):
-            exp1 = self.__create_exp_op()
-            while self.__check_token(TokenType.PLUS) or self.__check_token(TokenType.MINUS):
-                self.instructions.append({'opcode': Opcode.ST, 'arg': exp1, 'arg_mode': AddressingMode.ABSOLUTE})
-                operator = self.cur_token.text
-                self.__next_token()
-                self.term()
-                exp2 = self.__create_and_save_to_exp_op()
-                if operator == '+':
-                    self.__create_exp_evaluation(opcode=Opcode.ADD, exp1=exp1, exp2=exp2, exp_res=None)
-                elif operator == '-':
-                    self.__create_exp_evaluation(opcode=Opcode.SUB, exp1=exp1, exp2=exp2, exp_res=None)
-
-    def evaluate_expression(self):
-        res = self.evaluate_term()
-
-        # Can have 0 or more +/- and expressions.
         while self.__check_token(TokenType.PLUS) or self.__check_token(TokenType.MINUS):
-            operator = self.cur_token.text
+            opcode = Opcode.ADD if self.__check_token(TokenType.PLUS) else Opcode.SUB
             self.__next_token()
-            term = self.evaluate_term()
-            if operator == '+':
-                res = res + term
-            elif operator == '-':
-                res = res - term
-        return res
+            node = Binary(opcode, node, self.term())
+        return node
+
+    # Value of an 'int' initializer, calculated at compile time
+    def evaluate_expression(self):
+        return evaluate(self.expression(), self.integers)
 
     # <term> ::= <unary> {( "/" | "*" | "%" ) <unary>}
     def term(self):
-        self.unary()
+        node = self.unary()
 
         # Can have 0 or more */% and expressions.
-        if self.__check_token(TokenType.ASTERISK) or self.__check_token(TokenType.SLASH) \
-                or self.__check_token(TokenType.MOD):
-            exp1 = self.__create_exp_op()
-            while self.__check_token(TokenType.ASTERISK) or self.__check_token(TokenType.SLASH) or self.__check_token(
-                    TokenType.MOD):
-                self.instructions.append({'opcode': Opcode.ST, 'arg': exp1, 'arg_mode': AddressingMode.ABSOLUTE})
-                operator = self.cur_token.text
-                self.__next_token()
-                self.unary()
-                exp2 = self.__create_and_save_to_exp_op()
-                if operator == "/":
-                    self.__create_exp_evaluation(opcode=Opcode.DIV, exp1=exp1, exp2=exp2, exp_res=None)
-                elif operator == "*":
-                    self.__create_exp_evaluation(opcode=Opcode.MUL, exp1=exp1, exp2=exp2, exp_res=None)
-                elif operator == '%':
-                    self.__create_exp_evaluation(opcode=Opcode.MOD, exp1=exp1, exp2=exp2, exp_res=None)
-
-    def evaluate_term(self):
-        res = self.evaluate_unary()
-
-        # Can have 0 or more *// and expressions.
         while self.__check_token(TokenType.ASTERISK) or self.__check_token(TokenType.SLASH) or self.__check_token(
                 TokenType.MOD):
-            operator = self.cur_token.text
+            opcode = term_opcodes[self.cur_token.kind]
             self.__next_token()
-            unary = self.evaluate_unary()
-            if operator == "/":
-                res = res // unary
-            elif operator == "*":
-                res = res * unary
-            elif operator == '%':
-                res = res % unary
-        return res
+            node = Binary(opcode, node, self.unary())
+        return node
 
     # <unary> ::= ["+" | "-"] <primary>
     def unary(self):
         # Optional unary +/-
-        token = None
+        negate = False
         if self.__check_token(TokenType.PLUS) or self.__check_token(TokenType.MINUS):
-            if self.__check_token(TokenType.MINUS):
-                token = '-'
+            negate = self.__check_token(TokenType.MINUS)
             self.__next_token()
-        self.primary()
-        if token == '-':
-            self.instructions.append({'opcode': Opcode.NEG})
-
-    def evaluate_unary(self):
-        # Optional unary +/-
-        sign = 1
-        if self.__check_token(TokenType.PLUS) or self.__check_token(TokenType.MINUS):
-            if self.__check_token(TokenType.MINUS):
-                sign = -1
-            self.__next_token()
-        return self.evaluate_primary() * sign
+        node = self.primary()
+        return Negate(node) if negate else node
 
     # <primary> ::= <number> | <ident>
     def primary(self):
         if self.__check_token(TokenType.NUMBER):
-            self.instructions.append(
-                {'opcode': Opcode.LD, 'arg': self.cur_token.text, 'arg_mode': AddressingMode.DIRECT})
-            self.__next_token()
-        elif self.__check_token(TokenType.IDENT):
-            # Ensure the variable already exists.
-            if self.cur_token.text not in self.integers:
-                raise TranslationException("Referencing variable before assignment: " + self.cur_token.text)
-
-            self.instructions.append(
-                {'opcode': Opcode.LD, 'arg': self.cur_token.text, 'arg_mode': AddressingMode.ABSOLUTE})
-            self.__next_token()
-        else:
-            raise TranslationException("Unexpected token at " + self.cur_token.text)
-
-    def evaluate_primary(self):
-        if self.__check_token(TokenType.NUMBER):
-            res = int(self.cur_token.text)
+            node = Number(int(self.cur_token.text))
             self.__next_token()
         elif self.__check_token(TokenType.IDENT):
             # Ensure the variable already exists.
             if self.cur_token.text not in self.integers:
                 raise TranslationException("Referencing variable before assignment: " + self.cur_token.text)
 
-            res = int(self.integers[self.cur_token.text])
+            node = Variable(self.cur_token.text)
             self.__next_token()
         else:
             raise TranslationException("Unexpected token at " + self.cur_token.text)
-        return res
+        return node
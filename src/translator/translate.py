@@ -1,28 +1,98 @@
 # pylint: disable=missing-module-docstring
 # pylint: disable=missing-class-docstring
 # pylint: disable=missing-function-docstring
+# pylint: disable=too-many-locals
+# pylint: disable=too-many-statements
 
+import argparse
 import sys
 
-from src.isa import write_code
-from src.translator.lex import Lexer
+from src.isa import SourceSpan, write_code, write_object, write_source_map
+from src.machine.config import add_geometry_arguments, parse_geometry
+from src.translator.cache import DEFAULT_CACHE_SIZE, TranslationCache
+from src.translator.lex import Lexer, RegexLexer
+from src.translator.optimize import optimize
 from src.translator.parse import Parser, TranslationException
 
+# Object file records hold 32-bit arguments
+OBJECT_WORD_SIZE = 32
+
+lexers = {
+    "regex": RegexLexer,
+    "char": Lexer
+}
+
+
+# Source map of optimized code: merged instructions keep the span of the first one
+def relocate_source_map(source_map: dict, relocation: dict):
+    relocated = {}
+    for addr, span in sorted(source_map.items()):
+        if relocation.get(addr) is not None:
+            relocated.setdefault(relocation[addr], span)
+    return relocated
+
 
 def main(args):
-    assert len(args) == 2, "Wrong arguments: translate.py <input_file> <target_file>"
-    source, target = args
+    arg_parser = argparse.ArgumentParser(prog="translate.py")
+    arg_parser.add_argument("input_file")
+    arg_parser.add_argument("target_file")
+    arg_parser.add_argument("--binary", action="store_true", help="write a binary object file instead of JSON")
+    arg_parser.add_argument("--optimize", action="store_true", help="run the peephole optimizer over the code")
+    arg_parser.add_argument("--lexer", choices=list(lexers), default="regex")
+    arg_parser.add_argument("--source-map", action="store_true",
+                            help="also write the source spans and symbols of the addresses to <target_file>.map")
+    arg_parser.add_argument("--cache-dir", metavar="DIR",
+                            help="reuse translations cached in DIR, and record new ones")
+    arg_parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help="cache size limit in bytes")
+    add_geometry_arguments(arg_parser)
+    options = arg_parser.parse_args(args)
+    source, target = options.input_file, options.target_file
+    geometry = parse_geometry(arg_parser, options)
+    if options.binary and geometry.word_size > OBJECT_WORD_SIZE:
+        arg_parser.error(f"object files hold words of up to {OBJECT_WORD_SIZE} bits")
 
     with open(source, "rt", encoding="utf-8") as file:
         source = file.read()
 
-    lexer = Lexer(source)
-    parser = Parser(lexer)
+    cache = TranslationCache(options.cache_dir, options.cache_size) if options.cache_dir is not None else None
+    key = TranslationCache.key(source, {"binary": options.binary, "optimize": options.optimize, "lexer": options.lexer,
+                                        "source_map": options.source_map, "geometry": list(geometry)})
+    entry = cache.load(key) if cache is not None else None
+    if entry is not None:
+        payload, header = entry
+        print("source LoC:", len(source.split("\n")), "| code instr:", header["instructions"])
+        with open(target, "wb") as file:
+            file.write(payload)
+        if options.source_map:
+            write_source_map(target, {addr: SourceSpan(*span) for addr, *span in header["source_map"]},
+                             header["symbols"])
+        return
+
+    lexer = lexers[options.lexer](source)
+    parser = Parser(lexer, geometry)
 
     try:
         code = parser.program()
+        symbols = parser.symbols()
+        source_map = parser.source_map() if options.source_map else None
+        if options.optimize:
+            code, relocation = optimize(code, geometry)
+            symbols = {name: relocation[addr] for name, addr in symbols.items() if relocation.get(addr) is not None}
+            if source_map is not None:
+                source_map = relocate_source_map(source_map, relocation)
         print("source LoC:", len(source.split("\n")), "| code instr:", len(code))
-        write_code(target, code)
+        if options.binary:
+            write_object(target, code, symbols)
+            if source_map is not None:
+                write_source_map(target, source_map, symbols)
+        else:
+            write_code(target, code, source_map, symbols)
+        if cache is not None:
+            header = {"instructions": len(code), "symbols": symbols}
+            if source_map is not None:
+                header["source_map"] = [[addr, *span] for addr, span in source_map.items()]
+            with open(target, "rb") as file:
+                cache.store(key, file.read(), header)
     except TranslationException as exception:
         print(exception.get_msg())
 
@@ -0,0 +1,135 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=too-many-return-statements
+
+from collections import namedtuple
+
+from src.isa import Opcode
+from src.machine.config import DEFAULT_GEOMETRY, Geometry
+from src.translator.optimize import alu_opcodes, in_word_range
+
+
+# Expression nodes
+class Number(namedtuple("Number", "value")):
+    pass
+
+
+class Variable(namedtuple("Variable", "name")):
+    pass
+
+
+class Negate(namedtuple("Negate", "operand")):
+    pass
+
+
+class Binary(namedtuple("Binary", "opcode left right")):
+    pass
+
+
+# 'branch' is the instruction that leaves the block when the comparison is false
+class Comparison(namedtuple("Comparison", "branch left right")):
+    pass
+
+
+# Statement nodes. 'opcode' of Assign is None for a plain "=", 'output' of Print is OUTC or OUT.
+# 'span' is the SourceSpan of the statement, only of the header line for If and While
+class Print(namedtuple("Print", "ident output is_string span", defaults=(None,))):
+    pass
+
+
+class Input(namedtuple("Input", "ident span", defaults=(None,))):
+    pass
+
+
+class Assign(namedtuple("Assign", "ident opcode expression span", defaults=(None,))):
+    pass
+
+
+class If(namedtuple("If", "condition body span", defaults=(None,))):
+    pass
+
+
+class While(namedtuple("While", "condition body span", defaults=(None,))):
+    pass
+
+
+# When each branch is taken, given the difference CMP computes
+branch_taken = {
+    Opcode.BEQ: lambda diff: diff == 0,
+    Opcode.BNE: lambda diff: diff != 0,
+    Opcode.BGE: lambda diff: diff >= 0,
+    Opcode.BLE: lambda diff: diff <= 0,
+    Opcode.BL: lambda diff: diff < 0,
+    Opcode.BG: lambda diff: diff > 0
+}
+
+# Right operands that leave the left one unchanged
+identity_operands = {
+    Opcode.ADD: 0,
+    Opcode.SUB: 0,
+    Opcode.MUL: 1,
+    Opcode.DIV: 1
+}
+
+
+# A value the machine can hold, so it can be used as a DIRECT operand.
+# Literals out of the word range are kept as they are: loading them fails at run time.
+def is_constant(node, geometry: Geometry = DEFAULT_GEOMETRY):
+    return isinstance(node, Number) and in_word_range(node.value, geometry)
+
+
+# Compile-time value with unbounded Python integers, as used for 'int' initializers
+def evaluate(node, values: dict):
+    if isinstance(node, Number):
+        return node.value
+    if isinstance(node, Variable):
+        return int(values[node.name])
+    if isinstance(node, Negate):
+        return -evaluate(node.operand, values)
+    return alu_opcodes[node.opcode](evaluate(node.left, values), evaluate(node.right, values))
+
+
+# Result of an ALU instruction on constants, or None if the machine would fail on it
+def compute(opcode, left: int, right: int, geometry: Geometry = DEFAULT_GEOMETRY):
+    if opcode in (Opcode.DIV, Opcode.MOD) and right == 0:
+        return None
+    value = alu_opcodes[opcode](left, right)
+    return value if in_word_range(value, geometry) else None
+
+
+# Folds constant subtrees, replacing variables listed in 'constants' by their values.
+# Anything that may fail at run time (overflow, division by zero, out of range literals) is left for the machine.
+def fold(node, constants: dict, geometry: Geometry = DEFAULT_GEOMETRY):
+    if isinstance(node, Variable):
+        return Number(constants[node.name]) if node.name in constants else node
+
+    if isinstance(node, Negate):
+        operand = fold(node.operand, constants, geometry)
+        if is_constant(operand, geometry) and in_word_range(-operand.value, geometry):
+            return Number(-operand.value)
+        return Negate(operand)
+
+    if isinstance(node, Binary):
+        left, right = fold(node.left, constants, geometry), fold(node.right, constants, geometry)
+        if is_constant(left, geometry) and is_constant(right, geometry):
+            value = compute(node.opcode, left.value, right.value, geometry)
+            if value is not None:
+                return Number(value)
+        if is_constant(right, geometry) and identity_operands.get(node.opcode) == right.value:
+            return left
+        if is_constant(left, geometry) and (node.opcode, left.value) in ((Opcode.ADD, 0), (Opcode.MUL, 1)):
+            return right
+        return Binary(node.opcode, left, right)
+
+    return node
+
+
+# Folded comparison: True or False when the outcome is known at compile time, otherwise None
+def decide(condition: Comparison, constants: dict, geometry: Geometry = DEFAULT_GEOMETRY):
+    left, right = fold(condition.left, constants, geometry), fold(condition.right, constants, geometry)
+    if is_constant(left, geometry) and is_constant(right, geometry):
+        diff = compute(Opcode.CMP, left.value, right.value, geometry)
+        if diff is not None:
+            return not branch_taken[condition.branch](diff)
+    return None